@@ -4,17 +4,27 @@ Xử lý ảnh món ăn bằng nhiều models song song
 """
 
 import asyncio
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import hmac
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
-import io
-from typing import Dict, List
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
 import uvicorn
 import numpy as np
 
-from services.model_service import ModelService
+from services.model_service import BASE_VERSION, ModelService
 from services.prediction_service import PredictionService
-from utils.image_processor import ImageProcessor
+from services.admission import AdmissionController, AdmissionRejected, parse_deadline
+from services.cache_service import PredictionCache
+from services.embedding_service import EmbeddingService
+from services.job_queue import JobQueue, QueueFullError, check_callback_url
+from services.metrics import METRICS, REQUEST_SECONDS, REQUESTS_TOTAL, RequestTimer
+from utils.archive import extract_images, is_archive
+from utils.config import env_bool, env_int, env_str
+from utils.image_processor import ImageProcessor, InvalidImageError
+from utils.runtime import get_runtime_stats
 
 app = FastAPI(
     title="Yummy AI Service",
@@ -35,12 +45,64 @@ app.add_middleware(
 model_service = ModelService()
 prediction_service = PredictionService()
 image_processor = ImageProcessor()
+prediction_cache = PredictionCache()
+admission_controller = AdmissionController()
+embedding_service = EmbeddingService(model_service)
 
 # Flags để track loading status (cho Hugging Face Spaces health check)
 models_loading = False
 models_loaded = False
 models_load_error = None
 
+# /predict/batch: giới hạn số ảnh / request và số ảnh decode + infer mỗi đợt
+BATCH_PREDICT_MAX_IMAGES = env_int("BATCH_PREDICT_MAX_IMAGES", 1000)
+BATCH_PREDICT_CHUNK_SIZE = env_int("BATCH_PREDICT_CHUNK_SIZE", 32)
+BATCH_PREDICT_MAX_BYTES = env_int("BATCH_PREDICT_MAX_BYTES", 512 * 1024 * 1024)
+
+# Content-Length tối đa theo endpoint (kiểm tra trước khi nhận / parse multipart);
+# /predict cộng thêm phần overhead của multipart
+UPLOAD_LIMITS = {
+    "/predict": image_processor.max_bytes + 64 * 1024,
+    "/predict/batch": BATCH_PREDICT_MAX_BYTES,
+    "/jobs": image_processor.max_bytes + 64 * 1024,
+    "/embed": image_processor.max_bytes + 64 * 1024,
+}
+
+# Trả timings từng stage qua header Server-Timing (xem được trong DevTools / log của backend)
+SERVER_TIMING_HEADER = env_bool("SERVER_TIMING_HEADER", False)
+
+# Token của admin API (/admin/...); rỗng = tắt admin API
+ADMIN_TOKEN = env_str("ADMIN_TOKEN")
+
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Từ chối upload quá lớn dựa vào Content-Length, trước khi đọc body"""
+    limit = UPLOAD_LIMITS.get(request.url.path)
+    content_length = request.headers.get("content-length", "")
+    if limit and content_length.isdigit() and int(content_length) > limit:
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"Request body too large: {content_length} bytes > {limit} bytes"},
+        )
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Đếm request + đo thời gian theo endpoint (route template, không theo URL thực)"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        REQUESTS_TOTAL.inc(endpoint=endpoint, status=status)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+
 
 async def load_models_background():
     """
@@ -54,15 +116,17 @@ async def load_models_background():
     print("🚀 System: Đang nạp Models vào bộ nhớ (background)...")
     try:
         await model_service.load_all_models()
-        loaded_models = len(model_service.models)
+        loaded_models = len(model_service.get_model_names())
         print(f"✅ System: Đã load {loaded_models} models. Sẵn sàng phục vụ!")
         
-        # Log danh sách models đã load thành công
+        # Log danh sách models đã load thành công (lazy mode: load khi request đầu tiên cần)
         if loaded_models > 0:
-            print(f"📋 Available models: {', '.join(model_service.models.keys())}")
+            print(f"📋 Available models: {', '.join(model_service.get_model_names())}")
         else:
             print("⚠️  Warning: No models loaded! Server may not function correctly.")
         models_loaded = True
+        # Index tham chiếu cho /embed (không có thì /embed chỉ trả embedding)
+        await asyncio.get_event_loop().run_in_executor(None, embedding_service.load_index)
     except RuntimeError as e:
         # RuntimeError được raise khi không có model nào load được
         models_load_error = str(e)
@@ -88,9 +152,18 @@ async def startup():
     """
     # Start loading models trong background task
     asyncio.create_task(load_models_background())
+    # Job queue nhận job ngay cả khi models đang load (job chờ tới khi sẵn sàng)
+    job_queue.start()
     print("✅ Server started. Models loading in background...")
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    """Dừng job workers và inference worker processes (MODEL_WORKERS > 0)"""
+    await job_queue.stop()
+    model_service.shutdown()
+
+
 @app.get("/")
 async def root():
     """Health check endpoint - trả lời ngay cả khi models chưa load"""
@@ -99,7 +172,7 @@ async def root():
         "service": "Yummy AI Service",
         "models_loading": models_loading,
         "models_loaded": models_loaded,
-        "models_count": len(model_service.models) if models_loaded else 0,
+        "models_count": len(model_service.get_model_names()) if models_loaded else 0,
     }
 
 
@@ -111,17 +184,264 @@ async def health_check():
         "models_loading": models_loading,
         "models_loaded": models_loaded,
         "models": model_service.get_models_status() if models_loaded else {},
+        "serving_mode": model_service.serving_mode,
+        "inference_mode": model_service.get_inference_mode(),
+        "runtime": get_runtime_stats(),
+        "precision": model_service.get_precision_stats() if models_loaded else None,
+        "versions": model_service.get_version_stats() if models_loaded else None,
+        "workers": model_service.get_worker_stats(),
+        "registry": model_service.get_registry_stats(),
+        "startup": model_service.get_startup_stats(),
+        "batching": prediction_service.get_batching_stats(),
+        "cache": prediction_cache.get_stats(),
+        "ensemble": prediction_service.get_ensemble_stats(),
+        "jobs": job_queue.get_stats(),
+        "admission": admission_controller.get_stats(),
+        "embeddings": embedding_service.get_stats(),
         "error": models_load_error if models_load_error else None,
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Metrics theo Prometheus text format (histogram từng stage / model, request counters)"""
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+def _cache_namespace(top_k: Optional[int] = None) -> str:
+    """
+    Namespace cache theo ensemble mode + voting method + danh sách models để không trả kết quả
+    cũ khi cấu hình thay đổi; request có top_k khác mặc định được cache riêng
+    """
+    namespace = f"{prediction_service.ensemble_mode}:{','.join(sorted(model_service.get_model_names()))}"
+    # Thứ tự top_k (và margin) phụ thuộc voting method: majority xếp theo vote trước
+    namespace += f":vote-{prediction_service.aggregator.method}"
+    if model_service.fused is not None:
+        # Fused graph resize trong TF (bilinear) thay vì PIL: probability lệch nhẹ
+        namespace += ":fused"
+    reduced = sorted(
+        f"{model_name}={stats['precision']}" for model_name, stats in model_service.precision_stats.items()
+        if stats.get("precision", "float32") != "float32"
+    )
+    if reduced:
+        # Model chạy bfloat16 / float16 cho probability lệch nhẹ so với float32
+        namespace += f":precision-{','.join(reduced)}"
+    versions = sorted(
+        f"{model_name}={version}" for model_name, version in model_service.model_versions.items()
+        if version != BASE_VERSION
+    )
+    if versions:
+        # Hot reload sang version khác không được trả kết quả của version cũ
+        namespace += f":versions-{','.join(versions)}"
+    if prediction_service.tta_mode != "off":
+        namespace += f":tta-{prediction_service.tta_mode}"
+    if top_k is not None:
+        namespace += f":top-{top_k}"
+    return namespace
+
+
+def _check_models_ready():
+    """503 nếu models chưa load xong / load lỗi"""
+    if not models_loaded:
+        if models_loading:
+            raise HTTPException(
+                status_code=503,
+                detail="Models are still loading. Please try again in a few minutes."
+            )
+        else:
+            raise HTTPException(
+                status_code=503,
+                detail=f"Models failed to load. Error: {models_load_error or 'Unknown error'}. Please check server logs."
+            )
+
+
+async def _acquire_models(model_names: Optional[List[str]] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Models + inference callables cho một request (mặc định mọi model), 503 nếu chưa sẵn sàng"""
+    _check_models_ready()
+    models, inference_fns = await model_service.acquire_models(model_names)
+    
+    # Kiểm tra có models không
+    if not models:
+        raise HTTPException(
+            status_code=503,
+            detail="No models available. Please check server logs for model loading errors."
+        )
+    
+    # Đảm bảo prediction_service có class names
+    if not prediction_service.class_names and model_service.class_names:
+        prediction_service.set_class_names(model_service.class_names)
+    return models, inference_fns
+
+
+def _format_response(
+    predictions: Dict[str, Dict[str, Any]],
+    voting_result: Dict[str, Any],
+    top_k: Optional[int] = None,
+    model_versions: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """
+    Format kết quả ensemble theo response mà Node backend đang dùng.
+    top_k: client yêu cầu top-k -> thêm "top_k" (món + probability) ở top level
+    model_versions: version của các model đã chạy request (xem ModelService.get_model_versions)
+    """
+    model_details_formatted = {}
+    for model_name, result in predictions.items():
+        model_details_formatted[model_name] = {
+            "prediction": result.get("prediction", "Unknown"),
+            "confidence": result.get("confidence", 0.0)
+        }
+    
+    response = {
+        "best_match": voting_result["prediction"],
+        "confidence": voting_result["confidence"],
+        "model_details": model_details_formatted,
+        "voting_result": voting_result,
+        "models_run": list(predictions.keys()),
+    }
+    if model_versions:
+        response["model_versions"] = {
+            model_name: model_versions[model_name] for model_name in predictions if model_name in model_versions
+        }
+    if top_k is not None:
+        response["top_k"] = voting_result.get("top_k", [])
+    if any(result.get("tta_views") for result in predictions.values()):
+        response["tta"] = True
+    return response
+
+
+def _cacheable(models: Dict[str, Any], predictions: Dict[str, Dict[str, Any]]) -> bool:
+    """Chỉ cache khi đủ models (không bị bỏ qua vì memory budget) và không model nào lỗi"""
+    all_models_available = model_service.is_full_ensemble(models)
+    return all_models_available and not any("error" in result for result in predictions.values())
+
+
+def _record_model_timings(timer: RequestTimer, predictions: Dict[str, Dict[str, Any]]):
+    """Đưa queue wait / inference của từng model vào Server-Timing (histogram đã ghi trong PredictionService)"""
+    for model_name, result in predictions.items():
+        timing = result.get("timing") or {}
+        if timing.get("queue_ms") is not None:
+            timer.record(f"queue_{model_name}", timing["queue_ms"] / 1000, observe=False)
+        if timing.get("inference_ms") is not None:
+            timer.record(f"model_{model_name}", timing["inference_ms"] / 1000, observe=False)
+
+
+async def _predict_image(
+    image_bytes: bytes,
+    timer: RequestTimer,
+    deadline: Optional[float] = None,
+    from_job: bool = False,
+    top_k: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Pipeline của /predict (dùng chung với job queue) cho một ảnh đã qua check_upload:
+    cache lookup -> parse header -> admission -> chạy models -> vote -> cache store.
+    
+    deadline: thời điểm (time.time()) client thôi chờ; quá deadline thì bỏ trước inference.
+    from_job: job đã được giới hạn bởi job queue và không bị timeout nên không bị
+    shed khi queue đầy và luôn chạy đủ models.
+    top_k: số món (kèm probability) trả về trong "top_k"; None = chỉ voting_result mặc định.
+    
+    Raises:
+        HTTPException: ảnh không hợp lệ (400 / 413), models chưa sẵn sàng / quá tải (503),
+        quá deadline (504)
+    """
+    # Cache theo nội dung ảnh: user scan lại cùng ảnh / backend retry khi timeout
+    # Namespace theo ensemble mode + danh sách models để không trả kết quả cũ khi cấu hình thay đổi
+    with timer.stage("cache_lookup"):
+        cached_result, cache_keys = prediction_cache.lookup(image_bytes, _cache_namespace(top_k))
+    if cached_result is not None:
+        return {**cached_result, "cached": True}
+    
+    # Chỉ parse header (format, kích thước) - pixel được decode đúng một lần
+    # trong preprocess (JPEG dùng draft mode để downscale ngay khi decode)
+    try:
+        with timer.stage("validate"):
+            image = image_processor.open_image(image_bytes)
+    except InvalidImageError as e:
+        print(f"❌ Rejected image: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    print(f"✅ Image header OK - Format: {image.format}, Size: {image.size}")
+    
+    if prediction_cache.use_perceptual_hash and cache_keys:
+        # dHash decode ảnh: sau validate (MAX_IMAGE_PIXELS) và trong thread pool
+        with timer.stage("cache_phash"):
+            cached_result = await asyncio.get_event_loop().run_in_executor(
+                None, _perceptual_lookup, image_bytes, cache_keys, _cache_namespace(top_k)
+            )
+        if cached_result is not None:
+            image.close()
+            return {**cached_result, "cached": True}
+    
+    # Admission control: giới hạn số request chạy models cùng lúc (tensor đã decode
+    # chiếm RAM), quá tải thì chạy ít model hơn thay vì để client timeout
+    all_model_names = model_service.get_model_names()
+    can_degrade = not from_job and len(all_model_names) > admission_controller.degraded_model_count
+    try:
+        async with admission_controller.admit(deadline, can_degrade=can_degrade, sheddable=not from_job) as admission:
+            model_names = None
+            if admission.degraded:
+                model_names = admission_controller.degraded_models(all_model_names, prediction_service.cascade_order)
+                print(f"🚦 Degraded ({admission.reason}): running {', '.join(model_names)}")
+            
+            # 2-3. Kiểm tra models đã load chưa (lazy mode: load model chưa có trong RAM)
+            models, inference_fns = await _acquire_models(model_names)
+            
+            # 4. Chạy tất cả models song song (parallel inference)
+            # Image sẽ được preprocess riêng cho từng model trong prediction_service
+            stage_timings: Dict[str, float] = {}
+            inference_start = time.perf_counter()
+            try:
+                predictions = await prediction_service.predict_all_models(
+                    image,  # Truyền PIL Image gốc (chưa decode)
+                    models,
+                    image_processor,
+                    inference_fns=inference_fns,
+                    timings=stage_timings,
+                )
+            except InvalidImageError as e:
+                # Header hợp lệ nhưng dữ liệu ảnh hỏng / bị cắt cụt
+                print(f"❌ Rejected image: {e}")
+                raise HTTPException(status_code=e.status_code, detail=str(e))
+            for stage, ms in stage_timings.items():
+                timer.record(stage, ms / 1000)
+            # Wall time của phần chạy models (tới khi model chậm nhất xong), trừ decode + preprocess (+ tta)
+            preprocess_seconds = sum(stage_timings.values()) / 1000
+            timer.record("inference", time.perf_counter() - inference_start - preprocess_seconds)
+            _record_model_timings(timer, predictions)
+            
+            # 5. Voting mechanism để chọn kết quả cuối cùng
+            with timer.stage("vote"):
+                voting_result = prediction_service.vote(predictions, top_k=top_k)
+            
+            # 6. Format response để match với backend expectation
+            result = _format_response(predictions, voting_result, top_k, model_service.get_model_versions(models))
+            if admission.degraded:
+                result["degraded"] = True
+    except AdmissionRejected as e:
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+    
+    # Chỉ cache kết quả khi tất cả models chạy thành công (không bị bỏ qua vì memory budget)
+    if _cacheable(models, predictions):
+        prediction_cache.store(cache_keys, result)
+    return result
+
+
 @app.post("/predict")
-async def predict(file: UploadFile = File(...)):
+async def predict(
+    request: Request,
+    response: Response,
+    file: UploadFile = File(...),
+    top_k: Optional[int] = Query(None, ge=1),
+):
     """
     Nhận ảnh món ăn và chạy tất cả models song song để dự đoán.
     
     Args:
         file: Ảnh món ăn (multipart/form-data)
+        top_k (query, tùy chọn): trả thêm "top_k" - k món có probability cao nhất
+        Header X-Request-Timeout-Ms / X-Request-Deadline (tùy chọn): client thôi chờ
+        sau thời điểm này; request chưa kịp chạy thì bị bỏ (504), sắp hết giờ thì chạy ít model hơn
     
     Returns:
         {
@@ -137,101 +457,433 @@ async def predict(file: UploadFile = File(...)):
             "voting_result": {...}
         }
     """
+    timer = RequestTimer()
     try:
         # 1. Đọc ảnh từ RAM (không ghi ra đĩa để tối ưu I/O)
-        image_bytes = await file.read()
+        with timer.stage("upload_read"):
+            image_bytes = await file.read()
         
-        # Verify image bytes không rỗng
-        if not image_bytes:
-            raise HTTPException(status_code=400, detail="Empty image file")
+        # Kiểm tra rỗng / quá MAX_UPLOAD_BYTES trước khi hash cho cache
+        try:
+            image_processor.check_upload(image_bytes)
+        except InvalidImageError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
         
         print(f"📸 Received image - Size: {len(image_bytes)} bytes, Content-Type: {file.content_type}, Filename: {file.filename}")
         
-        # Kiểm tra magic bytes để verify image format
-        # JPEG: FF D8 FF
-        # PNG: 89 50 4E 47
-        # GIF: 47 49 46 38
-        magic_bytes = image_bytes[:4]
-        is_jpeg = magic_bytes[:3] == b'\xff\xd8\xff'
-        is_png = magic_bytes[:4] == b'\x89PNG'
-        is_gif = magic_bytes[:4] == b'GIF8'
-        
-        if not (is_jpeg or is_png or is_gif):
-            print(f"⚠️ Unknown image format - Magic bytes: {magic_bytes.hex()}")
-            print(f"   First 20 bytes (hex): {image_bytes[:20].hex()}")
-        
-        # Thử mở image với error handling tốt hơn
-        try:
-            image = Image.open(io.BytesIO(image_bytes))
-            # Verify image format
-            image.verify()
-            # Reset image sau khi verify (verify() đóng image)
-            image = Image.open(io.BytesIO(image_bytes))
-            print(f"✅ Image opened successfully - Format: {image.format}, Size: {image.size}")
-        except Exception as e:
-            print(f"❌ Error opening image: {type(e).__name__}: {e}")
-            print(f"   Magic bytes (hex): {magic_bytes.hex()}")
-            print(f"   First 100 bytes (hex): {image_bytes[:100].hex()}")
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Invalid image format: {str(e)}"
-            )
+        result = await _predict_image(image_bytes, timer, deadline=parse_deadline(request.headers), top_k=top_k)
+        if SERVER_TIMING_HEADER:
+            response.headers["Server-Timing"] = timer.server_timing()
+        return result
         
-        # 2. Kiểm tra models đã load chưa
-        if not models_loaded:
-            if models_loading:
-                raise HTTPException(
-                    status_code=503,
-                    detail="Models are still loading. Please try again in a few minutes."
-                )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error in predict: {e}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+
+
+def _perceptual_lookup(image_bytes: bytes, cache_keys: List[str], namespace: str) -> Optional[Dict[str, Any]]:
+    """
+    Lookup cache theo perceptual hash (chạy trong thread pool, ảnh đã qua open_image).
+    dHash decode ảnh ở độ phân giải thấp nên dùng handle riêng: ảnh của preprocess
+    vẫn chưa decode và giữ được JPEG draft theo kích thước model.
+    """
+    with image_processor.open_image(image_bytes) as image:
+        return prediction_cache.lookup_perceptual(image, cache_keys, namespace)
+
+
+def _decode_for_batch(image_bytes: bytes, sizes: List[int], dtype: Any) -> Dict[int, np.ndarray]:
+    """Kiểm tra header + decode + preprocess một ảnh của batch (chạy trong thread pool)"""
+    with image_processor.open_image(image_bytes) as image:
+        return image_processor.preprocess_multi(image, sizes, dtype=dtype)
+
+
+async def _read_batch_items(request: Request) -> List[Tuple[str, bytes]]:
+    """
+    Đọc ảnh từ request: multipart nhiều file (field bất kỳ, file zip/tar được
+    giải nén) hoặc body là một file zip / tar.
+    
+    Ảnh trong archive được giải nén có giới hạn: mỗi ảnh tối đa MAX_UPLOAD_BYTES, tổng
+    dung lượng ảnh (sau giải nén) tối đa BATCH_PREDICT_MAX_BYTES (chống zip bomb).
+    
+    Raises:
+        InvalidImageError: ảnh / tổng dung lượng giải nén vượt giới hạn (413)
+        ValueError: archive hỏng hoặc quá nhiều ảnh
+    """
+    items: List[Tuple[str, bytes]] = []
+    total_bytes = 0
+    
+    def extract(data: bytes) -> List[Tuple[str, bytes]]:
+        nonlocal total_bytes
+        images = extract_images(
+            data,
+            BATCH_PREDICT_MAX_IMAGES,
+            max_file_bytes=image_processor.max_bytes,
+            max_total_bytes=BATCH_PREDICT_MAX_BYTES - total_bytes,
+        )
+        total_bytes += sum(len(content) for _, content in images)
+        return images
+    
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        uploads = [value for _, value in form.multi_items() if hasattr(value, "read")]
+        for index, upload in enumerate(uploads):
+            data = await upload.read()
+            filename = upload.filename or f"file_{index}"
+            if is_archive(data):
+                items.extend((f"{filename}/{name}", content) for name, content in extract(data))
             else:
-                raise HTTPException(
-                    status_code=503,
-                    detail=f"Models failed to load. Error: {models_load_error or 'Unknown error'}. Please check server logs."
-                )
-        
-        # Kiểm tra có models không
-        if not model_service.models or len(model_service.models) == 0:
+                total_bytes += len(data)
+                items.append((filename, data))
+    else:
+        data = await request.body()
+        if not is_archive(data):
             raise HTTPException(
-                status_code=503,
-                detail="No models available. Please check server logs for model loading errors."
+                status_code=415,
+                detail="Send images as multipart/form-data or a zip / tar archive body"
             )
-        
-        # 3. Đảm bảo prediction_service có class names
-        if not prediction_service.class_names and model_service.class_names:
-            prediction_service.set_class_names(model_service.class_names)
-        
-        # 4. Chạy tất cả models song song (parallel inference)
-        # Image sẽ được preprocess riêng cho từng model trong prediction_service
-        predictions = await prediction_service.predict_all_models(
-            image,  # Truyền PIL Image gốc
-            model_service.models,
-            image_processor
+        items = extract(data)
+    return items
+
+
+@app.post("/predict/batch")
+async def predict_batch(request: Request, top_k: Optional[int] = Query(None, ge=1)):
+    """
+    Dự đoán nhiều ảnh trong một request (seed dữ liệu, re-score lịch sử scan).
+    
+    Input: multipart/form-data nhiều file (có thể là file zip / tar) hoặc body
+    là một file zip / tar (Content-Type: application/zip, application/x-tar...).
+    
+    Ảnh được decode song song, mỗi model chạy theo batch thật, kết quả stream
+    về dạng NDJSON theo đúng thứ tự input (client đọc được ngay từng dòng):
+    
+        {"index": 0, "filename": "pho.jpg", "best_match": "pho", "confidence": 0.93, ...}
+        {"index": 1, "filename": "bad.jpg", "error": "Invalid image format: ..."}
+    
+    top_k (query, tùy chọn): mỗi dòng có thêm "top_k" như /predict.
+    
+    Mỗi chunk qua admission control như một request /predict (không degrade): server
+    quá tải / quá deadline trước khi stream thì trả 503 / 504, giữa chừng thì các dòng
+    còn lại có "error".
+    """
+    deadline = parse_deadline(request.headers)
+    try:
+        items = await _read_batch_items(request)
+    except InvalidImageError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not items:
+        raise HTTPException(status_code=400, detail="No images found in request")
+    if len(items) > BATCH_PREDICT_MAX_IMAGES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many images: {len(items)} > {BATCH_PREDICT_MAX_IMAGES}"
         )
+    
+    models, inference_fns = await _acquire_models()
+    try:
+        admission_controller.check(deadline)
+    except AdmissionRejected as e:
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+    input_sizes = prediction_service.get_input_sizes(models, image_processor)
+    sizes = sorted(set(input_sizes.values()))
+    input_dtype = prediction_service.get_input_dtype(models, inference_fns)
+    model_versions = model_service.get_model_versions(models)
+    cache_namespace = _cache_namespace(top_k)
+    loop = asyncio.get_event_loop()
+    print(f"📦 Batch prediction: {len(items)} images, {len(models)} models")
+    
+    async def decode_chunk(start: int) -> List[Any]:
+        chunk = items[start:start + BATCH_PREDICT_CHUNK_SIZE]
+        return await asyncio.gather(
+            *(loop.run_in_executor(None, _decode_for_batch, data, sizes, input_dtype) for _, data in chunk),
+            return_exceptions=True,
+        )
+    
+    async def process_chunk(start: int, decoded: List[Any]) -> List[Dict[str, Any]]:
+        lines: List[Optional[Dict[str, Any]]] = []
+        pending = []  # (vị trí trong chunk, ảnh đã preprocess, cache keys)
+        for offset, result in enumerate(decoded):
+            index = start + offset
+            filename, data = items[index]
+            if isinstance(result, BaseException):
+                error = str(result) if isinstance(result, InvalidImageError) else f"Invalid image format: {result}"
+                lines.append({"index": index, "filename": filename, "error": error})
+                continue
+            cached_result, cache_keys = prediction_cache.lookup(data, cache_namespace)
+            if cached_result is not None:
+                lines.append({"index": index, "filename": filename, **cached_result, "cached": True})
+                continue
+            lines.append(None)
+            pending.append((offset, result, cache_keys))
         
-        # 5. Voting mechanism để chọn kết quả cuối cùng
-        voting_result = prediction_service.vote(predictions)
-        
-        # 6. Format response để match với backend expectation
-        model_details_formatted = {}
-        for model_name, result in predictions.items():
-            model_details_formatted[model_name] = {
-                "prediction": result.get("prediction", "Unknown"),
-                "confidence": result.get("confidence", 0.0)
-            }
+        if pending and prediction_cache.use_perceptual_hash:
+            # Ảnh đã decode thành công (đã qua open_image); dHash trong thread pool
+            phash_results = await asyncio.gather(*(
+                loop.run_in_executor(None, _perceptual_lookup, items[start + offset][1], cache_keys, cache_namespace)
+                for offset, _, cache_keys in pending
+            ), return_exceptions=True)
+            remaining = []
+            for (offset, images, cache_keys), cached_result in zip(pending, phash_results):
+                if isinstance(cached_result, dict):
+                    index = start + offset
+                    lines[offset] = {"index": index, "filename": items[index][0], **cached_result, "cached": True}
+                else:
+                    remaining.append((offset, images, cache_keys))
+            pending = remaining
         
-        return {
-            "best_match": voting_result["prediction"],
-            "confidence": voting_result["confidence"],
-            "model_details": model_details_formatted,
-            "voting_result": voting_result,
+        if pending:
+            async with admission_controller.admit(deadline, can_degrade=False, observe_latency=False):
+                batch_predictions = await prediction_service.predict_batch(
+                    [images for _, images, _ in pending], models, input_sizes, inference_fns
+                )
+            for (offset, _, cache_keys), predictions in zip(pending, batch_predictions):
+                response = _format_response(
+                    predictions, prediction_service.vote(predictions, top_k=top_k), top_k, model_versions
+                )
+                if _cacheable(models, predictions):
+                    prediction_cache.store(cache_keys, response)
+                lines[offset] = {"index": start + offset, "filename": items[start + offset][0], **response}
+        return lines
+    
+    async def stream():
+        starts = list(range(0, len(items), BATCH_PREDICT_CHUNK_SIZE))
+        # Decode chunk kế tiếp trong lúc models chạy chunk hiện tại
+        next_decode = asyncio.ensure_future(decode_chunk(starts[0]))
+        for position, start in enumerate(starts):
+            decoded = await next_decode
+            if position + 1 < len(starts):
+                next_decode = asyncio.ensure_future(decode_chunk(starts[position + 1]))
+            try:
+                lines = await process_chunk(start, decoded)
+            except AdmissionRejected as e:
+                if e.status_code == 504:
+                    # Quá deadline: các chunk sau cũng không kịp, trả lỗi cho mọi ảnh còn lại
+                    next_decode.cancel()
+                    for index in range(start, len(items)):
+                        line = {"index": index, "filename": items[index][0], "error": e.detail}
+                        yield json.dumps(line, ensure_ascii=False) + "\n"
+                    return
+                lines = [
+                    {"index": start + offset, "filename": items[start + offset][0], "error": e.detail}
+                    for offset in range(len(decoded))
+                ]
+            except Exception as e:
+                print(f"❌ Error in batch prediction: {e}")
+                lines = [
+                    {"index": start + offset, "filename": items[start + offset][0], "error": f"Prediction failed: {e}"}
+                    for offset in range(len(decoded))
+                ]
+            for line in lines:
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.post("/embed")
+async def embed(
+    request: Request,
+    file: UploadFile = File(...),
+    model: Optional[str] = Query(None),
+    top_k: Optional[int] = Query(None, ge=1, le=100),
+    include_vector: bool = Query(True),
+):
+    """
+    Embedding (penultimate layer, L2-normalized) của ảnh từ một model + món tương tự
+    trong embedding index (nếu có, cùng model với index).
+
+    Args:
+        file: Ảnh món ăn (multipart/form-data)
+        model: Model dùng để lấy embedding (mặc định EMBEDDING_MODEL / model của index)
+        top_k: Số ảnh tham chiếu gần nhất (mặc định EMBEDDING_TOP_K)
+        include_vector: false để không trả vector (chỉ cần món tương tự)
+
+    Returns:
+        {
+            "model": "inception_v3",
+            "dimension": 2048,
+            "embedding": [...],
+            "nearest_dish": "pho",
+            "similarity": 0.91,
+            "unknown": false,
+            "similar_dishes": [{"label": "pho", "similarity": 0.91}, ...],
+            "neighbours": [{"label": "pho", "similarity": 0.91, "reference": "pho/001.jpg"}, ...]
         }
-        
-    except Exception as e:
-        print(f"❌ Error in predict: {e}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    """
+    _check_models_ready()
+    model_name = embedding_service.resolve_model(model)
+    if model_name not in embedding_service.available_models():
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown model: {model_name}. Available: {', '.join(embedding_service.available_models())}"
+        )
+
+    image_bytes = await file.read()
+    try:
+        image_processor.check_upload(image_bytes)
+        image = image_processor.open_image(image_bytes)
+    except InvalidImageError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    loop = asyncio.get_event_loop()
+    try:
+        # Dùng chung giới hạn concurrency với /predict (không degrade: chỉ chạy một model)
+        async with admission_controller.admit(parse_deadline(request.headers), can_degrade=False):
+            # Lazy mode: model được load qua registry (trong memory budget)
+            try:
+                extractor = await embedding_service.acquire_extractor(model_name)
+            except RuntimeError as e:
+                raise HTTPException(status_code=503, detail=str(e))
+            embedding = await loop.run_in_executor(
+                None, embedding_service.embed_image, image, image_processor, extractor
+            )
+    except AdmissionRejected as e:
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+    except InvalidImageError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    result: Dict[str, Any] = {"model": model_name, "dimension": int(embedding.shape[1])}
+    if include_vector:
+        result["embedding"] = [round(float(value), 6) for value in embedding[0]]
+    index = embedding_service.index
+    if index is not None and index.model_name == model_name:
+        result.update(embedding_service.lookup(embedding, top_k)[0])
+    elif index is not None:
+        result["index_note"] = f"Embedding index was built with {index.model_name}; similar-dish lookup skipped"
+    return result
+
+
+async def _run_job(image_bytes: bytes) -> Dict[str, Any]:
+    """Handler của job queue: chờ models load xong (cold start) rồi chạy pipeline /predict"""
+    while models_loading and not models_loaded:
+        await asyncio.sleep(0.5)
+    return await _predict_image(image_bytes, RequestTimer(), from_job=True)
+
+
+job_queue = JobQueue(_run_job)
+
+
+def _check_callback_url(callback_url: str):
+    """400 nếu callback_url không hợp lệ / host không nằm trong JOB_CALLBACK_ALLOWED_HOSTS"""
+    try:
+        check_callback_url(callback_url, job_queue.callback_allowed_hosts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(response: Response, file: UploadFile = File(...), callback_url: Optional[str] = Form(None)):
+    """
+    Nhận ảnh và trả job id ngay (không giữ connection trong lúc chạy ensemble).
+    Kết quả lấy bằng GET /jobs/{job_id}, hoặc được POST (JSON) tới callback_url.
+    Queue đầy -> 429 kèm Retry-After.
+    
+    Returns:
+        {"job_id": "...", "status": "queued", "status_url": "/jobs/...", ...}
+    """
+    if models_load_error and not models_loading:
+        raise HTTPException(status_code=503, detail=f"Models failed to load: {models_load_error}")
+    
+    image_bytes = await file.read()
+    try:
+        image_processor.check_upload(image_bytes)
+        # Ảnh hỏng bị từ chối ngay thay vì chiếm chỗ trong queue
+        image_processor.open_image(image_bytes).close()
+    except InvalidImageError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if callback_url:
+        _check_callback_url(callback_url)
+    
+    cached_result = None
+    if models_loaded:
+        cached_result, _ = prediction_cache.lookup(image_bytes, _cache_namespace())
+    if cached_result is not None:
+        job = job_queue.add_completed({**cached_result, "cached": True}, callback_url)
+    else:
+        try:
+            job = job_queue.submit(image_bytes, callback_url)
+        except QueueFullError as e:
+            return JSONResponse(
+                status_code=429,
+                content={"detail": str(e)},
+                headers={"Retry-After": str(e.retry_after)},
+            )
+    
+    status_url = f"/jobs/{job.id}"
+    response.headers["Location"] = status_url
+    return {**job.to_dict(), "status_url": status_url}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Trạng thái job (queued | running | done | failed), kèm result / error khi đã xong"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job.to_dict()
+
+
+def _check_admin(request: Request):
+    """Admin API cần ADMIN_TOKEN (header Authorization: Bearer <token> hoặc X-Admin-Token)"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API is disabled (set ADMIN_TOKEN)")
+    authorization = request.headers.get("authorization", "")
+    token = authorization[7:] if authorization.lower().startswith("bearer ") else request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.get("/admin/models")
+async def list_model_versions(request: Request):
+    """Version đang phục vụ, các version có sẵn và trạng thái hot reload của từng model"""
+    _check_admin(request)
+    _check_models_ready()
+    return model_service.get_version_stats()
+
+
+@app.post("/admin/models/{model_name}/reload", status_code=202)
+async def reload_model(
+    request: Request,
+    response: Response,
+    model_name: str,
+    version: Optional[str] = Query(None, description="Version trong models/<model>/ (mặc định CURRENT / mới nhất)"),
+    wait: bool = Query(False, description="Chờ load + warm-up + swap xong mới trả về"),
+):
+    """
+    Hot reload một model sang version khác không downtime: version mới được load +
+    warm-up trong background rồi swap atomic; request đang chạy dùng version cũ tới
+    khi xong, sau đó RAM của version cũ được giải phóng.
+    
+    Returns:
+        Trạng thái reload ("loading" | "active" | "failed"), xem thêm GET /admin/models
+    """
+    _check_admin(request)
+    _check_models_ready()
+    try:
+        task = model_service.start_reload(model_name, version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {model_name}")
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if not wait:
+        return model_service.reloads[model_name]
+    status = await task
+    if status["state"] == "failed":
+        raise HTTPException(status_code=500, detail=status["error"])
+    response.status_code = 200
+    return status
 
 
 if __name__ == "__main__":
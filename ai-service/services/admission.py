@@ -0,0 +1,183 @@
+"""
+Admission Control - Giới hạn số prediction chạy đồng thời / đang chờ, bỏ request đã quá
+deadline của client và giảm số model khi quá tải
+"""
+
+from typing import Any, Dict, List, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import math
+import time
+
+from services.metrics import ADMISSION_DEGRADED_TOTAL, ADMISSION_SHED_TOTAL
+from utils.config import env_float, env_int
+
+
+class AdmissionRejected(Exception):
+    """Request bị từ chối trước khi inference (queue đầy / quá deadline)"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[int] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Admission:
+    """Quyết định cho một request đã được nhận: chạy đủ models hay bản degraded"""
+
+    def __init__(self, degraded: bool, reason: Optional[str] = None):
+        self.degraded = degraded
+        self.reason = reason
+
+
+def parse_deadline(headers: Any) -> Optional[float]:
+    """
+    Deadline (time.time()) từ header của client:
+    - X-Request-Deadline: epoch milliseconds
+    - X-Request-Timeout-Ms: thời gian client còn chờ (ms), tính từ lúc nhận request
+    """
+    try:
+        if headers.get("x-request-deadline"):
+            return float(headers["x-request-deadline"]) / 1000
+        if headers.get("x-request-timeout-ms"):
+            return time.time() + float(headers["x-request-timeout-ms"]) / 1000
+    except ValueError:
+        pass
+    return None
+
+
+class AdmissionController:
+    """
+    Tối đa MAX_CONCURRENT_PREDICTIONS request chạy models cùng lúc, tối đa
+    MAX_QUEUED_PREDICTIONS request chờ; vượt quá thì trả 503 + Retry-After ngay
+    thay vì để latency / RAM (tensor đã decode) tăng không giới hạn.
+
+    Request được chạy bản degraded (DEGRADED_MODEL_COUNT model rẻ nhất) khi số
+    request đang chờ >= DEGRADE_QUEUE_DEPTH, hoặc thời gian còn lại tới deadline
+    ít hơn latency trung bình của full ensemble.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        max_queued: Optional[int] = None,
+        degrade_queue_depth: Optional[int] = None,
+        degraded_model_count: Optional[int] = None,
+    ):
+        self.max_concurrent = max_concurrent or env_int("MAX_CONCURRENT_PREDICTIONS", 8)
+        self.max_queued = max_queued if max_queued is not None else env_int("MAX_QUEUED_PREDICTIONS", 32)
+        self.degrade_queue_depth = (
+            degrade_queue_depth if degrade_queue_depth is not None
+            else env_int("DEGRADE_QUEUE_DEPTH", max(1, self.max_queued // 2))
+        )
+        self.degraded_model_count = degraded_model_count or env_int("DEGRADED_MODEL_COUNT", 2)
+        # EWMA latency (giây) của full ensemble để quyết định degrade theo deadline
+        self.full_latency: Optional[float] = None
+        self._ewma_alpha = env_float("ADMISSION_LATENCY_EWMA_ALPHA", 0.2)
+
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self.in_flight = 0
+        self.waiting = 0
+        self.counts = {"admitted": 0, "degraded": 0, "shed_queue_full": 0, "shed_deadline": 0}
+
+    def _shed(self, reason: str, status_code: int, detail: str, retry_after: Optional[int] = None):
+        self.counts[f"shed_{reason}"] += 1
+        ADMISSION_SHED_TOTAL.inc(reason=reason)
+        print(f"🚦 Shedding request ({reason}): {detail}")
+        raise AdmissionRejected(status_code, detail, retry_after)
+
+    def retry_after(self) -> int:
+        """Ước lượng thời gian để các request đang chờ chạy xong (tối thiểu 1 giây)"""
+        latency = self.full_latency or 1.0
+        return max(1, math.ceil(latency * (self.waiting + self.in_flight) / self.max_concurrent))
+
+    def check(self, deadline: Optional[float] = None, sheddable: bool = True):
+        """
+        Từ chối ngay nếu queue đầy / đã quá deadline (không chiếm slot), vd. trước khi
+        /predict/batch bắt đầu stream response.
+
+        Raises:
+            AdmissionRejected: queue đầy (503) hoặc đã quá deadline (504)
+        """
+        if sheddable and self.waiting >= self.max_queued and self._semaphore.locked():
+            self._shed("queue_full", 503, "Server is overloaded, please retry later", self.retry_after())
+        if deadline is not None and time.time() >= deadline:
+            self._shed("deadline", 504, "Request deadline exceeded before inference")
+
+    @asynccontextmanager
+    async def admit(
+        self,
+        deadline: Optional[float] = None,
+        can_degrade: bool = True,
+        sheddable: bool = True,
+        observe_latency: bool = True,
+    ):
+        """
+        Chờ tới lượt chạy models (yield Admission), giữ slot tới khi xong.
+        sheddable=False: không từ chối khi queue đầy (vd. job đã được giới hạn bởi job queue).
+        observe_latency=False: thời gian chạy không phải latency của một ảnh (vd. một chunk
+        của /predict/batch) nên không đưa vào EWMA dùng cho degrade / Retry-After.
+
+        Raises:
+            AdmissionRejected: queue đầy (503) hoặc đã quá deadline trước khi inference (504)
+        """
+        self.check(deadline, sheddable)
+
+        self.waiting += 1
+        try:
+            timeout = max(0.0, deadline - time.time()) if deadline is not None else None
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self._shed("deadline", 504, "Request deadline exceeded while waiting in queue")
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            admission = self._decide(deadline, can_degrade)
+            self.counts["admitted"] += 1
+            if admission.degraded:
+                self.counts["degraded"] += 1
+                ADMISSION_DEGRADED_TOTAL.inc(reason=admission.reason)
+            start = time.perf_counter()
+            yield admission
+            if observe_latency and not admission.degraded:
+                self._observe_full_latency(time.perf_counter() - start)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def _decide(self, deadline: Optional[float], can_degrade: bool) -> Admission:
+        if not can_degrade:
+            return Admission(False)
+        if self.waiting >= self.degrade_queue_depth:
+            return Admission(True, "queue_depth")
+        if deadline is not None and self.full_latency is not None and deadline - time.time() < self.full_latency:
+            return Admission(True, "deadline")
+        return Admission(False)
+
+    def _observe_full_latency(self, seconds: float):
+        if self.full_latency is None:
+            self.full_latency = seconds
+        else:
+            self.full_latency += self._ewma_alpha * (seconds - self.full_latency)
+
+    def degraded_models(self, model_names: List[str], preferred_order: List[str]) -> List[str]:
+        """DEGRADED_MODEL_COUNT model đầu tiên theo thứ tự ưu tiên (model rẻ + chính xác trước)"""
+        order = [name for name in preferred_order if name in model_names]
+        order += [name for name in model_names if name not in order]
+        return order[:self.degraded_model_count]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Trạng thái admission cho /health"""
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "degrade_queue_depth": self.degrade_queue_depth,
+            "degraded_model_count": self.degraded_model_count,
+            "full_latency_ms": round(self.full_latency * 1000, 1) if self.full_latency is not None else None,
+            **self.counts,
+        }
@@ -0,0 +1,200 @@
+"""
+Ensemble Aggregation - Gộp probability vectors của các models (vectorized trên trục class)
+"""
+
+from typing import Any, Dict, List, Optional, Sequence
+from pathlib import Path
+import json
+import numpy as np
+
+from utils.config import env_int, env_str
+
+
+# majority: vote theo argmax (tie -> average confidence cao nhất), giống logic cũ
+# soft: trung bình (có trọng số) của probability vectors
+# geometric: trung bình nhân (log-space) rồi chuẩn hóa lại
+# weighted: soft voting với trọng số học được từ held-out set (MODEL_WEIGHTS_PATH)
+AGGREGATION_METHODS = ("majority", "soft", "geometric", "weighted")
+
+_EPSILON = 1e-8
+
+
+class EnsembleAggregator:
+    """
+    Gộp kết quả ensemble trong một bước NumPy.
+
+    Input là ma trận (num_models, num_classes); mọi phương pháp đều trả về
+    cùng format: prediction, confidence, top-k kèm probability và margin.
+    """
+
+    def __init__(
+        self,
+        method: Optional[str] = None,
+        top_k: Optional[int] = None,
+        weights_path: Optional[str] = None,
+    ):
+        self.method = (method or env_str("VOTING_METHOD", "majority")).lower()
+        if self.method not in AGGREGATION_METHODS:
+            print(f"⚠️  Unknown VOTING_METHOD={self.method}, falling back to majority")
+            self.method = "majority"
+        self.top_k = top_k or env_int("VOTING_TOP_K", 3)
+        self.weights_path = Path(weights_path or env_str("MODEL_WEIGHTS_PATH", "models/ensemble_weights.json"))
+        self.model_weights: Dict[str, float] = {}
+        if self.method == "weighted":
+            self.load_weights()
+
+    def load_weights(self):
+        """Load trọng số từng model ({model_name: weight}) từ file JSON"""
+        if not self.weights_path.exists():
+            print(f"⚠️  {self.weights_path} not found, weighted voting uses equal weights")
+            return
+        try:
+            self.model_weights = {
+                name: float(weight)
+                for name, weight in json.loads(self.weights_path.read_text(encoding="utf-8")).items()
+            }
+            print(f"✅ Loaded ensemble weights from {self.weights_path}: {self.model_weights}")
+        except Exception as e:
+            print(f"⚠️  Error loading ensemble weights: {e}")
+            self.model_weights = {}
+
+    def _weights(self, model_names: Sequence[str]) -> np.ndarray:
+        weights = np.array([self.model_weights.get(name, 1.0) for name in model_names], dtype=np.float64)
+        total = weights.sum()
+        return weights / total if total > 0 else np.full(len(model_names), 1.0 / len(model_names))
+
+    def scores(self, model_names: Sequence[str], probabilities: np.ndarray, method: Optional[str] = None) -> np.ndarray:
+        """
+        Điểm ensemble cho từng class.
+
+        Args:
+            probabilities: (num_models, num_classes) hoặc (batch, num_models, num_classes)
+
+        Returns:
+            (num_classes,) hoặc (batch, num_classes)
+        """
+        method = method or self.method
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+
+        if method == "majority":
+            num_classes = probabilities.shape[-1]
+            winners = probabilities.argmax(axis=-1)
+            one_hot = np.eye(num_classes, dtype=np.float64)[winners]
+            votes = one_hot.sum(axis=-2)
+            confidence_sum = (one_hot * probabilities.max(axis=-1, keepdims=True)).sum(axis=-2)
+            average_confidence = np.divide(
+                confidence_sum, votes, out=np.zeros_like(confidence_sum), where=votes > 0
+            )
+            # Số vote quyết định; average confidence (< 1) chỉ dùng để phá tie
+            return votes + average_confidence / 2
+
+        weights = self._weights(model_names) if method == "weighted" else np.full(
+            len(model_names), 1.0 / len(model_names)
+        )
+        if method == "geometric":
+            log_mean = np.einsum("m,...mc->...c", weights, np.log(probabilities + _EPSILON))
+            combined = np.exp(log_mean - log_mean.max(axis=-1, keepdims=True))
+            return combined / combined.sum(axis=-1, keepdims=True)
+        # soft / weighted
+        return np.einsum("m,...mc->...c", weights, probabilities)
+
+    def aggregate(
+        self,
+        model_names: Sequence[str],
+        probabilities: np.ndarray,
+        class_names: Sequence[str],
+        method: Optional[str] = None,
+        top_k: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Gộp probability vectors của các models cho một ảnh.
+
+        Args:
+            model_names: Tên các model tương ứng với từng dòng
+            probabilities: (num_models, num_classes)
+            class_names: Tên classes
+
+        Returns:
+            {
+                "prediction": "pho",
+                "confidence": 0.93,
+                "method": "soft",
+                "votes": {"pho": 4, "bun_bo_hue": 1},
+                "top_k": [{"prediction": "pho", "probability": 0.93}, ...],
+                "margin": 0.81,
+            }
+
+            Majority: top-k xếp theo số vote (probability trung bình của class ít vote hơn
+            có thể cao hơn), mỗi entry có thêm "votes" và "score" (vote share, average
+            confidence phá tie, sau đó probability trung bình); margin = score top-1 − top-2
+            nên không bao giờ âm.
+        """
+        method = method or self.method
+        top_k = top_k or self.top_k
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        num_classes = probabilities.shape[-1]
+
+        winners = probabilities.argmax(axis=1)
+        votes = np.bincount(winners, minlength=num_classes)
+
+        if method == "majority":
+            # Confidence = average confidence của các model vote cho class thắng (giống logic cũ);
+            # top-k / margin dùng probability trung bình để có ý nghĩa với cả class không được vote
+            confidence_sum = np.bincount(winners, weights=probabilities.max(axis=1), minlength=num_classes)
+            confidence = np.divide(confidence_sum, votes, out=np.zeros(num_classes), where=votes > 0)
+            # Score chuẩn hóa theo số model (~ vote share) để margin cùng thang [0, 1] với soft voting
+            ranking_scores = self.scores(model_names, probabilities, "majority") / len(probabilities)
+            class_probabilities = probabilities.mean(axis=0)
+        else:
+            class_probabilities = self.scores(model_names, probabilities, method)
+            confidence = class_probabilities
+            ranking_scores = class_probabilities
+
+        k = min(top_k, num_classes)
+        if method == "majority":
+            # Vote -> average confidence -> probability trung bình: class không được vote
+            # (score = 0) vẫn xếp theo probability thay vì thứ tự tùy ý của argpartition
+            top_indices = np.lexsort((class_probabilities, confidence, votes))[::-1][:k]
+        else:
+            top_indices = np.argpartition(-ranking_scores, k - 1)[:k]
+            top_indices = top_indices[np.argsort(-ranking_scores[top_indices], kind="stable")]
+        best = int(top_indices[0])
+        # Margin tính trên cùng score dùng để xếp hạng
+        runner_up_score = float(ranking_scores[top_indices[1]]) if k > 1 else 0.0
+
+        def name(index: int) -> str:
+            return class_names[index] if index < len(class_names) else f"class_{index}"
+
+        def entry(index: int) -> Dict[str, Any]:
+            item = {"prediction": name(index), "probability": round(float(class_probabilities[index]), 4)}
+            if method == "majority":
+                item["votes"] = int(votes[index])
+                item["score"] = round(float(ranking_scores[index]), 4)
+            return item
+
+        return {
+            "prediction": name(best),
+            "confidence": round(float(confidence[best]), 4),
+            "method": method,
+            "votes": {name(int(idx)): int(votes[idx]) for idx in np.flatnonzero(votes)},
+            "top_k": [entry(int(idx)) for idx in top_indices],
+            "margin": round(float(ranking_scores[best]) - runner_up_score, 4),
+        }
+
+
+def learn_weights(model_names: List[str], probabilities: np.ndarray, labels: np.ndarray) -> Dict[str, float]:
+    """
+    Học trọng số từng model từ held-out set: weight = log-likelihood trung bình
+    của nhãn đúng, chuẩn hóa về tổng = số model (model tốt hơn nặng ký hơn).
+
+    Args:
+        probabilities: (num_images, num_models, num_classes)
+        labels: (num_images,) class index
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    true_probabilities = probabilities[np.arange(len(labels)), :, labels]  # (num_images, num_models)
+    mean_log_likelihood = np.log(true_probabilities + _EPSILON).mean(axis=0)
+    # Đổi về số dương: model có log-likelihood cao nhất có trọng số lớn nhất
+    raw = np.exp(mean_log_likelihood - mean_log_likelihood.max())
+    weights = raw * len(model_names) / raw.sum()
+    return {name: round(float(weight), 4) for name, weight in zip(model_names, weights)}
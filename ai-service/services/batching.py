@@ -0,0 +1,168 @@
+"""
+Micro-batching - Gom ảnh từ nhiều request đồng thời thành batch cho từng model
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from collections import Counter
+from concurrent.futures import Executor
+import asyncio
+import time
+import numpy as np
+
+
+# Hàm chạy 1 forward pass của model trên cả batch: (model, (N, H, W, 3)) -> (N, num_classes)
+BatchRunner = Callable[[Any, np.ndarray], np.ndarray]
+
+
+class MicroBatcher:
+    """
+    Hàng đợi batching cho một model.
+
+    Request gửi ảnh (batch size 1) vào queue; worker gom tối đa
+    `max_batch_size` ảnh hoặc đợi tối đa `max_wait_ms` rồi chạy một forward
+    pass duy nhất, sau đó trả từng dòng kết quả về đúng request.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        run_batch: BatchRunner,
+        executor: Executor,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+    ):
+        self.model_name = model_name
+        self.run_batch = run_batch
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # (ảnh, model, future, thời điểm submit, dict timing của request)
+        self._pending: List[Tuple[np.ndarray, Any, asyncio.Future, float, Optional[Dict[str, float]]]] = []
+
+        # Thống kê batch size thực tế để tune max_batch_size / max_wait_ms
+        self.batch_size_counts: Counter = Counter()
+        self.total_batches = 0
+        self.total_items = 0
+
+    async def submit(
+        self,
+        image: np.ndarray,
+        model: Any,
+        timing: Optional[Dict[str, float]] = None,
+    ) -> np.ndarray:
+        """
+        Đưa ảnh vào hàng đợi và đợi kết quả.
+
+        Args:
+            image: Ảnh đã preprocess, shape (n, H, W, 3)
+            model: Model object sẽ chạy batch chứa ảnh này
+            timing: Nếu có, được ghi queue_ms (gom batch + chờ thread pool),
+                inference_ms và batch_size
+
+        Returns:
+            Output của model cho đúng n dòng của ảnh này
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, model, future, time.perf_counter(), timing))
+        return await future
+
+    def _ensure_worker(self):
+        """Khởi tạo queue và worker task trong event loop hiện tại (lazy)"""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._pending = []
+            self._worker = loop.create_task(self._run())
+
+    async def _collect(self) -> List[Tuple[np.ndarray, Any, asyncio.Future, float, Optional[Dict[str, float]]]]:
+        """Gom items cho một batch: đợi item đầu tiên, sau đó đợi thêm tối đa max_wait_ms"""
+        loop = asyncio.get_running_loop()
+        items = self._pending or [await self._queue.get()]
+        self._pending = []
+
+        deadline = loop.time() + self.max_wait_ms / 1000.0
+        while len(items) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            try:
+                if timeout <= 0:
+                    items.append(self._queue.get_nowait())
+                else:
+                    items.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+
+        # Chỉ gom các item dùng cùng model object và cùng dtype (uint8 / float32) vào một
+        # batch, phần còn lại để dành cho batch sau
+        model, dtype = items[0][1], items[0][0].dtype
+        batch_items = [item for item in items if item[1] is model and item[0].dtype == dtype]
+        self._pending = [item for item in items if item[1] is not model or item[0].dtype != dtype]
+        return batch_items
+
+    async def _run(self):
+        """Worker loop: gom batch -> forward pass trong executor -> trả kết quả"""
+        while True:
+            # Batch xử lý trong hàm riêng: loop không giữ model / batch cũ trong lúc đợi
+            # batch sau (model cũ sau hot reload phải được giải phóng được)
+            await self._process(await self._collect())
+
+    async def _process(self, items: List[Tuple[np.ndarray, Any, asyncio.Future, float, Optional[Dict[str, float]]]]):
+        items = [item for item in items if not item[2].cancelled()]
+        if not items:
+            return
+
+        model = items[0][1]
+        loop = asyncio.get_running_loop()
+        try:
+            # Ghép batch cũng nằm trong try: shape lệch không được làm chết worker
+            # (mọi request còn lại sẽ chờ future mãi mãi)
+            batch = np.concatenate([item[0] for item in items], axis=0)
+            outputs, started, finished = await loop.run_in_executor(
+                self.executor, self._timed_run, model, batch
+            )
+            del batch
+            self._record(len(items))
+
+            offset = 0
+            for image, _, future, submitted, timing in items:
+                n = image.shape[0]
+                if timing is not None:
+                    timing["queue_ms"] = (started - submitted) * 1000
+                    timing["inference_ms"] = (finished - started) * 1000
+                    timing["batch_size"] = len(items)
+                if not future.done():
+                    future.set_result(outputs[offset:offset + n])
+                offset += n
+        except Exception as e:
+            for item in items:
+                if not item[2].done():
+                    item[2].set_exception(e)
+
+    def _timed_run(self, model: Any, batch: np.ndarray) -> Tuple[np.ndarray, float, float]:
+        """Chạy trong executor: ghi lại lúc thread thực sự bắt đầu / kết thúc forward pass"""
+        started = time.perf_counter()
+        outputs = self.run_batch(model, batch)
+        return outputs, started, time.perf_counter()
+
+    def _record(self, batch_size: int):
+        self.batch_size_counts[batch_size] += 1
+        self.total_batches += 1
+        self.total_items += batch_size
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê batch size đã đạt được"""
+        return {
+            "batches": self.total_batches,
+            "images": self.total_items,
+            "avg_batch_size": round(self.total_items / self.total_batches, 3) if self.total_batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batch_size_histogram": {
+                str(size): count for size, count in sorted(self.batch_size_counts.items())
+            },
+        }
@@ -0,0 +1,258 @@
+"""
+Cache Service - Cache kết quả prediction theo nội dung ảnh (LRU + TTL, tùy chọn lưu xuống đĩa)
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from pathlib import Path
+from PIL import Image
+import hashlib
+import io
+import json
+import sqlite3
+import threading
+import time
+
+from utils.config import env_bool, env_float, env_int, env_str
+
+
+class PredictionCache:
+    """
+    Cache kết quả /predict.
+
+    - Key chính: SHA-256 của bytes upload (cùng file -> cùng kết quả)
+    - Key phụ (tùy chọn): difference hash của ảnh đã decode, bắt được cùng
+      một ảnh bị re-encode / resize nhẹ
+    - Tier 1: in-memory LRU có TTL
+    - Tier 2 (tùy chọn): SQLite trên đĩa, giữ được qua các lần restart
+    """
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        use_perceptual_hash: Optional[bool] = None,
+        disk_path: Optional[str] = None,
+    ):
+        self.enabled = enabled if enabled is not None else env_bool("PREDICTION_CACHE_ENABLED", True)
+        self.max_entries = max_entries or env_int("PREDICTION_CACHE_MAX_ENTRIES", 512)
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else env_float("PREDICTION_CACHE_TTL_SECONDS", 3600.0)
+        self.use_perceptual_hash = (
+            use_perceptual_hash if use_perceptual_hash is not None
+            else env_bool("PREDICTION_CACHE_PHASH", False)
+        )
+        disk_path = disk_path if disk_path is not None else env_str("PREDICTION_CACHE_DISK_PATH")
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.disk_path: Optional[str] = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.enabled and disk_path:
+            self._open_disk(disk_path)
+
+    def _open_disk(self, disk_path: str):
+        """Mở (hoặc tạo) SQLite database cho tier trên đĩa"""
+        try:
+            Path(disk_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS prediction_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS prediction_cache_expires ON prediction_cache (expires_at)"
+            )
+            self._db.commit()
+            self.disk_path = disk_path
+            print(f"✅ Prediction cache disk tier: {disk_path}")
+        except Exception as e:
+            self._db = None
+            print(f"⚠️  Could not open prediction cache database {disk_path}: {e}")
+
+    @staticmethod
+    def content_key(image_bytes: bytes, namespace: str = "") -> str:
+        """Key theo nội dung file upload"""
+        return f"sha256:{namespace}:{hashlib.sha256(image_bytes).hexdigest()}"
+
+    @staticmethod
+    def perceptual_key(image: Image.Image, namespace: str = "", hash_size: int = 8) -> Optional[str]:
+        """
+        Key theo difference hash (dHash) của ảnh: so sánh độ sáng các pixel
+        liền kề trên ảnh grayscale (hash_size+1) x hash_size.
+
+        `image` phải đã qua ImageProcessor.open_image (giới hạn pixel) và chưa decode;
+        hàm này decode nó (JPEG ở độ phân giải thấp) nên không dùng lại cho preprocess.
+        Decode tốn CPU: gọi trong thread pool, không gọi trên event loop.
+        """
+        try:
+            # JPEG: decode thẳng ở độ phân giải thấp
+            image.draft("L", (hash_size * 8, hash_size * 8))
+            pixels = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+            data = list(pixels.getdata())
+        except Exception:
+            return None
+
+        bits = 0
+        for row in range(hash_size):
+            offset = row * (hash_size + 1)
+            for col in range(hash_size):
+                bits = (bits << 1) | (data[offset + col] > data[offset + col + 1])
+        return f"dhash:{namespace}:{bits:0{hash_size * hash_size // 4}x}"
+
+    def lookup(self, image_bytes: bytes, namespace: str = "") -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        """
+        Tìm kết quả cho ảnh upload theo SHA-256 (rẻ, gọi được trên event loop).
+        Perceptual hash cần decode ảnh nên nằm riêng ở `lookup_perceptual`.
+
+        Returns:
+            (kết quả nếu hit, danh sách keys để `store` sau khi chạy inference)
+        """
+        if not self.enabled:
+            return None, []
+
+        keys = [self.content_key(image_bytes, namespace)]
+        value = self.get(keys[0])
+        if value is None and not self.use_perceptual_hash:
+            with self._lock:
+                self.misses += 1
+        return value, keys
+
+    def lookup_perceptual(
+        self, image: Image.Image, keys: List[str], namespace: str = ""
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Bước 2 của lookup khi SHA-256 miss (PREDICTION_CACHE_PHASH): tìm theo dHash của
+        ảnh đã validate, thêm key vào `keys` để `store`. Chạy trong thread pool.
+        """
+        if not self.enabled or not self.use_perceptual_hash or not keys:
+            return None
+
+        value = None
+        phash_key = self.perceptual_key(image, namespace)
+        if phash_key:
+            keys.append(phash_key)
+            value = self.get(phash_key, perceptual=True)
+            if value is not None:
+                # Lần sau cùng file sẽ hit thẳng theo SHA-256
+                self.set(keys[0], value)
+
+        if value is None:
+            with self._lock:
+                self.misses += 1
+        return value
+
+    def store(self, keys: List[str], value: Dict[str, Any]):
+        """Lưu kết quả cho tất cả keys trả về từ `lookup`"""
+        for key in keys:
+            self.set(key, value)
+
+    def get(self, key: str, perceptual: bool = False) -> Optional[Dict[str, Any]]:
+        """Tìm kết quả theo key (memory trước, sau đó đĩa); không đếm miss"""
+        if not self.enabled or not key:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._record_hit(perceptual)
+                    return value
+                del self._entries[key]
+
+        value = self._disk_get(key, now)
+        if value is not None:
+            with self._lock:
+                self._store(key, value, now)
+                self.disk_hits += 1
+                self._record_hit(perceptual)
+            return value
+        return None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        """Lưu kết quả vào cache (memory + đĩa nếu có)"""
+        if not self.enabled or not key:
+            return
+        now = time.time()
+        with self._lock:
+            self._store(key, value, now)
+        self._disk_set(key, value, now + self.ttl_seconds)
+
+    def _record_hit(self, perceptual: bool):
+        self.hits += 1
+        if perceptual:
+            self.perceptual_hits += 1
+
+    def _store(self, key: str, value: Dict[str, Any], now: float):
+        """Thêm vào LRU, evict entry cũ nhất khi vượt quá max_entries (gọi khi đã giữ lock)"""
+        self._entries[key] = (now + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        if self._db is None:
+            return None
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM prediction_cache WHERE key = ?", (key,)
+                ).fetchone()
+            if row is None or row[1] <= now:
+                return None
+            return json.loads(row[0])
+        except Exception as e:
+            print(f"⚠️  Prediction cache disk read failed: {e}")
+            return None
+
+    def _disk_set(self, key: str, value: Dict[str, Any], expires_at: float):
+        if self._db is None:
+            return
+        try:
+            payload = json.dumps(value)
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO prediction_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, payload, expires_at),
+                )
+                self._db.execute("DELETE FROM prediction_cache WHERE expires_at <= ?", (time.time(),))
+                self._db.commit()
+        except Exception as e:
+            print(f"⚠️  Prediction cache disk write failed: {e}")
+
+    def clear(self):
+        """Xóa toàn bộ cache (vd. khi models thay đổi)"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM prediction_cache")
+                self._db.commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters cho /health"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "perceptual_hash": self.use_perceptual_hash,
+            "disk_path": self.disk_path,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "perceptual_hits": self.perceptual_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
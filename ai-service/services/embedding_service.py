@@ -0,0 +1,369 @@
+"""
+Embedding Service - Vector đặc trưng (penultimate layer) của ảnh món ăn và tìm món
+tương tự / phát hiện món lạ bằng vector index NumPy (một phép nhân ma trận mỗi query)
+"""
+
+from typing import Any, Dict, List, Optional, Sequence
+from pathlib import Path
+import asyncio
+import json
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from services.model_service import MODEL_FILES, STUDENT_MODEL_NAME, MultiHeadModel
+from utils.config import env_bool, env_float, env_int, env_str
+
+
+# Layout của index trên đĩa (tools/build_embedding_index.py): một thư mục gồm
+# embeddings.npy (N, D) đã L2-normalize + index.json (model, labels, references...)
+INDEX_EMBEDDINGS_FILE = "embeddings.npy"
+INDEX_META_FILE = "index.json"
+
+# Model mặc định cho /embed khi chưa có index: rẻ và chính xác (đứng đầu cascade order)
+DEFAULT_EMBEDDING_MODEL = "inception_v3"
+
+
+class EmbeddingExtractor:
+    """
+    tf.function trả về embedding L2-normalized của một Keras model: input của Dense
+    layer cuối cùng (penultimate layer), hoặc output của EMBEDDING_LAYER nếu có cấu hình.
+    Student multi-head: các head dùng chung backbone nên Dense cuối cũng nhận feature chung.
+    """
+
+    def __init__(self, model_name: str, model: tf.keras.Model, layer_name: Optional[str] = None):
+        self.model_name = model_name
+        if layer_name:
+            self.layer_name = layer_name
+            features = model.get_layer(layer_name).output
+        else:
+            dense_layers = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.Dense)]
+            if not dense_layers:
+                raise ValueError(f"{model_name} has no Dense layer, set EMBEDDING_LAYER")
+            self.layer_name = dense_layers[-1].name
+            features = dense_layers[-1].input
+        feature_model = tf.keras.Model(model.inputs, features)
+        input_shape = model.input_shape
+        if isinstance(input_shape, list):
+            input_shape = input_shape[0]
+        self.input_size = int(input_shape[1])
+        self.dimension = int(feature_model.output_shape[-1])
+        self.warmup_ms: Optional[float] = None
+
+        @tf.function(input_signature=[tf.TensorSpec([None, self.input_size, self.input_size, 3], tf.float32)])
+        def extract(images):
+            features = feature_model(images, training=False)
+            features = tf.reshape(features, [tf.shape(features)[0], -1])
+            return tf.math.l2_normalize(features, axis=1)
+
+        self._extract = extract
+
+    def warmup(self) -> float:
+        start = time.perf_counter()
+        self(np.zeros((1, self.input_size, self.input_size, 3), dtype=np.float32))
+        self.warmup_ms = (time.perf_counter() - start) * 1000
+        return self.warmup_ms
+
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        return self._extract(images).numpy()
+
+
+class EmbeddingIndex:
+    """
+    Embeddings của ảnh tham chiếu (N, D), đã L2-normalize, kèm nhãn món của từng dòng.
+
+    Cosine similarity của Q query với cả index là một phép nhân ma trận (Q, D) @ (D, N),
+    top-k lấy bằng argpartition. mmap=True thì embeddings.npy được mmap thay vì đọc
+    hết vào RAM (index lớn / nhiều worker dùng chung page cache).
+    """
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        labels: Sequence[str],
+        model_name: str,
+        references: Optional[Sequence[str]] = None,
+        unknown_threshold: Optional[float] = None,
+        layer_name: Optional[str] = None,
+    ):
+        if len(embeddings) != len(labels):
+            raise ValueError(f"{len(embeddings)} embeddings but {len(labels)} labels")
+        self.embeddings = embeddings
+        self.labels = list(labels)
+        self.model_name = model_name
+        self.references = list(references) if references is not None else None
+        self.unknown_threshold = unknown_threshold
+        self.layer_name = layer_name
+
+    @property
+    def size(self) -> int:
+        return int(self.embeddings.shape[0])
+
+    @property
+    def dimension(self) -> int:
+        return int(self.embeddings.shape[1])
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = False) -> "EmbeddingIndex":
+        path = Path(path)
+        meta = json.loads((path / INDEX_META_FILE).read_text(encoding="utf-8"))
+        embeddings = np.load(path / INDEX_EMBEDDINGS_FILE, mmap_mode="r" if mmap else None)
+        return cls(
+            embeddings,
+            meta["labels"],
+            meta["model"],
+            references=meta.get("references"),
+            unknown_threshold=meta.get("unknown_threshold"),
+            layer_name=meta.get("layer"),
+        )
+
+    def save(self, path: Path, extra: Optional[Dict[str, Any]] = None):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / INDEX_EMBEDDINGS_FILE, np.ascontiguousarray(self.embeddings, dtype=np.float32))
+        meta = {
+            "model": self.model_name,
+            "layer": self.layer_name,
+            "size": self.size,
+            "dimension": self.dimension,
+            "unknown_threshold": self.unknown_threshold,
+            **(extra or {}),
+            "labels": self.labels,
+            "references": self.references,
+        }
+        (path / INDEX_META_FILE).write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+
+    def similarities(self, queries: np.ndarray) -> np.ndarray:
+        """(Q, D) embeddings đã normalize -> (Q, N) cosine similarity"""
+        return np.asarray(queries, dtype=np.float32) @ np.asarray(self.embeddings, dtype=np.float32).T
+
+    def search(self, queries: np.ndarray, top_k: int) -> List[List[Dict[str, Any]]]:
+        """
+        Top-k ảnh tham chiếu gần nhất cho từng query.
+
+        Returns:
+            [[{"label": "pho", "similarity": 0.91, "reference": "pho/001.jpg"}, ...], ...]
+        """
+        scores = self.similarities(queries)
+        k = min(top_k, self.size)
+        if k <= 0:
+            return [[] for _ in range(len(scores))]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, indices in zip(scores, top):
+            indices = indices[np.argsort(-row[indices], kind="stable")]
+            results.append([
+                {
+                    "label": self.labels[index],
+                    "similarity": round(float(row[index]), 4),
+                    **({"reference": self.references[index]} if self.references else {}),
+                }
+                for index in indices
+            ])
+        return results
+
+
+class EmbeddingService:
+    """
+    /embed: embedding từ một model của ensemble (EMBEDDING_MODEL, mặc định model của
+    index) + tra cứu món tương tự trong index (EMBEDDING_INDEX_PATH).
+
+    Ảnh có similarity cao nhất với index < unknown threshold được coi là món lạ
+    (không thuộc các món trong index).
+    """
+
+    def __init__(self, model_service: Any):
+        self.model_service = model_service
+        self.layer_name = env_str("EMBEDDING_LAYER") or None
+        self.index_path = Path(env_str("EMBEDDING_INDEX_PATH", str(model_service.models_path / "embedding_index")))
+        self.index_mmap = env_bool("EMBEDDING_INDEX_MMAP", False)
+        self.top_k = env_int("EMBEDDING_TOP_K", 5)
+        # Rỗng = dùng threshold đã calibrate lúc build index
+        self.unknown_threshold_override: Optional[float] = env_float("EMBEDDING_UNKNOWN_THRESHOLD", None)
+
+        self.index: Optional[EmbeddingIndex] = None
+        self.index_error: Optional[str] = None
+        self._index_checked = False
+        self.extractors: Dict[str, EmbeddingExtractor] = {}
+        self._lock = threading.Lock()  # chỉ giữ khi đọc / sửa dict, không giữ lúc build extractor
+        self._build_locks: Dict[str, threading.Lock] = {}  # mỗi model build extractor một lần
+        self.default_model = env_str("EMBEDDING_MODEL")
+        # Index build bằng version model đã bị hot reload thay: embedding mới lệch không gian với index
+        self.index_stale = False
+        model_service.reload_listeners.append(self.on_model_reloaded)
+        model_service.evict_listeners.append(self.on_model_evicted)
+
+    def on_model_reloaded(self, model_name: str):
+        """Model được hot reload: bỏ extractor giữ version cũ (build lại ở request sau)"""
+        with self._lock:
+            self.extractors.pop(model_name, None)
+            if self.index is not None and self.index.model_name == model_name:
+                self.index_stale = True
+                print(f"⚠️  Embedding index was built with the previous {model_name} version, rebuild it")
+
+    def on_model_evicted(self, model_name: str):
+        """Lazy mode: model bị evict khỏi registry -> bỏ extractor để RAM của model được giải phóng"""
+        with self._lock:
+            self.extractors.pop(model_name, None)
+
+    def load_index(self) -> Optional[EmbeddingIndex]:
+        """Load index một lần (không có index thì /embed chỉ trả embedding)"""
+        with self._lock:
+            if self._index_checked:
+                return self.index
+            self._index_checked = True
+            if not (self.index_path / INDEX_META_FILE).exists():
+                print(f"⚠️  Embedding index not found at {self.index_path} (similar-dish lookup disabled)")
+                return None
+            try:
+                self.index = EmbeddingIndex.load(self.index_path, mmap=self.index_mmap)
+                print(f"✅ Loaded embedding index: {self.index.size} images, {len(set(self.index.labels))} dishes, "
+                      f"{self.index.model_name} ({self.index.dimension}-d{', mmap' if self.index_mmap else ''})")
+            except Exception as e:
+                self.index_error = str(e)
+                print(f"⚠️  Error loading embedding index: {e}")
+            return self.index
+
+    @property
+    def unknown_threshold(self) -> Optional[float]:
+        if self.unknown_threshold_override is not None:
+            return self.unknown_threshold_override
+        return self.index.unknown_threshold if self.index is not None else None
+
+    def resolve_model(self, model_name: Optional[str] = None) -> str:
+        """Model dùng cho embedding: tham số > EMBEDDING_MODEL > model của index > mặc định"""
+        if model_name:
+            return model_name
+        if self.default_model:
+            return self.default_model
+        if self.index is not None:
+            return self.index.model_name
+        if self.model_service.serving_mode == "student":
+            return STUDENT_MODEL_NAME
+        return DEFAULT_EMBEDDING_MODEL
+
+    def available_models(self) -> List[str]:
+        if self.model_service.serving_mode == "student":
+            return [STUDENT_MODEL_NAME]
+        return [name for name in MODEL_FILES if name in self.model_service.model_names]
+
+    async def acquire_extractor(self, model_name: str) -> EmbeddingExtractor:
+        """
+        Extractor cho một request /embed. Model lấy qua model_service.acquire_models nên
+        ở lazy mode được load qua registry (trong MODEL_MEMORY_BUDGET_MB, dùng chung bản
+        đang serve); extractor được build trong thread pool.
+
+        Raises:
+            KeyError: model không dùng được cho embedding
+            RuntimeError: model không vừa memory budget
+        """
+        with self._lock:
+            extractor = self.extractors.get(model_name)
+        if extractor is not None:
+            return extractor
+        if model_name not in self.available_models():
+            raise KeyError(model_name)
+
+        models, _ = await self.model_service.acquire_models([model_name])
+        model = models.get(model_name)
+        if model is None and self.model_service.registry is not None:
+            raise RuntimeError(f"{model_name} does not fit the memory budget")
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.get_extractor, model_name, model)
+
+    def get_extractor(self, model_name: str, model: Any = None) -> EmbeddingExtractor:
+        """
+        Build (một lần) extractor cho model. Dùng lại Keras model đang serve nếu có;
+        backend tflite / onnx / savedmodel / worker processes không có layer trung gian
+        nên file .keras được load riêng. Blocking: gọi trong thread pool hoặc từ tools.
+        """
+        with self._lock:
+            extractor = self.extractors.get(model_name)
+            if extractor is not None:
+                return extractor
+            if model_name not in self.available_models():
+                raise KeyError(model_name)
+            build_lock = self._build_locks.setdefault(model_name, threading.Lock())
+
+        # Load / build ngoài self._lock: /embed của model khác (đã có extractor) không phải chờ
+        with build_lock:
+            with self._lock:
+                extractor = self.extractors.get(model_name)
+            if extractor is not None:
+                return extractor
+
+            if model is None:
+                model = self.model_service.get_model(model_name)
+            if isinstance(model, MultiHeadModel):
+                model = model.model
+            if not isinstance(model, tf.keras.Model):
+                path = (
+                    self.model_service.student_path if model_name == STUDENT_MODEL_NAME
+                    else self.model_service.get_keras_path(model_name)
+                )
+                print(f"🔄 Loading {model_name} from {path} for embeddings...")
+                model = tf.keras.models.load_model(str(path), compile=False)
+
+            extractor = EmbeddingExtractor(model_name, model, self.layer_name)
+            warmup_ms = extractor.warmup()
+            print(f"⚡ Embedding extractor for {model_name} ({extractor.layer_name}, "
+                  f"{extractor.dimension}-d, warm-up {warmup_ms:.0f} ms)")
+            registry = self.model_service.registry
+            with self._lock:
+                # Model bị evict trong lúc build: dùng cho request này nhưng không giữ lại
+                if registry is None or registry.is_resident(model_name):
+                    self.extractors[model_name] = extractor
+            return extractor
+
+    def embed_image(self, image: Image.Image, image_processor: Any, extractor: EmbeddingExtractor) -> np.ndarray:
+        """Decode + preprocess + extract cho một ảnh (chạy trong thread pool) -> (1, D)"""
+        images = image_processor.preprocess_multi(image, {extractor.input_size})
+        return extractor(images[extractor.input_size])
+
+    def lookup(self, embeddings: np.ndarray, top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Món tương tự + open-set check cho mỗi embedding (một phép nhân ma trận cho cả batch).
+
+        Returns:
+            [{"neighbours": [...], "similar_dishes": [{"label", "similarity"}],
+              "nearest_dish": "pho", "similarity": 0.91, "unknown": false}, ...]
+        """
+        top_k = top_k or self.top_k
+        threshold = self.unknown_threshold
+        results = []
+        for neighbours in self.index.search(embeddings, top_k):
+            # Mỗi món một lần, theo similarity cao nhất của ảnh tham chiếu thuộc món đó
+            dishes: Dict[str, float] = {}
+            for neighbour in neighbours:
+                dishes.setdefault(neighbour["label"], neighbour["similarity"])
+            best = neighbours[0]["similarity"] if neighbours else 0.0
+            results.append({
+                "neighbours": neighbours,
+                "similar_dishes": [{"label": label, "similarity": score} for label, score in dishes.items()],
+                "nearest_dish": neighbours[0]["label"] if neighbours else None,
+                "similarity": best,
+                "unknown": threshold is not None and best < threshold,
+            })
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Trạng thái index / extractors cho /health"""
+        return {
+            "index": {
+                "path": str(self.index_path),
+                "model": self.index.model_name,
+                "size": self.index.size,
+                "dishes": len(set(self.index.labels)),
+                "dimension": self.index.dimension,
+                "mmap": self.index_mmap,
+            } if self.index is not None else None,
+            "index_error": self.index_error,
+            "index_stale": self.index_stale,
+            "unknown_threshold": self.unknown_threshold,
+            "extractors": {
+                model_name: {"layer": extractor.layer_name, "dimension": extractor.dimension}
+                for model_name, extractor in self.extractors.items()
+            },
+        }
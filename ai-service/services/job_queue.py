@@ -0,0 +1,290 @@
+"""
+Job Queue - Hàng đợi prediction bất đồng bộ (POST /jobs): submit trả job id ngay,
+kết quả lấy bằng polling GET /jobs/{id} hoặc được POST tới callback URL
+"""
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import asyncio
+import ipaddress
+import json
+import math
+import socket
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from utils.config import env_float, env_int, env_list
+
+
+# handler(payload) -> result; exception có status_code / detail (vd. HTTPException)
+# được giữ lại trong job như response lỗi của /predict
+JobHandler = Callable[[Any], Awaitable[Dict[str, Any]]]
+
+
+class QueueFullError(Exception):
+    """Queue đã đầy: client nên thử lại sau `retry_after` giây"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def check_callback_url(callback_url: str, allowed_hosts: List[str]):
+    """
+    Chỉ POST kết quả tới http(s) URL có host trong allowed_hosts (JOB_CALLBACK_ALLOWED_HOSTS).
+    Rỗng = tắt callback; "*" = mọi host public (mọi địa chỉ resolve được phải là global IP,
+    không phải loopback / private / link-local như 169.254.169.254).
+
+    Raises:
+        ValueError: URL không hợp lệ hoặc host không được phép
+    """
+    parsed = urlparse(callback_url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("callback_url must be an http(s) URL")
+    if not allowed_hosts:
+        raise ValueError("Callbacks are disabled (set JOB_CALLBACK_ALLOWED_HOSTS)")
+    if parsed.hostname in allowed_hosts:
+        return
+    if "*" not in allowed_hosts:
+        raise ValueError(f"callback_url host not allowed: {parsed.hostname}")
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parsed.hostname, parsed.port or 0)}
+    except (socket.gaierror, UnicodeError) as e:
+        raise ValueError(f"callback_url host cannot be resolved: {parsed.hostname}") from e
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%", 1)[0]).is_global:
+            raise ValueError(f"callback_url host resolves to a non-public address: {parsed.hostname}")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Không đi theo redirect của callback (host được phép có thể redirect vào mạng nội bộ)"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_callback_opener = urllib.request.build_opener(_NoRedirect)
+
+
+class Job:
+    """Một prediction job và trạng thái của nó"""
+
+    def __init__(self, payload: Any, callback_url: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.payload = payload  # bỏ đi sau khi chạy xong để giải phóng RAM
+        self.callback_url = callback_url
+        self.status = "queued"  # queued | running | done | failed
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[Dict[str, Any]] = None
+        self.callback_status: Optional[str] = None  # None | delivered | failed
+
+    def finish(self, result: Optional[Dict[str, Any]] = None, error: Optional[Dict[str, Any]] = None):
+        self.finished_at = time.time()
+        self.result = result
+        self.error = error
+        self.status = "failed" if error is not None else "done"
+        self.payload = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": round(self.created_at, 3),
+            "started_at": round(self.started_at, 3) if self.started_at else None,
+            "finished_at": round(self.finished_at, 3) if self.finished_at else None,
+        }
+        if self.result is not None:
+            data["result"] = self.result
+        if self.error is not None:
+            data["error"] = self.error
+        if self.callback_url:
+            data["callback_status"] = self.callback_status
+        return data
+
+
+class JobQueue:
+    """
+    Queue giới hạn (JOB_QUEUE_MAX_SIZE) + JOB_WORKERS coroutine lấy job ra chạy.
+
+    Khi queue đầy, submit() raise QueueFullError kèm Retry-After ước lượng từ
+    thời gian chạy trung bình của các job gần đây, thay vì nhận thêm việc
+    làm latency tăng không giới hạn. Job đã xong được giữ JOB_RESULT_TTL giây, tối đa
+    JOB_MAX_STORED_RESULTS job (vượt quá thì bỏ job xong sớm nhất).
+    Callback chạy trong thread pool riêng (JOB_CALLBACK_WORKERS): receiver chậm chỉ
+    chiếm các thread này, không chiếm default executor của event loop.
+    """
+
+    def __init__(
+        self,
+        handler: JobHandler,
+        max_queue_size: Optional[int] = None,
+        num_workers: Optional[int] = None,
+        result_ttl: Optional[float] = None,
+    ):
+        self.handler = handler
+        self.max_queue_size = max_queue_size or env_int("JOB_QUEUE_MAX_SIZE", 64)
+        self.num_workers = num_workers or env_int("JOB_WORKERS", 4)
+        self.result_ttl = result_ttl if result_ttl is not None else env_float("JOB_RESULT_TTL", 600.0)
+        self.callback_timeout = env_float("JOB_CALLBACK_TIMEOUT", 10.0)
+        self.callback_retries = env_int("JOB_CALLBACK_RETRIES", 3)
+        # Retry + backoff block thread tới ~retries * (timeout + 10) giây mỗi callback
+        self._callback_executor = ThreadPoolExecutor(
+            max_workers=env_int("JOB_CALLBACK_WORKERS", 4), thread_name_prefix="job-callback"
+        )
+        self.callback_allowed_hosts = env_list("JOB_CALLBACK_ALLOWED_HOSTS", [])
+        self.max_stored_results = env_int("JOB_MAX_STORED_RESULTS", 1024)
+
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        self._durations: deque = deque(maxlen=50)  # giây, dùng để ước lượng Retry-After
+        self.counts = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "evicted": 0}
+
+    def start(self):
+        """Tạo queue + worker tasks (gọi trong event loop, lúc startup)"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, payload: Any, callback_url: Optional[str] = None) -> Job:
+        """
+        Đưa job vào queue (không block).
+
+        Raises:
+            QueueFullError: queue đã đầy
+        """
+        self.start()
+        self._purge()
+        if self._queue.full():
+            self.counts["rejected"] += 1
+            raise QueueFullError(self.retry_after())
+        job = Job(payload, callback_url)
+        self._queue.put_nowait(job)
+        self.jobs[job.id] = job
+        self.counts["submitted"] += 1
+        return job
+
+    def add_completed(self, result: Dict[str, Any], callback_url: Optional[str] = None) -> Job:
+        """Job đã có kết quả ngay lúc submit (vd. cache hit): không cần vào queue"""
+        self._purge()
+        job = Job(None, callback_url)
+        job.started_at = job.created_at
+        job.finish(result=result)
+        self.jobs[job.id] = job
+        self.counts["submitted"] += 1
+        self.counts["done"] += 1
+        # Cache hit không đi qua queue nên không bị JOB_QUEUE_MAX_SIZE giới hạn: giới hạn số kết quả giữ lại
+        self._evict_finished()
+        if callback_url:
+            self._callback_executor.submit(self._deliver_callback, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._purge()
+        return self.jobs.get(job_id)
+
+    def retry_after(self) -> int:
+        """Số giây ước lượng tới khi queue có chỗ (tối thiểu 1)"""
+        average = sum(self._durations) / len(self._durations) if self._durations else 1.0
+        return max(1, math.ceil(average * (self.depth / self.num_workers)))
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.finish(result=await self.handler(job.payload))
+                self.counts["done"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.finish(error={
+                    "status_code": getattr(e, "status_code", 500),
+                    "detail": getattr(e, "detail", None) or str(e),
+                })
+                self.counts["failed"] += 1
+            finally:
+                self._durations.append(time.time() - job.started_at)
+                self._queue.task_done()
+                self._evict_finished()
+            if job.callback_url:
+                # Không chờ callback: worker nhận job tiếp theo ngay
+                self._callback_executor.submit(self._deliver_callback, job)
+
+    def _deliver_callback(self, job: Job):
+        """POST kết quả job (JSON) tới callback URL, retry với backoff (chạy trong thread pool)"""
+        body = json.dumps(job.to_dict()).encode("utf-8")
+        for attempt in range(self.callback_retries):
+            request = urllib.request.Request(
+                job.callback_url, data=body, headers={"Content-Type": "application/json"}, method="POST"
+            )
+            try:
+                # Kiểm tra lại trước mỗi lần gửi: DNS có thể đổi sau lúc submit
+                check_callback_url(job.callback_url, self.callback_allowed_hosts)
+                with _callback_opener.open(request, timeout=self.callback_timeout) as response:
+                    if response.status < 300:
+                        job.callback_status = "delivered"
+                        return
+            except ValueError as e:
+                print(f"⚠️  Callback for job {job.id} refused: {e}")
+                break
+            except (urllib.error.URLError, OSError) as e:
+                print(f"⚠️  Callback for job {job.id} failed (attempt {attempt + 1}): {e}")
+            if attempt + 1 < self.callback_retries:
+                time.sleep(min(2 ** attempt, 10))
+        job.callback_status = "failed"
+
+    def _purge(self):
+        """Bỏ các job đã xong quá JOB_RESULT_TTL (jobs giữ theo thứ tự submit)"""
+        now = time.time()
+        for job_id in list(self.jobs):
+            job = self.jobs[job_id]
+            if job.finished_at is not None and now - job.finished_at > self.result_ttl:
+                del self.jobs[job_id]
+
+    def _evict_finished(self):
+        """
+        Giữ tối đa JOB_MAX_STORED_RESULTS job đã xong, bỏ job xong sớm nhất trước (job
+        submit sớm nhưng chạy lâu vừa xong không bị bỏ trước khi client kịp lấy kết quả)
+        """
+        finished = [job for job in self.jobs.values() if job.finished_at is not None]
+        excess = len(finished) - self.max_stored_results
+        if excess <= 0:
+            return
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:excess]:
+            del self.jobs[job.id]
+            self.counts["evicted"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Trạng thái queue cho /health"""
+        running = sum(1 for job in self.jobs.values() if job.status == "running")
+        return {
+            "queued": self.depth,
+            "running": running,
+            "max_queue_size": self.max_queue_size,
+            "workers": self.num_workers,
+            "stored_jobs": len(self.jobs),
+            "avg_job_ms": round(1000 * sum(self._durations) / len(self._durations), 1) if self._durations else None,
+            **self.counts,
+        }
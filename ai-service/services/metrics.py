@@ -0,0 +1,211 @@
+"""
+Metrics - Histogram / counter trong process và export theo Prometheus text format (/metrics)
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from contextlib import contextmanager
+import threading
+import time
+
+
+# Bucket (giây) phủ từ preprocess vài ms tới inference VGG19/ResNet152 trên CPU vài giây
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names: Sequence[str], label_values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Counter tăng dần, có labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram:
+    """Histogram cumulative bucket giống prometheus_client (không cần dependency)"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [counts theo bucket (không cumulative), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [[0] * len(self.buckets), 0.0, 0]
+                self._series[key] = series
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = sorted((key, list(counts), total, count) for key, (counts, total, count) in self._series.items())
+        lines = []
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            inf = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Tập hợp metrics của service, render một lần cho /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+REQUESTS_TOTAL = METRICS.counter(
+    "yummy_http_requests_total", "HTTP requests theo endpoint và status code", ("endpoint", "status")
+)
+REQUEST_SECONDS = METRICS.histogram(
+    "yummy_http_request_duration_seconds", "Thời gian xử lý HTTP request", ("endpoint",)
+)
+STAGE_SECONDS = METRICS.histogram(
+    "yummy_stage_duration_seconds",
+    "Thời gian từng stage của /predict (upload_read, cache_lookup, validate, decode, preprocess_<size>, inference, vote)",
+    ("stage",),
+)
+MODEL_INFERENCE_SECONDS = METRICS.histogram(
+    "yummy_model_inference_seconds", "Thời gian một forward pass của từng model", ("model",)
+)
+EXECUTOR_QUEUE_SECONDS = METRICS.histogram(
+    "yummy_executor_queue_wait_seconds",
+    "Thời gian ảnh chờ trước khi forward pass bắt đầu (gom batch + chờ thread pool)",
+    ("model",),
+)
+
+ADMISSION_SHED_TOTAL = METRICS.counter(
+    "yummy_admission_shed_total",
+    "Request bị từ chối trước khi inference (queue_full: quá MAX_QUEUED_PREDICTIONS, deadline: quá deadline của client)",
+    ("reason",),
+)
+ADMISSION_DEGRADED_TOTAL = METRICS.counter(
+    "yummy_admission_degraded_total",
+    "Request chạy với ít model hơn vì quá tải (queue_depth) hoặc sắp hết deadline (deadline)",
+    ("reason",),
+)
+
+
+class RequestTimer:
+    """
+    Timings của một request: mỗi stage được ghi vào histogram STAGE_SECONDS
+    và giữ lại để trả về qua header Server-Timing.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}  # tên -> ms
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float, observe: bool = True):
+        """Ghi một stage (giây); observe=False khi histogram đã được ghi ở nơi khác"""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds * 1000
+        if observe:
+            STAGE_SECONDS.observe(seconds, stage=name)
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.stages.items())
+
+
+def observe_model_timing(model_name: str, timing: Optional[Dict[str, float]]):
+    """Ghi inference / queue wait (ms) của một model vào histograms"""
+    if not timing:
+        return
+    if timing.get("inference_ms") is not None:
+        MODEL_INFERENCE_SECONDS.observe(timing["inference_ms"] / 1000, model=model_name)
+    if timing.get("queue_ms") is not None:
+        EXECUTOR_QUEUE_SECONDS.observe(timing["queue_ms"] / 1000, model=model_name)
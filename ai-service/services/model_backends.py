@@ -0,0 +1,158 @@
+"""
+Model Backends - Chạy models đã convert (TFLite / ONNX Runtime / SavedModel snapshot) thay cho Keras
+"""
+
+from typing import Optional, Tuple
+from pathlib import Path
+import threading
+import numpy as np
+import tensorflow as tf
+
+
+class TFLiteModel:
+    """
+    Wrapper cho tf.lite.Interpreter, dùng như một inference callable:
+    (N, H, W, 3) float32 -> (N, num_classes) float32.
+
+    Interpreter không thread-safe nên mỗi lần gọi giữ lock; batch size thay đổi
+    thì resize input tensor và allocate lại.
+    """
+
+    backend = "tflite"
+
+    def __init__(self, model_path: Path, num_threads: Optional[int] = None):
+        self.model_path = Path(model_path)
+        self._interpreter = tf.lite.Interpreter(
+            model_path=str(self.model_path),
+            num_threads=num_threads,
+        )
+        self._interpreter.allocate_tensors()
+        self._lock = threading.Lock()
+
+        input_details = self._interpreter.get_input_details()[0]
+        output_details = self._interpreter.get_output_details()[0]
+        self._input_index = input_details["index"]
+        self._output_index = output_details["index"]
+        self._batch_size = int(input_details["shape"][0])
+
+        height, width = int(input_details["shape"][1]), int(input_details["shape"][2])
+        self.input_size = height
+        self.input_shape: Tuple = (None, height, width, 3)
+        self.output_shape: Tuple = (None, int(output_details["shape"][-1]))
+        self.input_dtype = input_details["dtype"]
+
+    def _quantize_input(self, images: np.ndarray) -> np.ndarray:
+        details = self._interpreter.get_input_details()[0]
+        if details["dtype"] == np.float32:
+            return images.astype(np.float32, copy=False)
+        scale, zero_point = details["quantization"]
+        info = np.iinfo(details["dtype"])
+        quantized = np.round(images / scale + zero_point)
+        return np.clip(quantized, info.min, info.max).astype(details["dtype"])
+
+    def _dequantize_output(self, outputs: np.ndarray) -> np.ndarray:
+        details = self._interpreter.get_output_details()[0]
+        if details["dtype"] == np.float32:
+            return outputs
+        scale, zero_point = details["quantization"]
+        return (outputs.astype(np.float32) - zero_point) * scale
+
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        with self._lock:
+            batch_size = images.shape[0]
+            if batch_size != self._batch_size:
+                self._interpreter.resize_tensor_input(
+                    self._input_index, [batch_size, *images.shape[1:]], strict=False
+                )
+                self._interpreter.allocate_tensors()
+                self._batch_size = batch_size
+            self._interpreter.set_tensor(self._input_index, self._quantize_input(images))
+            self._interpreter.invoke()
+            outputs = self._interpreter.get_tensor(self._output_index).copy()
+        return self._dequantize_output(outputs)
+
+
+class ONNXModel:
+    """Wrapper cho onnxruntime.InferenceSession (cần cài `onnxruntime`)"""
+
+    backend = "onnx"
+
+    def __init__(self, model_path: Path, num_threads: Optional[int] = None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError(
+                "MODEL_BACKEND=onnx requires onnxruntime (pip install onnxruntime)"
+            ) from e
+
+        self.model_path = Path(model_path)
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self._session = ort.InferenceSession(
+            str(self.model_path),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+
+        model_input = self._session.get_inputs()[0]
+        model_output = self._session.get_outputs()[0]
+        self._input_name = model_input.name
+        height, width = model_input.shape[1], model_input.shape[2]
+        self.input_size = int(height)
+        self.input_shape: Tuple = (None, int(height), int(width), 3)
+        self.output_shape: Tuple = (None, int(model_output.shape[-1]))
+
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        # InferenceSession.run thread-safe, không cần lock
+        return self._session.run(None, {self._input_name: images.astype(np.float32, copy=False)})[0]
+
+
+class SavedModelSnapshot:
+    """
+    Snapshot SavedModel (concrete function đã trace sẵn + checkpoint weights).
+
+    Load bằng tf.saved_model.load: không deserialize / dựng lại các Keras layer
+    và không phải trace lại graph như khi load file .keras, nên cold start
+    nhanh hơn nhiều; warm-up chỉ còn chi phí của lần chạy đầu.
+    """
+
+    backend = "savedmodel"
+
+    def __init__(self, model_path: Path):
+        self.model_path = Path(model_path)
+        self._module = tf.saved_model.load(str(self.model_path))
+        self._serve = self._module.signatures["serving_default"]
+
+        input_spec = list(self._serve.structured_input_signature[1].values())[0]
+        output_spec = list(self._serve.structured_outputs.values())[0]
+        self._output_key = list(self._serve.structured_outputs.keys())[0]
+        height, width = int(input_spec.shape[1]), int(input_spec.shape[2])
+        self.input_size = height
+        self.input_shape: Tuple = (None, height, width, 3)
+        self.output_shape: Tuple = (None, int(output_spec.shape[-1]))
+
+    @property
+    def weights(self):
+        # Cho estimate_model_mb của lazy registry (list tf.Variable do convert_models lưu kèm)
+        return list(getattr(self._module, "weights", []))
+
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        outputs = self._serve(tf.convert_to_tensor(images, dtype=tf.float32))
+        return outputs[self._output_key].numpy()
+
+
+def exported_model_path(export_dir: Path, model_file: str, backend: str, quantization: str = "") -> Path:
+    """
+    Đường dẫn file đã convert tương ứng với file .keras gốc.
+    Vd: InceptionV3_models.keras -> exported/InceptionV3_models.float16.tflite
+    """
+    stem = Path(model_file).stem
+    if backend == "tflite":
+        suffix = f".{quantization}" if quantization else ""
+        return Path(export_dir) / f"{stem}{suffix}.tflite"
+    if backend == "onnx":
+        return Path(export_dir) / f"{stem}.onnx"
+    if backend == "savedmodel":
+        return Path(export_dir) / f"{stem}.savedmodel"
+    raise ValueError(f"Unknown model backend: {backend}")
@@ -0,0 +1,256 @@
+"""
+Model Registry - Load models theo yêu cầu (lazy) và evict model ít dùng nhất khi vượt RAM budget
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from collections import OrderedDict, deque
+from pathlib import Path
+import gc
+import os
+import threading
+import time
+
+
+# loader(model_name, model_path) -> (model, inference callable hoặc model)
+ModelLoader = Callable[[str, Path], Tuple[Any, Any]]
+
+
+def _rss_mb() -> Optional[float]:
+    """Resident memory của process (Linux /proc), None nếu không đọc được"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except Exception:
+        return None
+
+
+def estimate_model_mb(model: Any, model_path: Optional[Path] = None) -> float:
+    """Ước lượng RAM của model: tổng kích thước weights, fallback kích thước file"""
+    weights = getattr(model, "weights", None)
+    if weights:
+        total = 0
+        for weight in weights:
+            dtype_size = getattr(getattr(weight, "dtype", None), "size", None)
+            if dtype_size is None:
+                import tensorflow as tf
+                dtype_size = tf.as_dtype(weight.dtype).size
+            count = 1
+            for dim in weight.shape:
+                count *= int(dim)
+            total += count * dtype_size
+        return total / (1024 * 1024)
+    if model_path is not None and Path(model_path).exists():
+        return Path(model_path).stat().st_size / (1024 * 1024)
+    return 0.0
+
+
+class _Entry:
+    """Model đang nằm trong RAM"""
+
+    def __init__(self, model: Any, runner: Any, memory_mb: float):
+        self.model = model
+        self.runner = runner
+        self.memory_mb = memory_mb
+
+
+class LazyModelRegistry:
+    """
+    Registry load model lần đầu được dùng, giữ thứ tự LRU và evict model ít
+    dùng nhất khi tổng RAM ước lượng vượt `memory_budget_mb`.
+
+    Model đã cấp cho request hiện tại không bị evict trong request đó; model
+    không vừa budget thì bị bỏ qua (request chạy với các model còn lại).
+    """
+
+    def __init__(
+        self,
+        loader: ModelLoader,
+        model_paths: Dict[str, Path],
+        memory_budget_mb: float = 0.0,
+        max_events: int = 100,
+        on_evict: Optional[Callable[[str], None]] = None,
+    ):
+        self.loader = loader
+        # Gọi khi model bị evict, trước gc.collect (vd. bỏ object khác còn giữ model)
+        self.on_evict = on_evict
+        self.model_paths = dict(model_paths)
+        self.memory_budget_mb = memory_budget_mb  # 0 = không giới hạn
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._measured_mb: Dict[str, float] = {}  # RAM đo được ở lần load trước
+        # Model đang load (ngoài lock): Event để request khác chờ, RAM ước lượng đã giữ chỗ
+        self._loading: Dict[str, threading.Event] = {}
+        self._reserved_mb: Dict[str, float] = {}
+        self._lock = threading.RLock()
+        self.events: deque = deque(maxlen=max_events)
+        self.stats: Dict[str, Dict[str, Any]] = {
+            model_name: {"loads": 0, "evictions": 0, "last_load_ms": None, "memory_mb": None, "last_used": None}
+            for model_name in self.model_paths
+        }
+
+    @property
+    def model_names(self) -> List[str]:
+        return list(self.model_paths)
+
+    @property
+    def resident_mb(self) -> float:
+        return sum(entry.memory_mb for entry in self._entries.values())
+
+    def is_resident(self, model_name: str) -> bool:
+        return model_name in self._entries
+
+    def acquire(self, model_names: Optional[List[str]] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Đảm bảo các model cần dùng đã nằm trong RAM (blocking, gọi từ thread pool).
+        Lock chỉ giữ khi đọc / sửa trạng thái: file model được load ngoài lock nên request
+        dùng model đã resident không phải chờ model khác đang load.
+
+        Returns:
+            ({model_name: model}, {model_name: inference callable}) của các model sẵn sàng
+        """
+        requested = [name for name in (model_names or self.model_names) if name in self.model_paths]
+        models: Dict[str, Any] = {}
+        runners: Dict[str, Any] = {}
+        for model_name in requested:
+            entry = self._get_or_load(model_name, protected=set(models))
+            if entry is None:
+                continue
+            models[model_name] = entry.model
+            runners[model_name] = entry.runner
+        return models, runners
+
+    def _get_or_load(self, model_name: str, protected: set) -> Optional[_Entry]:
+        """Entry đang resident, hoặc load (một lần dù nhiều request cùng cần) rồi trả về"""
+        with self._lock:
+            entry = self._entries.get(model_name)
+            loading = self._loading.get(model_name)
+            if entry is None and loading is None:
+                # Giữ chỗ trong budget + đánh dấu đang load trước khi nhả lock
+                model_path = self.model_paths[model_name]
+                expected_mb = self._measured_mb.get(model_name) or estimate_model_mb(None, model_path)
+                if not self._make_room(expected_mb, protected):
+                    self._event("skipped", model_name, memory_mb=expected_mb,
+                                detail=f"does not fit memory budget {self.memory_budget_mb:.0f} MB")
+                    return None
+                self._loading[model_name] = threading.Event()
+                self._reserved_mb[model_name] = expected_mb
+
+        if entry is None and loading is not None:
+            # Request khác đang load model này: chờ kết quả thay vì load lần nữa
+            loading.wait()
+            with self._lock:
+                entry = self._entries.get(model_name)
+        elif entry is None:
+            entry = self._load(model_name, model_path, protected)
+
+        if entry is not None:
+            with self._lock:
+                if model_name in self._entries:
+                    self._entries.move_to_end(model_name)
+                self.stats[model_name]["last_used"] = time.time()
+        return entry
+
+    def _load(self, model_name: str, model_path: Path, protected: set) -> Optional[_Entry]:
+        """Load một model (gọi ngoài lock, chỗ trong budget đã được giữ bởi _get_or_load)"""
+        rss_before = _rss_mb()
+        start = time.perf_counter()
+        try:
+            model, runner = self.loader(model_name, model_path)
+        except Exception as e:
+            gc.collect()
+            with self._lock:
+                self._reserved_mb.pop(model_name, None)
+                self._event("load_failed", model_name, detail=f"{type(e).__name__}: {e}")
+                self._loading.pop(model_name).set()
+            print(f"❌ Lazy load failed for {model_name}: {e}")
+            return None
+        load_ms = (time.perf_counter() - start) * 1000
+        rss_after = _rss_mb()
+        memory_mb = estimate_model_mb(model, model_path)
+
+        with self._lock:
+            self._reserved_mb.pop(model_name, None)
+            entry = self._entries.get(model_name)
+            if entry is None:
+                entry = _Entry(model, runner, memory_mb)
+                self._entries[model_name] = entry
+                self._measured_mb[model_name] = memory_mb
+                stats = self.stats[model_name]
+                stats["loads"] += 1
+                stats["last_load_ms"] = round(load_ms, 1)
+                stats["memory_mb"] = round(memory_mb, 1)
+                self._event(
+                    "load", model_name, duration_ms=load_ms, memory_mb=memory_mb,
+                    rss_delta_mb=(rss_after - rss_before) if rss_before is not None and rss_after is not None else None,
+                )
+                print(f"✅ Lazy loaded {model_name} in {load_ms:.0f} ms ({memory_mb:.0f} MB)")
+                # Ước lượng trước có thể sai: evict thêm nếu vẫn vượt budget
+                self._make_room(0.0, protected | {model_name})
+            # else: swap() (hot reload) đã đặt version mới trong lúc load, bỏ bản vừa load
+            self._loading.pop(model_name).set()
+        return entry
+
+    def _make_room(self, needed_mb: float, protected: set) -> bool:
+        """Evict model LRU (không thuộc request hiện tại) cho tới khi đủ chỗ"""
+        if self.memory_budget_mb <= 0:
+            return True
+        while self.resident_mb + sum(self._reserved_mb.values()) + needed_mb > self.memory_budget_mb:
+            victim = next((name for name in self._entries if name not in protected), None)
+            if victim is None:
+                return False
+            self.evict(victim)
+        return True
+
+    def evict(self, model_name: str):
+        """Bỏ model khỏi RAM (request đang dùng vẫn giữ reference tới khi xong)"""
+        with self._lock:
+            entry = self._entries.pop(model_name, None)
+            if entry is None:
+                return
+            start = time.perf_counter()
+            memory_mb = entry.memory_mb
+            del entry
+            if self.on_evict is not None:
+                self.on_evict(model_name)
+            gc.collect()
+            self.stats[model_name]["evictions"] += 1
+            self._event("evict", model_name, duration_ms=(time.perf_counter() - start) * 1000, memory_mb=memory_mb)
+            print(f"♻️  Evicted {model_name} ({memory_mb:.0f} MB) to stay within memory budget")
+
+    def swap(self, model_name: str, model_path: Path, model: Any, runner: Any) -> Optional[Any]:
+        """
+        Thay model (hot reload) bằng bản đã load sẵn; các lần lazy load sau dùng model_path mới.
+
+        Returns:
+            Model cũ nếu đang nằm trong RAM (request đang dùng vẫn giữ tới khi xong)
+        """
+        with self._lock:
+            old = self._entries.pop(model_name, None)
+            self.model_paths[model_name] = model_path
+            memory_mb = estimate_model_mb(model, model_path)
+            self._measured_mb[model_name] = memory_mb
+            self._entries[model_name] = _Entry(model, runner, memory_mb)
+            self.stats[model_name]["memory_mb"] = round(memory_mb, 1)
+            self._event("swap", model_name, memory_mb=memory_mb, detail=str(model_path))
+            self._make_room(0.0, {model_name})
+        return old.model if old is not None else None
+
+    def _event(self, event: str, model_name: str, **details):
+        record = {"event": event, "model": model_name, "at": round(time.time(), 3)}
+        for key, value in details.items():
+            record[key] = round(value, 1) if isinstance(value, float) else value
+        self.events.append(record)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Trạng thái registry cho /health"""
+        return {
+            "memory_budget_mb": self.memory_budget_mb or None,
+            "resident_mb": round(self.resident_mb, 1),
+            "resident": list(self._entries),
+            "loading": list(self._loading),
+            "models": {
+                model_name: {**stats, "resident": model_name in self._entries}
+                for model_name, stats in self.stats.items()
+            },
+            "events": list(self.events)[-20:],
+        }
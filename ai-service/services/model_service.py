@@ -2,43 +2,380 @@
 Model Service - Quản lý việc load và lưu trữ models
 """
 
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from contextlib import contextmanager
 from pathlib import Path
-import tensorflow as tf
-import numpy as np
+import asyncio
+import gc
 import json
 import os
+import re
+import time
+import weakref
+
+from utils.config import env_bool, env_float, env_int, env_list, env_str
+from utils.runtime import configure_runtime, get_runtime_stats
+
+# Configure TensorFlow (GPU memory growth, oneDNN, intra/inter-op threads theo RUNTIME_PROFILE);
+# phải chạy trước khi import TensorFlow thì env mới có tác dụng
+configure_runtime()
+
+import tensorflow as tf
+import numpy as np
+
+from services.model_backends import ONNXModel, SavedModelSnapshot, TFLiteModel, exported_model_path
+from services.model_registry import LazyModelRegistry, estimate_model_mb
+from services.precision import (
+    MODEL_PRECISIONS, calibration_batch, cast_model, compare_precision, cpu_supports_bf16, resolve_precision,
+)
+from utils.dataset import list_images
+
+# Map tên model (dùng trong code) -> file .keras tương ứng trong thư mục models
+MODEL_FILES = {
+    "inception_v3": "InceptionV3_models.keras",
+    "resnet152_v2": "ResNet152V2_models.keras",
+    "vgg19": "VGG19_models.keras",
+    # 2 models mới
+    "inception_resnet_v2": "InceptionResNetV2_models.keras",
+    "xception": "Xception_models.keras",
+}
+
+# Backends hỗ trợ: Keras gốc hoặc file đã convert bằng tools/convert_models.py
+# (savedmodel = snapshot đã trace sẵn, khởi động nhanh)
+MODEL_BACKENDS = {"keras", "tflite", "onnx", "savedmodel"}
+
+# Kích thước input của từng kiến trúc (Inception/Xception cần 299x299)
+MODEL_INPUT_SIZES = {
+    "inception_v3": 299,
+    "resnet152_v2": 224,
+    "vgg19": 224,
+    "inception_resnet_v2": 299,
+    "xception": 299,
+}
+DEFAULT_INPUT_SIZE = 224
+
+# Serving mode: "ensemble" chạy 5 models, "student" chạy 1 model distill từ ensemble
+# (tools/distill_student.py), mỗi head bắt chước một teacher
+SERVING_MODES = {"ensemble", "student"}
+STUDENT_MODEL_FILE = "student.keras"
+STUDENT_MODEL_NAME = "student"
+
+# FUSED_ENSEMBLE=true: mọi model của ensemble chạy trong một graph, phục vụ dưới tên này
+FUSED_MODEL_NAME = "ensemble"
+
+# Versioned layout: models/<model_name>/<version>/<file model>; file CURRENT trong
+# models/<model_name>/ ghi version đang active (không có thì lấy version mới nhất).
+# Layout phẳng cũ (models/<file model>) là version BASE_VERSION.
+BASE_VERSION = "base"
+VERSION_POINTER_FILE = "CURRENT"
+_VERSION_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+
+def _version_sort_key(version: str):
+    """Sort tự nhiên: v2 < v10, 2024-01-02 < 2024-11-01"""
+    return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r"(\d+)", version) if part]
+
+
+def _compile_inference(model: Any, input_shape, dtype) -> Callable:
+    """
+    tf.function với input signature cố định cho một dtype. uint8: cast + chia 255 trong
+    graph, cùng phép chia float32 như ImageProcessor nên kết quả giống hệt bản float.
+    Số chia là Variable: với hằng số, grappler đổi phép chia thành nhân với 1/255
+    (lệch 1 ulp ở một số pixel).
+    """
+    scale = tf.Variable(255.0, trainable=False, dtype=tf.float32) if dtype == tf.uint8 else None
+    
+    @tf.function(input_signature=[tf.TensorSpec([None, *input_shape], dtype)])
+    def infer(images):
+        if scale is not None:
+            images = tf.cast(images, tf.float32) / scale
+        return model(images, training=False)
+    
+    return infer
+
+
+def _run_compiled(infer: Callable, infer_uint8: Optional[Callable], images: np.ndarray):
+    """Chọn graph theo dtype của batch; uint8 gửi tới model chỉ có graph float thì chia 255 ở đây"""
+    if images.dtype == np.uint8:
+        if infer_uint8 is not None:
+            return infer_uint8(images)
+        images = images.astype(np.float32) / 255.0
+    return infer(images)
+
+
+class CompiledInference:
+    """
+    Inference callable đã compile bằng tf.function cho một model.
+
+    Input signature cố định (batch thay đổi, H/W cố định) nên graph chỉ trace
+    một lần; gọi trực tiếp model thay vì model.predict() để bỏ overhead
+    data adapter + callbacks ở mỗi request.
+    
+    accepts_uint8=True: request path gửi pixel uint8 (chuẩn hóa trong graph); input
+    float [0, 1] (TTA views, tools) vẫn chạy graph float riêng, trace khi cần.
+    """
+    
+    def __init__(self, model_name: str, model: tf.keras.Model, input_size: int, accepts_uint8: bool = False):
+        self.model_name = model_name
+        self.input_size = input_size
+        self.accepts_uint8 = accepts_uint8
+        self.warmup_ms: Optional[float] = None
+        input_shape = (input_size, input_size, 3)
+        self._infer = _compile_inference(model, input_shape, tf.float32)
+        self._infer_uint8 = _compile_inference(model, input_shape, tf.uint8) if accepts_uint8 else None
+    
+    def warmup(self) -> float:
+        """Chạy 1 lần với ảnh rỗng để trace graph trước khi nhận request"""
+        start = time.perf_counter()
+        self(np.zeros((1, self.input_size, self.input_size, 3), dtype=np.uint8 if self.accepts_uint8 else np.float32))
+        self.warmup_ms = (time.perf_counter() - start) * 1000
+        return self.warmup_ms
+    
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        outputs = _run_compiled(self._infer, self._infer_uint8, images)
+        if isinstance(outputs, (list, tuple)):
+            outputs = outputs[0]
+        return outputs.numpy()
+
+
+class MultiHeadModel:
+    """
+    Student multi-head (một backbone, một head / teacher) đã compile bằng tf.function.
+
+    Output (N, num_heads, num_classes); PredictionService tách mỗi head thành một
+    kết quả riêng nên voting / response giữ nguyên format như ensemble.
+    """
+    
+    def __init__(self, model: tf.keras.Model, accepts_uint8: bool = False):
+        self.model = model
+        self.accepts_uint8 = accepts_uint8
+        input_shape = model.input_shape
+        if isinstance(input_shape, list):
+            input_shape = input_shape[0]
+        self.input_shape = tuple(input_shape)
+        output_names = list(getattr(model, "output_names", None) or [])
+        # Model 1 output -> xử lý như một model thường
+        self.head_names: Optional[List[str]] = output_names if len(output_names) > 1 else None
+        output_shape = model.output_shape
+        if isinstance(output_shape, list):
+            output_shape = output_shape[0]
+        self.num_classes = int(output_shape[-1])
+        self.output_shape = (None, len(self.head_names), self.num_classes) if self.head_names else (None, self.num_classes)
+        self.warmup_ms: Optional[float] = None
+        
+        self._infer = _compile_inference(model, self.input_shape[1:], tf.float32)
+        self._infer_uint8 = _compile_inference(model, self.input_shape[1:], tf.uint8) if accepts_uint8 else None
+    
+    @property
+    def weights(self):
+        return self.model.weights
+    
+    def warmup(self) -> float:
+        start = time.perf_counter()
+        self(np.zeros((1, *self.input_shape[1:]), dtype=np.uint8 if self.accepts_uint8 else np.float32))
+        self.warmup_ms = (time.perf_counter() - start) * 1000
+        return self.warmup_ms
+    
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        outputs = _run_compiled(self._infer, self._infer_uint8, images)
+        if isinstance(outputs, dict):
+            outputs = [outputs[name] for name in self.head_names or outputs]
+        if isinstance(outputs, (list, tuple)):
+            if not self.head_names:
+                return outputs[0].numpy()
+            return np.stack([output.numpy() for output in outputs], axis=1)
+        return outputs.numpy()
 
-# Configure TensorFlow để tối ưu memory
-os.environ['TF_FORCE_GPU_ALLOW_GROWTH'] = 'true'
-# Disable oneDNN optimizations để giảm memory usage
-os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
+
+class FusedEnsemble:
+    """
+    Mọi model của ensemble trong một tf.function: nhận batch uint8 (N, S, S, 3) ở kích
+    thước input lớn nhất, chia 255 + resize cho từng model ngay trong graph, trả về
+    (N, num_models, num_classes).
+
+    Một lần gọi thay cho 5 lần dispatch qua 5 executor thread: TF tự chạy song song
+    các nhánh độc lập trong inter-op pool, không tranh GIL. Output có head_names như
+    student multi-head nên PredictionService tách lại thành kết quả từng model.
+    """
+    
+    def __init__(self, models: Dict[str, tf.keras.Model], input_sizes: Dict[str, int]):
+        self.head_names: List[str] = list(models)
+        self.input_sizes = dict(input_sizes)
+        self.input_size = max(self.input_sizes.values())
+        self.input_shape = (None, self.input_size, self.input_size, 3)
+        members = list(models.items())
+        output_shape = members[0][1].output_shape
+        if isinstance(output_shape, list):
+            output_shape = output_shape[0]
+        self.num_classes = int(output_shape[-1])
+        self.output_shape = (None, len(members), self.num_classes)
+        self.accepts_uint8 = True
+        self._models = models
+        self.warmup_ms: Optional[float] = None
+        
+        @tf.function(input_signature=[tf.TensorSpec([None, self.input_size, self.input_size, 3], tf.uint8)])
+        def infer(images):
+            images = tf.cast(images, tf.float32) / 255.0
+            resized = {self.input_size: images}
+            outputs = []
+            for model_name, model in members:
+                size = self.input_sizes[model_name]
+                if size not in resized:
+                    resized[size] = tf.image.resize(images, (size, size), method="bilinear", antialias=True)
+                output = model(resized[size], training=False)
+                if isinstance(output, (list, tuple)):
+                    output = output[0]
+                outputs.append(output)
+            return tf.stack(outputs, axis=1)
+        
+        self._infer = infer
+    
+    @property
+    def weights(self):
+        return [weight for model in self._models.values() for weight in model.weights]
+    
+    def warmup(self) -> float:
+        start = time.perf_counter()
+        self(np.zeros((1, self.input_size, self.input_size, 3), dtype=np.uint8))
+        self.warmup_ms = (time.perf_counter() - start) * 1000
+        return self.warmup_ms
+    
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        if images.dtype != np.uint8:
+            # Ảnh float [0, 1] từ preprocess_multi: đổi về uint8 (không mất thông tin vì ảnh gốc là 8-bit)
+            images = np.round(images * 255.0).astype(np.uint8)
+        return self._infer(images).numpy()
 
 
 class ModelService:
     """Service để quản lý các AI models"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        model_names: Optional[List[str]] = None,
+        num_workers: Optional[int] = None,
+        lazy_loading: Optional[bool] = None,
+        serving_mode: Optional[str] = None,
+        fused: Optional[bool] = None,
+    ):
         self.models: Dict[str, tf.keras.Model] = {}
-        self.models_path = Path("models")  # Thư mục chứa các model files
+        self.models_path = Path(env_str("MODELS_DIR", "models"))  # Thư mục chứa các model files
         self.class_names = []  # Sẽ được load từ model hoặc config
         
+        # Compiled inference (tf.function) thay cho model.predict();
+        # USE_COMPILED_INFERENCE=false để quay về legacy path khi cần so sánh
+        self.use_compiled_inference = env_bool("USE_COMPILED_INFERENCE", True)
+        # UINT8_INPUTS: compiled model nhận pixel uint8 và chia 255 trong graph
+        # (ít memory traffic hơn 4 lần, kết quả giống hệt)
+        self.uint8_inputs = env_bool("UINT8_INPUTS", False)
+        self.inference_fns: Dict[str, Callable[[np.ndarray], np.ndarray]] = {}
+        
+        # Backend phục vụ: keras (mặc định) | tflite | onnx
+        self.backend = env_str("MODEL_BACKEND", "keras").lower()
+        if self.backend not in MODEL_BACKENDS:
+            print(f"⚠️  Unknown MODEL_BACKEND={self.backend}, falling back to keras")
+            self.backend = "keras"
+        self.quantization = env_str("MODEL_QUANTIZATION", "float16").lower()  # chỉ dùng cho tflite
+        self.export_path = Path(env_str("MODEL_EXPORT_DIR", str(self.models_path / "exported")))
+        # Mặc định theo intra-op threads của RUNTIME_PROFILE (None = backend tự chọn)
+        self.backend_threads = env_int("MODEL_BACKEND_THREADS", 0) or get_runtime_stats().get("intra_op_threads")
+        
+        # Chỉ load một phần models (vd. worker process được giao một nhóm models)
+        self.model_names = model_names or list(MODEL_FILES)
+        
+        # Multi-process inference: MODEL_WORKERS > 0 thì models nằm trong worker processes,
+        # self.models chứa RemoteModel proxies
+        self.num_workers = num_workers if num_workers is not None else env_int("MODEL_WORKERS", 0)
+        self.worker_pool = None
+        
+        # Lazy loading: model chỉ load khi request đầu tiên cần tới, evict LRU khi
+        # vượt MODEL_MEMORY_BUDGET_MB (0 = không giới hạn)
+        self.lazy_loading = lazy_loading if lazy_loading is not None else env_bool("LAZY_MODEL_LOADING", False)
+        self.memory_budget_mb = env_float("MODEL_MEMORY_BUDGET_MB", 0.0)
+        self.registry: Optional[LazyModelRegistry] = None
+        
+        # Thời gian khởi động theo từng phase (ms) cho /health
+        self.startup_stats: Dict = {"phases_ms": {}, "models": {}}
+        
+        # Serving mode: ensemble (mặc định) | student (STUDENT_MODEL_PATH, mặc định models/student.keras)
+        self.serving_mode = (serving_mode or env_str("SERVING_MODE", "ensemble")).lower()
+        if self.serving_mode not in SERVING_MODES:
+            print(f"⚠️  Unknown SERVING_MODE={self.serving_mode}, falling back to ensemble")
+            self.serving_mode = "ensemble"
+        self.student_path = Path(env_str("STUDENT_MODEL_PATH", str(self.models_path / STUDENT_MODEL_FILE)))
+        
+        # Fused ensemble: một graph chạy mọi model (chỉ với Keras backend, load eager trong process chính)
+        self.fused_enabled = fused if fused is not None else env_bool("FUSED_ENSEMBLE", False)
+        self.fused: Optional[FusedEnsemble] = None
+        
+        # Mixed precision lúc load (chỉ Keras backend): float32 (mặc định) | bfloat16 | float16 | auto.
+        # Mỗi model chỉ được đổi khi bản precision thấp còn trong tolerance so với float32
+        self.precision = env_str("MODEL_PRECISION", "float32").lower()
+        if self.precision not in MODEL_PRECISIONS:
+            print(f"⚠️  Unknown MODEL_PRECISION={self.precision}, falling back to float32")
+            self.precision = "float32"
+        self.precision_models = env_list("MODEL_PRECISION_MODELS", [])  # rỗng = mọi model
+        self.precision_stats: Dict[str, Dict] = {}
+        
+        # Version đang phục vụ của từng model + trạng thái hot reload gần nhất
+        self.model_versions: Dict[str, str] = {}
+        self.reloads: Dict[str, Dict] = {}
+        # Callback(model_name) sau khi swap version (vd. embedding extractor giữ model cũ)
+        self.reload_listeners: List[Callable[[str], None]] = []
+        # Callback(model_name) khi lazy registry evict model (vd. bỏ embedding extractor giữ model đó)
+        self.evict_listeners: List[Callable[[str], None]] = []
+        self.reload_drain_timeout = env_float("MODEL_RELOAD_DRAIN_TIMEOUT", 60.0)
+        self._release_tasks: set = set()
+        self._fused_lock = asyncio.Lock()
+        
     async def load_all_models(self):
         """
         Load tất cả models vào RAM.
         Models sẽ được giữ trong RAM để tránh cold start.
         """
+        startup_start = time.perf_counter()
+        try:
+            await self._load_all_models()
+        finally:
+            self.startup_stats["backend"] = self.get_inference_mode()
+            self.startup_stats["total_ms"] = round((time.perf_counter() - startup_start) * 1000, 1)
+            phases = ", ".join(f"{phase} {ms / 1000:.1f}s" for phase, ms in self.startup_stats["phases_ms"].items())
+            print(f"⏱️  Model startup: {self.startup_stats['total_ms'] / 1000:.1f}s ({phases})")
+    
+    async def _load_all_models(self):
         # Load class names từ file nếu có
-        self._load_class_names()
+        with self._startup_phase("class_names"):
+            self._load_class_names()
+        
+        if self.fused_enabled and (self.serving_mode == "student" or self.num_workers > 0 or self.lazy_loading):
+            print("⚠️  FUSED_ENSEMBLE is ignored with SERVING_MODE=student, MODEL_WORKERS or LAZY_MODEL_LOADING")
+            self.fused_enabled = False
+        if self.fused_enabled and env_str("ENSEMBLE_MODE", "full").lower() == "cascade":
+            # Fused ensemble là một model duy nhất: cascade không dừng sớm được, luôn chạy đủ model
+            print("⚠️  FUSED_ENSEMBLE is ignored with ENSEMBLE_MODE=cascade (cascade needs separate models)")
+            self.fused_enabled = False
+        
+        if self.serving_mode == "student":
+            if self.num_workers > 0 or self.lazy_loading:
+                print("⚠️  MODEL_WORKERS / LAZY_MODEL_LOADING are ignored when SERVING_MODE=student")
+                self.num_workers = 0
+                self.lazy_loading = False
+            self._load_student()
+            return
+        
+        if self.num_workers > 0:
+            if self.lazy_loading:
+                print("⚠️  LAZY_MODEL_LOADING is ignored when MODEL_WORKERS > 0")
+            await self._start_worker_pool()
+            return
+        
+        if self.lazy_loading:
+            await self._init_lazy_registry()
+            return
         
-        # Map tên model (dùng trong code) -> file .keras tương ứng trong thư mục models
         model_files = {
-            "inception_v3": "InceptionV3_models.keras",
-            "resnet152_v2": "ResNet152V2_models.keras",
-            "vgg19": "VGG19_models.keras",
-            # 2 models mới
-            "inception_resnet_v2": "InceptionResNetV2_models.keras",
-            "xception": "Xception_models.keras",
+            model_name: model_file for model_name, model_file in MODEL_FILES.items()
+            if model_name in self.model_names
         }
         
         loaded_count = 0
@@ -46,7 +383,7 @@ class ModelService:
         
         for model_name, model_file in model_files.items():
             try:
-                model_path = self.models_path / model_file
+                version, model_path = self._resolve_model_path(model_name)
                 if model_path.exists():
                     print(f"🔄 Loading {model_name} from {model_path}...")
                     try:
@@ -55,11 +392,30 @@ class ModelService:
                         import os
                         os.environ['TF_FORCE_GPU_ALLOW_GROWTH'] = 'true'
                         
-                        # Load model với compile=False để tiết kiệm memory
-                        model = tf.keras.models.load_model(str(model_path), compile=False)
+                        load_start = time.perf_counter()
+                        with self._startup_phase("load"):
+                            model = self._load_model(model_path)
+                        load_ms = (time.perf_counter() - load_start) * 1000
+                        with self._startup_phase("precision"):
+                            model = self._apply_precision(model_name, model)
+                        model.model_version = version
                         self.models[model_name] = model
+                        self.model_versions[model_name] = version
                         loaded_count += 1
                         
+                        with self._startup_phase("warmup"):
+                            if self.backend != "keras":
+                                # TFLite/ONNX/SavedModel wrapper tự là inference callable
+                                self.inference_fns[model_name] = model
+                                self._warmup_backend(model_name, model)
+                            elif self.use_compiled_inference:
+                                self._build_inference_fn(model_name, model)
+                        warmup_fn = self.inference_fns.get(model_name)
+                        self.startup_stats["models"][model_name] = {
+                            "load_ms": round(load_ms, 1),
+                            "warmup_ms": round(getattr(warmup_fn, "warmup_ms", None) or 0.0, 1),
+                        }
+                        
                         # Clear memory sau khi load
                         import gc
                         gc.collect()
@@ -95,7 +451,7 @@ class ModelService:
                         # Tiếp tục load các model khác thay vì raise
                 else:
                     failed_count += 1
-                    print(f"⚠️  Model file not found: {model_file} (skipping)")
+                    print(f"⚠️  Model file not found: {model_path} (skipping)")
             except Exception as e:
                 failed_count += 1
                 print(f"❌ Unexpected error processing {model_name}: {e}")
@@ -114,11 +470,590 @@ class ModelService:
         if failed_count > 0:
             print(f"⚠️  Warning: {failed_count} model(s) failed to load. Server will continue with available models.")
         
+        if self.fused_enabled:
+            with self._startup_phase("fuse"):
+                self._build_fused_ensemble()
+        
         # Log class names đã load
         if self.class_names:
             print(f"📋 Class names loaded: {len(self.class_names)} classes")
             print(f"   First 5: {self.class_names[:5]}")
     
+    def _build_fused_ensemble(self):
+        """Gộp các Keras model đã load thành một FusedEnsemble (lỗi thì giữ từng model riêng)"""
+        if self.backend != "keras":
+            print(f"⚠️  FUSED_ENSEMBLE needs MODEL_BACKEND=keras (current: {self.backend}), skipping")
+            return
+        if len(self.models) < 2:
+            return
+        try:
+            fused = self._make_fused(self.models)
+        except Exception as e:
+            print(f"⚠️  Could not build fused ensemble, running models separately: {e}")
+            return
+        self.fused = fused
+        warmup_ms = fused.warmup_ms
+        print(f"⚡ Fused ensemble: {', '.join(fused.head_names)} in one graph "
+              f"(uint8 {fused.input_size}x{fused.input_size}, warm-up {warmup_ms:.0f} ms)")
+    
+    def _make_fused(self, models: Dict[str, Any]) -> FusedEnsemble:
+        """Build + warm-up FusedEnsemble từ các Keras model (ghi lại version của từng member)"""
+        fused = FusedEnsemble(
+            models,
+            {model_name: self.get_input_size(model_name, model) for model_name, model in models.items()},
+        )
+        fused.member_versions = {
+            model_name: getattr(model, "model_version", BASE_VERSION) for model_name, model in models.items()
+        }
+        fused.warmup()
+        return fused
+    
+    @contextmanager
+    def _startup_phase(self, phase: str):
+        """Cộng dồn thời gian (ms) của một phase khởi động"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phases = self.startup_stats["phases_ms"]
+            phases[phase] = round(phases.get(phase, 0.0) + (time.perf_counter() - start) * 1000, 1)
+    
+    def get_startup_stats(self) -> Dict:
+        """Thời gian khởi động từng phase + từng model cho /health"""
+        return self.startup_stats
+    
+    def _warmup_backend(self, model_name: str, model):
+        """Chạy 1 lần với ảnh rỗng (allocate tensors / chạy graph lần đầu) trước khi nhận request"""
+        start = time.perf_counter()
+        try:
+            model(np.zeros((1, *model.input_shape[1:]), dtype=np.float32))
+        except Exception as e:
+            print(f"⚠️  Warm-up failed for {model_name}: {e}")
+            return
+        model.warmup_ms = (time.perf_counter() - start) * 1000
+        print(f"⚡ Warmed up {model_name} ({self.backend}, {model.warmup_ms:.0f} ms)")
+    
+    def _load_student(self):
+        """Load student distill (Keras) thay cho 5 models của ensemble"""
+        if not self.student_path.exists():
+            raise RuntimeError(
+                f"Student model not found: {self.student_path} (train it with python -m tools.distill_student)"
+            )
+        print(f"🔄 Loading student model from {self.student_path}...")
+        model = tf.keras.models.load_model(str(self.student_path), compile=False)
+        student = MultiHeadModel(self._apply_precision(STUDENT_MODEL_NAME, model), accepts_uint8=self.uint8_inputs)
+        warmup_ms = student.warmup()
+        self.models[STUDENT_MODEL_NAME] = student
+        self.inference_fns[STUDENT_MODEL_NAME] = student
+        heads = ", ".join(student.head_names) if student.head_names else "single head"
+        print(f"✅ Loaded student ({heads}; input {student.input_shape[1]}, warm-up {warmup_ms:.0f} ms)")
+        
+        if not self.class_names:
+            self.class_names = [f"class_{i}" for i in range(student.num_classes)]
+            print(f"⚠️  Using default class names (class_0, class_1, ...)")
+    
+    async def _init_lazy_registry(self):
+        """Tạo registry lazy; chỉ preload các model trong LAZY_PRELOAD_MODELS"""
+        model_paths = {}
+        for model_name in MODEL_FILES:
+            if model_name not in self.model_names:
+                continue
+            version, model_path = self._resolve_model_path(model_name)
+            if model_path.exists():
+                model_paths[model_name] = model_path
+                self.model_versions[model_name] = version
+            else:
+                print(f"⚠️  Model file not found: {model_path} (skipping)")
+        if not model_paths:
+            raise RuntimeError("No model files found! Please check model files.")
+        
+        self.registry = LazyModelRegistry(
+            self._load_entry, model_paths, self.memory_budget_mb, on_evict=self._notify_evicted
+        )
+        budget = f"{self.memory_budget_mb:.0f} MB" if self.memory_budget_mb > 0 else "unlimited"
+        print(f"💤 Lazy model loading: {len(model_paths)} models available, memory budget {budget}")
+        
+        preload = [name for name in env_list("LAZY_PRELOAD_MODELS") if name in model_paths]
+        if preload:
+            await self.acquire_models(preload)
+    
+    def _notify_evicted(self, model_name: str):
+        for listener in self.evict_listeners:
+            try:
+                listener(model_name)
+            except Exception as e:
+                print(f"⚠️  Evict listener failed for {model_name}: {e}")
+    
+    def _load_entry(self, model_name: str, model_path: Path, version: Optional[str] = None):
+        """Loader cho registry / hot reload: trả về (model, inference callable)"""
+        print(f"🔄 Loading {model_name} from {model_path}...")
+        model = self._apply_precision(model_name, self._load_model(model_path))
+        model.model_version = version or self.model_versions.get(model_name, BASE_VERSION)
+        runner = model
+        if self.backend != "keras":
+            self._warmup_backend(model_name, model)
+        elif self.use_compiled_inference:
+            try:
+                fn = CompiledInference(
+                    model_name, model, self.get_input_size(model_name, model), accepts_uint8=self.uint8_inputs
+                )
+                fn.warmup()
+                runner = fn
+            except Exception as e:
+                print(f"⚠️  Could not compile inference for {model_name}, using model.predict(): {e}")
+        
+        if not self.class_names:
+            output_shape = model.output_shape
+            if isinstance(output_shape, list):
+                output_shape = output_shape[0]
+            self.class_names = [f"class_{i}" for i in range(output_shape[-1])]
+            print(f"⚠️  Using default class names (class_0, class_1, ...)")
+        return model, runner
+    
+    async def acquire_models(self, model_names: Optional[List[str]] = None):
+        """
+        Models + inference callables cho một request.
+        
+        Ở lazy mode, model chưa có trong RAM sẽ được load (trong thread pool, không
+        block event loop); model không vừa memory budget bị bỏ qua.
+        Fused ensemble: cả ensemble là một model FUSED_MODEL_NAME; chỉ khi chọn một
+        phần models (vd. degraded) mới trả về từng model riêng.
+        
+        Returns:
+            (models, inference_fns)
+        """
+        if self.registry is None:
+            if model_names is None:
+                if self.fused is not None:
+                    return {FUSED_MODEL_NAME: self.fused}, {FUSED_MODEL_NAME: self.fused}
+                return self.models, self.inference_fns
+            return (
+                {name: model for name, model in self.models.items() if name in model_names},
+                {name: fn for name, fn in self.inference_fns.items() if name in model_names},
+            )
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.registry.acquire, model_names)
+    
+    def get_model_names(self) -> List[str]:
+        """Tên các model có thể phục vụ (kể cả model lazy chưa load)"""
+        if self.registry is not None:
+            return self.registry.model_names
+        return list(self.models.keys())
+    
+    def is_full_ensemble(self, models: Dict[str, Any]) -> bool:
+        """
+        `models` (dict một request đã acquire) có đủ mọi model của ensemble không: fused
+        ensemble là một model FUSED_MODEL_NAME thay cho mọi member (head_names).
+        """
+        served = set()
+        for model_name, model in models.items():
+            served.update(model.head_names if model_name == FUSED_MODEL_NAME else [model_name])
+        return served >= set(self.get_model_names())
+    
+    def get_registry_stats(self) -> Optional[Dict]:
+        """Load / eviction events và memory của lazy registry cho /health"""
+        return self.registry.get_stats() if self.registry is not None else None
+    
+    async def _start_worker_pool(self):
+        """Khởi động worker processes và tạo RemoteModel proxy cho từng model"""
+        from services.worker_pool import RemoteModel, WorkerPool, assign_cpus, assign_models
+        
+        model_names = [model_name for model_name in MODEL_FILES if model_name in self.model_names]
+        # File .tflite được mmap -> các process dùng chung page cache, có thể replicate;
+        # Keras giữ weights trong heap riêng -> pin mỗi model vào một worker
+        default_strategy = "replicate" if self.backend == "tflite" else "pin"
+        strategy = env_str("WORKER_MODEL_ASSIGNMENT", default_strategy).lower()
+        assignments = assign_models(model_names, self.num_workers, strategy)
+        if strategy == "replicate" and self.backend == "keras" and self.num_workers > 1:
+            print("⚠️  Replicating Keras models across workers multiplies RAM; "
+                  "use MODEL_BACKEND=tflite (mmap) or WORKER_MODEL_ASSIGNMENT=pin")
+        
+        cpu_count = get_runtime_stats().get("cpus") or os.cpu_count() or 1
+        intra_op_threads = env_int("WORKER_INTRA_OP_THREADS", max(1, cpu_count // self.num_workers))
+        inter_op_threads = env_int("WORKER_INTER_OP_THREADS", 1)
+        # Pin mỗi worker vào một nhóm core riêng (intra-op pool của worker = số core của nhóm)
+        cpu_sets = assign_cpus(self.num_workers) if env_bool("WORKER_CPU_AFFINITY", False) else None
+        print(f"🚀 Starting {self.num_workers} inference workers ({strategy}, "
+              f"intra-op {intra_op_threads}, inter-op {inter_op_threads} threads"
+              f"{', CPU affinity' if cpu_sets else ''})...")
+        
+        self.worker_pool = WorkerPool(assignments, intra_op_threads, inter_op_threads, cpu_sets=cpu_sets)
+        loop = asyncio.get_event_loop()
+        models_info = await loop.run_in_executor(
+            None, self.worker_pool.start, env_int("WORKER_START_TIMEOUT", 600)
+        )
+        
+        request_timeout = env_int("WORKER_REQUEST_TIMEOUT", 60)
+        for model_name in model_names:
+            info = models_info.get(model_name)
+            if info is None:
+                print(f"⚠️  No worker loaded {model_name} (skipping)")
+                continue
+            remote = RemoteModel(
+                self.worker_pool, model_name, info["input_size"], info["num_classes"], request_timeout,
+                accepts_uint8=info.get("accepts_uint8", False),
+            )
+            if info.get("precision"):
+                self.precision_stats[model_name] = info["precision"]
+            remote.model_version = info.get("version") or BASE_VERSION
+            self.model_versions[model_name] = remote.model_version
+            self.models[model_name] = remote
+            self.inference_fns[model_name] = remote
+        
+        print(f"\n📊 Worker pool: {len(self.models)}/{len(model_names)} models available")
+        if not self.models:
+            raise RuntimeError("No models were successfully loaded by inference workers!")
+        
+        if not self.class_names:
+            num_classes = next(iter(models_info.values()))["num_classes"] or 0
+            self.class_names = [f"class_{i}" for i in range(num_classes)]
+            print(f"⚠️  Using default class names (class_0, class_1, ...)")
+    
+    def shutdown(self):
+        """Dừng worker processes (nếu có)"""
+        if self.worker_pool is not None:
+            self.worker_pool.stop()
+    
+    def get_worker_stats(self) -> Optional[Dict]:
+        """Trạng thái worker pool cho /health"""
+        return self.worker_pool.get_stats() if self.worker_pool is not None else None
+    
+    def _model_file_path(self, directory: Path, model_file: str, backend: str) -> Path:
+        """File model trong một thư mục theo backend (.keras gốc hoặc file đã convert)"""
+        if backend == "keras":
+            return directory / model_file
+        quantization = self.quantization if backend == "tflite" else ""
+        return exported_model_path(directory, model_file, backend, quantization)
+    
+    def list_model_versions(self, model_name: str) -> List[str]:
+        """Các version có file model cho backend hiện tại (cũ -> mới, BASE_VERSION đứng đầu)"""
+        model_file = MODEL_FILES[model_name]
+        versions = []
+        flat_dir = self.models_path if self.backend == "keras" else self.export_path
+        if self._model_file_path(flat_dir, model_file, self.backend).exists():
+            versions.append(BASE_VERSION)
+        root = self.models_path / model_name
+        if root.is_dir():
+            versions.extend(sorted(
+                (
+                    directory.name for directory in root.iterdir()
+                    if directory.is_dir() and _VERSION_PATTERN.match(directory.name)
+                    and self._model_file_path(directory, model_file, self.backend).exists()
+                ),
+                key=_version_sort_key,
+            ))
+        return versions
+    
+    def _resolve_model_path(
+        self,
+        model_name: str,
+        version: Optional[str] = None,
+        backend: Optional[str] = None,
+    ) -> Tuple[str, Path]:
+        """
+        (version, đường dẫn file model) theo backend. version None: version trong file
+        CURRENT, không có thì version mới nhất, không có version nào thì layout phẳng.
+        
+        Raises:
+            ValueError: tên version không hợp lệ
+        """
+        backend = backend or self.backend
+        model_file = MODEL_FILES[model_name]
+        root = self.models_path / model_name
+        if version is None:
+            pointer = root / VERSION_POINTER_FILE
+            if pointer.exists():
+                version = pointer.read_text(encoding="utf-8").strip() or None
+        if version is None:
+            versions = [v for v in self.list_model_versions(model_name) if v != BASE_VERSION]
+            version = versions[-1] if versions else BASE_VERSION
+        if version == BASE_VERSION:
+            flat_dir = self.models_path if backend == "keras" else self.export_path
+            return version, self._model_file_path(flat_dir, model_file, backend)
+        if not _VERSION_PATTERN.match(version):
+            raise ValueError(f"Invalid model version: {version!r}")
+        return version, self._model_file_path(root / version, model_file, backend)
+    
+    def get_keras_path(self, model_name: str) -> Path:
+        """File .keras của version đang phục vụ (vd. cho embedding khi backend không phải keras)"""
+        return self._resolve_model_path(model_name, self.model_versions.get(model_name), backend="keras")[1]
+    
+    def get_model_versions(self, models: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Version của các model trong `models` (dict một request đã acquire): đọc từ chính
+        object model nên đúng cả khi request chạy trên version cũ trong lúc hot reload.
+        """
+        versions = {}
+        for model_name, model in models.items():
+            member_versions = getattr(model, "member_versions", None)
+            if member_versions:
+                versions.update(member_versions)
+            elif getattr(model, "model_version", None):
+                versions[model_name] = model.model_version
+        return versions
+    
+    def get_version_stats(self) -> Dict:
+        """Version đang phục vụ, các version có sẵn và hot reload gần nhất của từng model cho /health"""
+        return {
+            model_name: {
+                "active": self.model_versions.get(model_name),
+                "available": self.list_model_versions(model_name) if model_name in MODEL_FILES else [],
+                "reload": self.reloads.get(model_name),
+            }
+            for model_name in self.get_model_names()
+        }
+    
+    def start_reload(self, model_name: str, version: Optional[str] = None) -> "asyncio.Task":
+        """
+        Bắt đầu hot reload một model sang `version` (None = CURRENT / mới nhất) trong
+        background: load + warm-up version mới, swap atomic rồi giải phóng version cũ.
+        
+        Raises:
+            KeyError: model không có trong ensemble
+            FileNotFoundError: version không có file model cho backend hiện tại
+            ValueError: tên version không hợp lệ
+            RuntimeError: không hỗ trợ ở mode hiện tại / model đang reload
+        """
+        if self.serving_mode == "student" or self.worker_pool is not None:
+            raise RuntimeError("Hot reload is not supported with SERVING_MODE=student or MODEL_WORKERS")
+        if model_name not in MODEL_FILES or model_name not in self.get_model_names():
+            raise KeyError(model_name)
+        if (self.reloads.get(model_name) or {}).get("state") == "loading":
+            raise RuntimeError(f"{model_name} is already being reloaded")
+        version, model_path = self._resolve_model_path(model_name, version)
+        if not model_path.exists():
+            raise FileNotFoundError(f"Model file not found: {model_path}")
+        
+        self.reloads[model_name] = {
+            "state": "loading",
+            "version": version,
+            "from_version": self.model_versions.get(model_name),
+            "path": str(model_path),
+            "started_at": round(time.time(), 3),
+        }
+        return asyncio.ensure_future(self._reload(model_name, version, model_path))
+    
+    async def _reload(self, model_name: str, version: str, model_path: Path) -> Dict:
+        status = self.reloads[model_name]
+        start = time.perf_counter()
+        loop = asyncio.get_event_loop()
+        try:
+            # Load + precision + compile + warm-up ngoài event loop; request vẫn chạy version cũ
+            model, runner = await loop.run_in_executor(None, self._load_entry, model_name, model_path, version)
+            # Reload song song của model khác cũng rebuild fused ensemble: build từ self.models
+            # mới nhất và swap trong cùng lock để reload sau không ghi đè model của reload trước
+            async with self._fused_lock:
+                fused = None
+                if self.fused is not None:
+                    fused = await loop.run_in_executor(None, self._make_fused, {**self.models, model_name: model})
+                old = self._swap_model(model_name, version, model_path, model, runner, fused)
+            del model, runner, fused
+        except Exception as e:
+            gc.collect()
+            status.update(state="failed", error=f"{type(e).__name__}: {e}",
+                          duration_ms=round((time.perf_counter() - start) * 1000, 1))
+            print(f"❌ Reload of {model_name} to {version} failed: {e}")
+            return status
+        except asyncio.CancelledError:
+            # Task bị cancel (shutdown): không để state "loading" chặn mọi reload sau (409)
+            status.update(state="failed", error="reload cancelled",
+                          duration_ms=round((time.perf_counter() - start) * 1000, 1))
+            raise
+        
+        pointer_error = self._write_version_pointer(model_name, version)
+        if pointer_error:
+            # Vd. models volume read-only: version mới vẫn phục vụ, restart sẽ về version cũ
+            status["pointer_error"] = pointer_error
+            print(f"⚠️  Could not persist {VERSION_POINTER_FILE} for {model_name}: {pointer_error}")
+        for listener in self.reload_listeners:
+            try:
+                listener(model_name)
+            except Exception as e:
+                print(f"⚠️  Reload listener failed for {model_name}: {e}")
+        status.update(state="active", duration_ms=round((time.perf_counter() - start) * 1000, 1))
+        print(f"🔁 {model_name}: {status['from_version']} -> {version} in {status['duration_ms'] / 1000:.1f}s")
+        
+        # Giải phóng version cũ khi request cuối cùng dùng nó xong (không giữ reference ở đây)
+        status["released"] = None
+        old_ref = weakref.ref(old) if old is not None else None
+        del old
+        self._release_tasks.add(asyncio.ensure_future(self._release(status, old_ref)))
+        return status
+    
+    def _swap_model(self, model_name: str, version: str, model_path: Path, model, runner, fused) -> Optional[Any]:
+        """
+        Swap sang version mới (không có await nên request nào cũng thấy trọn bộ cũ hoặc
+        trọn bộ mới; request đang chạy giữ dict / model cũ tới khi xong).
+        
+        Returns:
+            Model cũ (None nếu chưa nằm trong RAM)
+        """
+        if self.registry is not None:
+            old = self.registry.swap(model_name, model_path, model, runner)
+        else:
+            old = self.models.get(model_name)
+            models = {**self.models, model_name: model}
+            inference_fns = {name: fn for name, fn in self.inference_fns.items() if name != model_name}
+            if runner is not model:
+                inference_fns[model_name] = runner
+            self.models, self.inference_fns = models, inference_fns
+            if fused is not None:
+                self.fused = fused
+        self.model_versions[model_name] = version
+        return old
+    
+    def _write_version_pointer(self, model_name: str, version: str) -> Optional[str]:
+        """Ghi CURRENT để restart giữ version vừa reload; trả về lỗi (không raise) nếu không ghi được"""
+        try:
+            (self.models_path / model_name).mkdir(parents=True, exist_ok=True)
+            (self.models_path / model_name / VERSION_POINTER_FILE).write_text(version, encoding="utf-8")
+        except OSError as e:
+            return f"{type(e).__name__}: {e}"
+        return None
+    
+    async def _release(self, status: Dict, model_ref):
+        """Chờ (tối đa MODEL_RELOAD_DRAIN_TIMEOUT) tới khi model cũ không còn reference nào rồi thu hồi RAM"""
+        deadline = time.perf_counter() + self.reload_drain_timeout
+        while True:
+            gc.collect()
+            if model_ref is None or model_ref() is None:
+                status["released"] = True
+                break
+            if time.perf_counter() >= deadline:
+                status["released"] = False
+                print(f"⚠️  Previous {status['from_version']} model still referenced after {self.reload_drain_timeout:.0f}s")
+                break
+            await asyncio.sleep(0.5)
+        self._release_tasks = {task for task in self._release_tasks if not task.done()}
+    
+    def _load_model(self, model_path: Path):
+        """Load model từ file theo backend"""
+        if self.backend == "tflite":
+            return TFLiteModel(model_path, num_threads=self.backend_threads)
+        if self.backend == "onnx":
+            return ONNXModel(model_path, num_threads=self.backend_threads)
+        if self.backend == "savedmodel":
+            return SavedModelSnapshot(model_path)
+        # Load model với compile=False để tiết kiệm memory
+        return tf.keras.models.load_model(str(model_path), compile=False)
+    
+    def _apply_precision(self, model_name: str, model):
+        """
+        Thử MODEL_PRECISION cho một Keras model vừa load: so với bản float32 trên ảnh
+        calibration, trong tolerance thì trả về bản precision thấp (bản float32 được
+        giải phóng), ngoài tolerance thì giữ float32. Không có ảnh calibration
+        (MODEL_PRECISION_CALIBRATION_DIR) thì không kiểm được accuracy nên giữ float32.
+        """
+        if (
+            self.precision == "float32"
+            or not isinstance(model, tf.keras.Model)
+            or (self.precision_models and model_name not in self.precision_models)
+        ):
+            return model
+        target = resolve_precision(self.precision, get_runtime_stats().get("onednn", False))
+        input_shape = model.input_shape[0] if isinstance(model.input_shape, list) else model.input_shape
+        input_size = int(input_shape[1])
+        calibration_dir = env_str("MODEL_PRECISION_CALIBRATION_DIR", "")
+        count = env_int("MODEL_PRECISION_CALIBRATION_IMAGES", 16)
+        
+        def compiled(keras_model):
+            # Student multi-head: so sánh cả output (N, num_heads, num_classes)
+            if model_name == STUDENT_MODEL_NAME:
+                return MultiHeadModel(keras_model)
+            return CompiledInference(model_name, keras_model, input_size)
+        
+        paths = list_images(Path(calibration_dir), count) if calibration_dir else []
+        if not paths:
+            reason = (f"no calibration images in {calibration_dir}" if calibration_dir
+                      else "MODEL_PRECISION_CALIBRATION_DIR is not set")
+            self.precision_stats[model_name] = {"precision": "float32", "candidate": target, "reason": reason}
+            print(f"⚠️  {model_name}: keeping float32, {target} needs calibration images to check accuracy ({reason})")
+            return model
+        
+        candidate = None
+        try:
+            candidate = cast_model(model, target)
+            report = compare_precision(
+                compiled(model), compiled(candidate), calibration_batch(paths, input_size, count),
+                min_agreement=env_float("MODEL_PRECISION_MIN_AGREEMENT", 0.99),
+                max_prob_diff=env_float("MODEL_PRECISION_MAX_PROB_DIFF", 0.02),
+                max_slowdown=env_float("MODEL_PRECISION_MAX_SLOWDOWN", 1.3),
+            )
+            report["calibration"] = f"{len(paths)} images"
+        except Exception as e:
+            report = {"accepted": False, "reason": f"{type(e).__name__}: {e}"}
+        
+        accepted = report.pop("accepted")
+        report = {
+            "precision": target if accepted else "float32",
+            "candidate": target,
+            **report,
+            "weights_mb": {
+                "float32": round(estimate_model_mb(model), 1),
+                target: round(estimate_model_mb(candidate), 1) if candidate else None,
+            },
+        }
+        self.precision_stats[model_name] = report
+        if accepted:
+            print(f"🪶 {model_name}: {target} ({report['weights_mb']['float32']} -> "
+                  f"{report['weights_mb'][target]} MB weights, {report['latency_ms']['float32']} -> "
+                  f"{report['latency_ms']['candidate']} ms, max prob diff {report['max_prob_diff']})")
+            return candidate
+        print(f"⚠️  {model_name}: keeping float32, {target} out of tolerance ({report['reason']})")
+        return model
+    
+    def get_precision_stats(self) -> Dict:
+        """Precision đang dùng của từng model + kết quả kiểm tra tolerance cho /health"""
+        return {
+            "requested": self.precision,
+            "cpu_bf16": cpu_supports_bf16(),
+            "models": {
+                model_name: self.precision_stats.get(model_name, {"precision": "float32"})
+                for model_name in self.get_model_names()
+            },
+        }
+    
+    def get_input_size(self, model_name: str, model: Optional[tf.keras.Model] = None) -> int:
+        """Kích thước input (H = W) của model, ưu tiên đọc từ input_shape của model"""
+        model = model if model is not None else self.models.get(model_name)
+        input_shape = getattr(model, "input_shape", None)
+        if isinstance(input_shape, list):
+            input_shape = input_shape[0]
+        if input_shape and len(input_shape) == 4 and input_shape[1]:
+            return int(input_shape[1])
+        return MODEL_INPUT_SIZES.get(model_name, DEFAULT_INPUT_SIZE)
+    
+    def _build_inference_fn(self, model_name: str, model: tf.keras.Model):
+        """Build + warm-up compiled inference function cho model"""
+        try:
+            fn = CompiledInference(
+                model_name, model, self.get_input_size(model_name, model), accepts_uint8=self.uint8_inputs
+            )
+            warmup_ms = fn.warmup()
+            self.inference_fns[model_name] = fn
+            print(f"⚡ Compiled inference for {model_name} (input {fn.input_size}, warm-up {warmup_ms:.0f} ms)")
+        except Exception as e:
+            # Fallback về model.predict() nếu không compile được
+            self.inference_fns.pop(model_name, None)
+            print(f"⚠️  Could not compile inference for {model_name}, using model.predict(): {e}")
+    
+    def get_inference_mode(self) -> str:
+        """Backend / inference path đang dùng (cho /health)"""
+        if self.serving_mode == "student":
+            return f"student:{self.student_path.name}"
+        if self.worker_pool is not None:
+            return f"workers:{self.num_workers}x{self.backend}"
+        if self.registry is not None:
+            mode = "compiled" if self.backend == "keras" and self.use_compiled_inference else self.backend
+            return f"lazy:{mode}"
+        if self.backend == "tflite":
+            return f"tflite:{self.quantization}"
+        if self.backend in ("onnx", "savedmodel"):
+            return self.backend
+        if self.fused is not None:
+            return "fused"
+        return "compiled" if self.inference_fns else "legacy"
+    
     def _load_class_names(self):
         """Load class names từ file class_names.json"""
         class_names_path = self.models_path / "class_names.json"
@@ -137,10 +1072,15 @@ class ModelService:
     
     def models_loaded(self) -> bool:
         """Kiểm tra xem models đã được load chưa"""
+        if self.registry is not None:
+            return True
         return len(self.models) > 0
     
     def get_models_status(self) -> Dict[str, bool]:
         """Lấy trạng thái của từng model"""
+        if self.registry is not None:
+            # Lazy: True = đang nằm trong RAM, False = sẽ load khi cần
+            return {model_name: self.registry.is_resident(model_name) for model_name in self.registry.model_names}
         return {
             model_name: model is not None 
             for model_name, model in self.models.items()
@@ -0,0 +1,156 @@
+"""
+Model Precision - Chạy Keras model với weights / activations bfloat16 hoặc lưu weights float16 trên CPU
+
+Model được clone với dtype policy thấp hơn (layer output cuối giữ float32 để softmax
+không bị làm tròn) rồi so với bản float32 trên một batch calibration: chỉ thay bản
+float32 khi top-1, probability và latency còn trong tolerance.
+"""
+
+from typing import Any, Dict, List, Sequence
+from pathlib import Path
+import platform
+import time
+import numpy as np
+import tensorflow as tf
+
+
+# float32: giữ nguyên (mặc định)
+# bfloat16: weights + activations bf16 (nhanh trên CPU có AVX512-BF16 / AMX + oneDNN, weights nhỏ 2 lần)
+# float16: chỉ lưu weights float16, tính toán float32 (weights nhỏ 2 lần, chậm hơn một chút)
+# auto: bfloat16 nếu CPU hỗ trợ và oneDNN bật, ngược lại float16
+MODEL_PRECISIONS = ("float32", "bfloat16", "float16", "auto")
+
+# CPU flag (/proc/cpuinfo) có lệnh bf16 native
+_BF16_CPU_FLAGS = {"avx512_bf16", "amx_bf16", "bf16"}
+
+
+class Float16StoragePolicy(tf.keras.DTypePolicy):
+    """Variables float16, compute float32: Keras tự cast weights lên float32 khi layer chạy"""
+
+    def __init__(self):
+        super().__init__("float32")
+
+    @property
+    def name(self):
+        return "float16_storage"
+
+    @property
+    def variable_dtype(self):
+        return "float16"
+
+
+def cpu_supports_bf16() -> bool:
+    """CPU có lệnh bfloat16 native (x86 AVX512-BF16 / AMX-BF16, ARM BF16)"""
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith(("flags", "Features")):
+                    return bool(_BF16_CPU_FLAGS & set(line.split(":", 1)[1].split()))
+    except OSError:
+        pass
+    # Không có /proc/cpuinfo (macOS...): Apple silicon có BF16
+    return platform.system() == "Darwin" and platform.machine() == "arm64"
+
+
+def resolve_precision(requested: str, onednn: bool) -> str:
+    """MODEL_PRECISION -> precision thực sự thử cho host này"""
+    if requested == "auto":
+        # Không có oneDNN, conv bf16 của Eigen chậm hơn float32
+        return "bfloat16" if cpu_supports_bf16() and onednn else "float16"
+    return requested
+
+
+def cast_model(model: tf.keras.Model, precision: str) -> tf.keras.Model:
+    """
+    Clone model với dtype policy theo precision và copy weights sang (cast). Layer output
+    (và InputLayer) giữ float32 nên input / output của model không đổi dtype.
+    """
+    policy = Float16StoragePolicy() if precision == "float16" else precision
+    output_layers = {
+        getattr(tensor, "_keras_history", [None])[0]
+        for tensor in tf.nest.flatten(model.outputs)
+    }
+
+    def clone_layer(layer):
+        config = layer.get_config()
+        if layer not in output_layers and not isinstance(layer, tf.keras.layers.InputLayer):
+            config["dtype"] = policy
+        return layer.__class__.from_config(config)
+
+    cast = tf.keras.models.clone_model(model, clone_function=clone_layer)
+    cast.set_weights(model.get_weights())
+    return cast
+
+
+def calibration_batch(paths: Sequence[Path], input_size: int, count: int) -> np.ndarray:
+    """
+    Ảnh calibration (preprocess giống /predict). Không dùng ảnh noise thay thế: top-1
+    trên noise không nói gì về accuracy trên ảnh món ăn thật.
+
+    Raises:
+        ValueError: không đọc được ảnh calibration nào
+    """
+    from PIL import Image
+    from utils.image_processor import ImageProcessor
+
+    image_processor = ImageProcessor()
+    images = []
+    for path in paths[:count]:
+        try:
+            with Image.open(path) as image:
+                images.append(image_processor.preprocess_multi(image, {input_size})[input_size])
+        except Exception as e:
+            print(f"⚠️  Skipping calibration image {path}: {e}")
+    if not images:
+        raise ValueError("no readable calibration images")
+    return np.concatenate(images, axis=0)
+
+
+def _median_latency_ms(fn, image: np.ndarray, runs: int) -> float:
+    fn(image)  # trace + warm-up
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(image)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.median(latencies))
+
+
+def compare_precision(
+    reference_fn,
+    candidate_fn,
+    images: np.ndarray,
+    min_agreement: float,
+    max_prob_diff: float,
+    max_slowdown: float,
+    latency_runs: int = 5,
+) -> Dict[str, Any]:
+    """
+    So sánh inference callable float32 với bản precision thấp trên cùng batch:
+    top-1 agreement, độ lệch probability lớn nhất và latency (median, batch 1).
+
+    Returns:
+        {"accepted": bool, "agreement", "max_prob_diff", "latency_ms": {...}, "reason"}
+    """
+    reference = np.asarray(reference_fn(images), dtype=np.float32)
+    candidate = np.asarray(candidate_fn(images), dtype=np.float32)
+    agreement = float(np.mean(reference.argmax(axis=-1) == candidate.argmax(axis=-1)))
+    prob_diff = float(np.abs(reference - candidate).max())
+    reference_ms = _median_latency_ms(reference_fn, images[:1], latency_runs)
+    candidate_ms = _median_latency_ms(candidate_fn, images[:1], latency_runs)
+    slowdown = candidate_ms / reference_ms if reference_ms else 1.0
+
+    reasons: List[str] = []
+    if agreement < min_agreement:
+        reasons.append(f"top-1 agreement {agreement:.3f} < {min_agreement}")
+    if prob_diff > max_prob_diff:
+        reasons.append(f"max probability diff {prob_diff:.4f} > {max_prob_diff}")
+    if slowdown > max_slowdown:
+        reasons.append(f"latency x{slowdown:.2f} > x{max_slowdown}")
+    return {
+        "accepted": not reasons,
+        "agreement": round(agreement, 4),
+        "max_prob_diff": round(prob_diff, 6),
+        "latency_ms": {"float32": round(reference_ms, 1), "candidate": round(candidate_ms, 1)},
+        "reason": "; ".join(reasons) or None,
+    }
@@ -2,114 +2,519 @@
 Prediction Service - Xử lý dự đoán và voting mechanism
 """
 
-from typing import Dict, List, Any
+from typing import Callable, Dict, List, Any, Optional
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import asyncio
+import time
 from collections import Counter
 import numpy as np
 import tensorflow as tf
 from PIL import Image
 
+from services.aggregation import EnsembleAggregator
+from services.batching import MicroBatcher
+from services.metrics import observe_model_timing
+from utils.config import env_bool, env_float, env_int, env_list, env_str
+
+
+# Thứ tự chạy trong cascade mode: model rẻ + chính xác trước, model nặng
+# (ResNet152V2, VGG19) sau cùng
+DEFAULT_CASCADE_ORDER = ["inception_v3", "xception", "inception_resnet_v2", "resnet152_v2", "vgg19"]
+
+# Test-time augmentation: view -> box (y1, x1, y2, x2) chuẩn hóa cho tf.image.crop_and_resize;
+# x1 > x2 nghĩa là lật ngang. Crop giữa lấy 87.5% ảnh rồi resize lại kích thước input.
+_CROP_LOW, _CROP_HIGH = 0.0625, 0.9375
+TTA_VIEW_BOXES = {
+    "flip": (0.0, 1.0, 1.0, 0.0),
+    "center_crop": (_CROP_LOW, _CROP_LOW, _CROP_HIGH, _CROP_HIGH),
+    "center_crop_flip": (_CROP_LOW, _CROP_HIGH, _CROP_HIGH, _CROP_LOW),
+    "top_left_crop": (0.0, 0.0, 0.875, 0.875),
+    "bottom_right_crop": (0.125, 0.125, 1.0, 1.0),
+}
+
 
 class PredictionService:
     """Service để xử lý predictions và voting"""
     
-    def __init__(self, max_workers: int = 5):
+    def __init__(
+        self,
+        max_workers: int = 5,
+        enable_batching: Optional[bool] = None,
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+    ):
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
         self.class_names = []  # Sẽ được set từ model_service
+        
+        # Micro-batching: gom ảnh từ các request đồng thời thành 1 forward pass / model
+        self.enable_batching = (
+            enable_batching if enable_batching is not None
+            else env_bool("ENABLE_MICRO_BATCHING", True)
+        )
+        self.max_batch_size = max_batch_size or env_int("BATCH_MAX_SIZE", 8)
+        self.max_wait_ms = max_wait_ms if max_wait_ms is not None else env_float("BATCH_MAX_WAIT_MS", 5.0)
+        self.batchers: Dict[str, MicroBatcher] = {}
+        # /predict/batch: số ảnh tối đa trong một forward pass
+        self.batch_predict_size = env_int("BATCH_PREDICT_MAX_SIZE", 32)
+        
+        # Ensemble mode: "full" chạy mọi model, "cascade" dừng sớm khi kết quả đã chắc chắn
+        self.ensemble_mode = env_str("ENSEMBLE_MODE", "full").lower()
+        self.cascade_order = env_list("CASCADE_ORDER", DEFAULT_CASCADE_ORDER)
+        self.cascade_min_models = env_int("CASCADE_MIN_MODELS", 2)
+        self.cascade_margin = env_float("CASCADE_CONFIDENCE_MARGIN", 0.5)
+        self.models_run_counts: Counter = Counter()
+        
+        # Gộp kết quả ensemble (majority / soft / geometric / weighted)
+        self.aggregator = EnsembleAggregator()
+        
+        # Test-time augmentation: "off" | "adaptive" (chỉ khi margin probability lần đầu thấp) | "always"
+        self.tta_mode = env_str("TTA_MODE", "off").lower()
+        self.tta_margin_threshold = env_float("TTA_MARGIN_THRESHOLD", 0.2)
+        self.tta_views = [view for view in env_list("TTA_VIEWS", ["flip", "center_crop", "center_crop_flip"])
+                          if view in TTA_VIEW_BOXES]
+        self.tta_counts: Counter = Counter()
     
     async def predict_all_models(
         self, 
         original_image: Image.Image,
         models: Dict[str, tf.keras.Model],
-        image_processor: Any
+        image_processor: Any,
+        inference_fns: Optional[Dict[str, Callable[[np.ndarray], np.ndarray]]] = None,
+        mode: Optional[str] = None,
+        timings: Optional[Dict[str, float]] = None,
     ) -> Dict[str, Dict[str, Any]]:
         """
         Chạy tất cả models song song (parallel inference).
         Thời gian xử lý chỉ bằng thời gian của model chậm nhất.
+        
+        inference_fns: compiled inference callables từ ModelService; model nào
+        không có thì dùng model.predict() (legacy path).
+        mode: "full" (mặc định) chạy mọi model; "cascade" chạy lần lượt theo
+        CASCADE_ORDER và dừng sớm khi kết quả vote đã chắc chắn.
+        timings: nếu có, được ghi thời gian (ms) decode / preprocess_<size>.
+        Kết quả chỉ chứa các model đã thực sự chạy; mỗi kết quả có "timing"
+        (queue_ms, inference_ms) của model đó.
+        """
+        inference_fns = inference_fns or {}
+        mode = mode or self.ensemble_mode
+        
+        # Preprocess một lần cho tất cả models (decode 1 lần, resize 1 lần / kích thước),
+        # chạy trong thread pool để không block event loop
+        input_sizes = self.get_input_sizes(models, image_processor)
+        loop = asyncio.get_event_loop()
+        images = await loop.run_in_executor(
+            self.executor,
+            partial(
+                image_processor.preprocess_multi,
+                original_image,
+                set(input_sizes.values()),
+                timings,
+                dtype=self.get_input_dtype(models, inference_fns),
+            ),
+        )
+        
+        if mode == "cascade":
+            predictions = await self._predict_cascade(models, images, input_sizes, inference_fns)
+        else:
+            predictions = await self._run_models(list(models.keys()), models, images, input_sizes, inference_fns)
+        
+        if self.tta_mode in ("adaptive", "always") and self.tta_views:
+            start = time.perf_counter()
+            if await self._apply_tta(predictions, models, images, input_sizes, inference_fns) and timings is not None:
+                timings["tta"] = (time.perf_counter() - start) * 1000
+        
+        self.models_run_counts[len(predictions)] += 1
+        return predictions
+    
+    async def _apply_tta(
+        self,
+        predictions: Dict[str, Dict[str, Any]],
+        models: Dict[str, Any],
+        images: Dict[int, np.ndarray],
+        input_sizes: Dict[str, int],
+        inference_fns: Dict[str, Callable[[np.ndarray], np.ndarray]],
+    ) -> bool:
+        """
+        Test-time augmentation: mỗi model chạy thêm một forward pass trên batch các view
+        (lật / crop) của ảnh đã preprocess, probability được lấy trung bình với lần đầu.
+        Adaptive mode chỉ chạy khi margin top-1/top-2 của probability trung bình (lần đầu)
+        < TTA_MARGIN_THRESHOLD.
+        
+        Returns:
+            True nếu TTA đã được áp dụng (predictions được cập nhật tại chỗ)
+        """
+        self.tta_counts["checked"] += 1
+        if self.tta_mode == "adaptive":
+            margin = self._probability_margin(predictions)
+            if margin is None or margin >= self.tta_margin_threshold:
+                return False
+        
+        model_names = [
+            model_name for model_name in models
+            if any(result_name == model_name or result_name in (getattr(models[model_name], "head_names", None) or [])
+                   for result_name, result in predictions.items() if "error" not in result)
+        ]
+        loop = asyncio.get_event_loop()
+        views = {
+            size: await loop.run_in_executor(self.executor, self._augment, images[size])
+            for size in {input_sizes[model_name] for model_name in model_names}
+        }
+        
+        def run_model(model_name: str) -> np.ndarray:
+            model = inference_fns.get(model_name, models[model_name])
+            return np.asarray(self._infer(model, views[input_sizes[model_name]]))
+        
+        outputs = await asyncio.gather(
+            *(loop.run_in_executor(self.executor, run_model, model_name) for model_name in model_names),
+            return_exceptions=True,
+        )
+        for model_name, model_outputs in zip(model_names, outputs):
+            if isinstance(model_outputs, BaseException):
+                print(f"⚠️  TTA failed for {model_name}: {model_outputs}")
+                continue
+            head_names = getattr(models[model_name], "head_names", None)
+            # Student multi-head: (views, heads, classes) -> từng head
+            per_result = (
+                {head_name: model_outputs[:, index] for index, head_name in enumerate(head_names)}
+                if head_names else {model_name: model_outputs}
+            )
+            for result_name, view_probabilities in per_result.items():
+                result = predictions.get(result_name)
+                if result is None or "error" in result:
+                    continue
+                num_views = len(view_probabilities) + 1
+                averaged = (result["probabilities"] + view_probabilities.sum(axis=0)) / num_views
+                result.update(self._format_prediction(averaged))
+                result["tta_views"] = num_views
+        self.tta_counts["applied"] += 1
+        return True
+    
+    @staticmethod
+    def _probability_margin(predictions: Dict[str, Dict[str, Any]]) -> Optional[float]:
+        """
+        Top-1 − top-2 của probability trung bình các model. Không dùng margin của vote:
+        với majority đó là chênh lệch vote share, vote đồng thuận nhưng confidence thấp
+        vẫn cho margin ~1.0.
         """
-        # Tạo tasks cho tất cả models
+        probabilities = [
+            result["probabilities"] for result in predictions.values()
+            if "error" not in result and result.get("probabilities") is not None
+        ]
+        if not probabilities:
+            return None
+        mean_probabilities = np.mean(probabilities, axis=0)
+        if mean_probabilities.shape[-1] < 2:
+            return None
+        top_two = np.partition(mean_probabilities, -2)[-2:]
+        return float(top_two[1] - top_two[0])
+    
+    def _augment(self, image: np.ndarray) -> np.ndarray:
+        """(1, H, W, 3) -> (num_views, H, W, 3): mọi view tạo trong một op crop_and_resize"""
+        height, width = image.shape[1], image.shape[2]
+        if image.dtype == np.uint8:
+            # View nội suy từ ảnh float [0, 1] như trước (uint8 sẽ làm tròn pixel nội suy)
+            image = image.astype(np.float32) / 255.0
+        boxes = np.array([TTA_VIEW_BOXES[view] for view in self.tta_views], dtype=np.float32)
+        views = tf.image.crop_and_resize(
+            image.astype(np.float32, copy=False),
+            boxes,
+            np.zeros(len(boxes), dtype=np.int32),
+            (height, width),
+        )
+        return views.numpy()
+    
+    async def predict_batch(
+        self,
+        images: List[Dict[int, np.ndarray]],
+        models: Dict[str, Any],
+        input_sizes: Dict[str, int],
+        inference_fns: Optional[Dict[str, Callable[[np.ndarray], np.ndarray]]] = None,
+    ) -> List[Dict[str, Dict[str, Any]]]:
+        """
+        Chạy full ensemble trên nhiều ảnh đã preprocess (output của preprocess_multi).
+        Mỗi model chạy các forward pass tối đa BATCH_PREDICT_MAX_SIZE ảnh (không qua
+        micro-batcher vì đã là batch thật); các models vẫn chạy song song.
+        Cascade mode không áp dụng: quyết định dừng sớm là theo từng ảnh.
+        
+        Returns:
+            Danh sách predictions (cùng format predict_all_models) theo thứ tự ảnh
+        """
+        inference_fns = inference_fns or {}
+        model_names = list(models.keys())
+        loop = asyncio.get_event_loop()
+        
+        def run_model(model_name: str, submitted: float) -> np.ndarray:
+            model = inference_fns.get(model_name, models[model_name])
+            size = input_sizes[model_name]
+            outputs = []
+            timing = {"queue_ms": (time.perf_counter() - submitted) * 1000}
+            for start in range(0, len(images), self.batch_predict_size):
+                chunk = images[start:start + self.batch_predict_size]
+                batch = np.concatenate([image[size] for image in chunk], axis=0)
+                started = time.perf_counter()
+                outputs.append(np.asarray(self._infer(model, batch)))
+                timing["inference_ms"] = (time.perf_counter() - started) * 1000
+                observe_model_timing(model_name, timing)
+                timing = {}
+            return np.concatenate(outputs, axis=0)
+        
+        submitted = time.perf_counter()
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self.executor, run_model, model_name, submitted) for model_name in model_names),
+            return_exceptions=True,
+        )
+        
+        predictions: List[Dict[str, Dict[str, Any]]] = [{} for _ in images]
+        for model_name, outputs in zip(model_names, results):
+            if isinstance(outputs, BaseException):
+                print(f"❌ Error in {model_name} batch prediction: {outputs}")
+                for image_predictions in predictions:
+                    image_predictions[model_name] = {
+                        "prediction": "Unknown",
+                        "confidence": 0.0,
+                        "error": str(outputs),
+                    }
+                continue
+            model = models[model_name]
+            for index, image_predictions in enumerate(predictions):
+                image_predictions.update(
+                    self._expand_heads(model_name, self._format_output(model, outputs[index:index + 1]))
+                )
+        
+        # Student multi-head: mỗi head tính là một model đã chạy
+        for image_predictions in predictions:
+            self.models_run_counts[len(image_predictions)] += 1
+        return predictions
+    
+    async def _run_models(
+        self,
+        model_names: List[str],
+        models: Dict[str, Any],
+        images: Dict[int, np.ndarray],
+        input_sizes: Dict[str, int],
+        inference_fns: Dict[str, Callable[[np.ndarray], np.ndarray]],
+    ) -> Dict[str, Dict[str, Any]]:
+        """Chạy song song một nhóm models trên ảnh đã preprocess"""
+        # Tạo tasks cho các models
         tasks = []
-        for model_name, model in models.items():
-            # Một số kiến trúc Inception/Xception cần kích thước 299x299
-            if model_name in {"inception_v3", "inception_resnet_v2", "xception"}:
-                img = image_processor.preprocess_for_inception(original_image)
-            else:
-                img = image_processor.preprocess(original_image)
-            
+        for model_name in model_names:
+            img = images[input_sizes[model_name]]
             tasks.append(
-                self._predict_single_model(model_name, model, img)
+                self._predict_single_model(model_name, inference_fns.get(model_name, models[model_name]), img)
             )
         
         # Chạy song song và đợi tất cả hoàn thành
         results = await asyncio.gather(*tasks)
         
         # Chuyển đổi kết quả thành dictionary
-        predictions = {}
-        for model_name, result in zip(models.keys(), results):
-            predictions[model_name] = result
+        predictions: Dict[str, Dict[str, Any]] = {}
+        for model_name, result in zip(model_names, results):
+            predictions.update(self._expand_heads(model_name, result))
+        return predictions
+    
+    def _expand_heads(self, model_name: str, result: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """Student multi-head: mỗi head là một "model" trong kết quả (voting như ensemble)"""
+        if "heads" not in result:
+            return {model_name: result}
+        return result["heads"]
+    
+    async def _predict_cascade(
+        self,
+        models: Dict[str, Any],
+        images: Dict[int, np.ndarray],
+        input_sizes: Dict[str, int],
+        inference_fns: Dict[str, Callable[[np.ndarray], np.ndarray]],
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Early-exit cascade: chạy song song CASCADE_MIN_MODELS model đầu tiên
+        (rẻ + chính xác), sau đó thêm từng model cho tới khi kết quả đã quyết định.
+        Các model nặng (VGG19, ResNet152V2) ở cuối chỉ chạy với ảnh khó.
+        """
+        order = [name for name in self.cascade_order if name in models]
+        order += [name for name in models if name not in order]
+        first_stage = max(1, min(self.cascade_min_models, len(order)))
         
+        predictions = await self._run_models(order[:first_stage], models, images, input_sizes, inference_fns)
+        for model_name in order[first_stage:]:
+            if self._cascade_decided(predictions, remaining=len(order) - len(predictions)):
+                break
+            predictions.update(
+                await self._run_models([model_name], models, images, input_sizes, inference_fns)
+            )
         return predictions
     
+    def _cascade_decided(self, predictions: Dict[str, Dict[str, Any]], remaining: int) -> bool:
+        """
+        Kết quả đã quyết định khi:
+        - các model còn lại không thể lật được majority vote (kể cả tie), hoặc
+        - mọi model đã chạy cùng một dự đoán và margin top-1/top-2 trung bình >= CASCADE_CONFIDENCE_MARGIN
+        """
+        valid = [result for result in predictions.values() if "error" not in result]
+        if not valid:
+            return False
+        
+        counts = Counter(result["prediction"] for result in valid).most_common()
+        leader_votes = counts[0][1]
+        runner_up_votes = counts[1][1] if len(counts) > 1 else 0
+        if leader_votes > runner_up_votes + remaining:
+            return True
+        
+        if len(counts) == 1 and len(valid) >= self.cascade_min_models:
+            margin = float(np.mean([result.get("margin", 0.0) for result in valid]))
+            return margin >= self.cascade_margin
+        return False
+    
+    def get_ensemble_stats(self) -> Dict[str, Any]:
+        """Chế độ ensemble + phân bố số model đã chạy mỗi request"""
+        return {
+            "mode": self.ensemble_mode,
+            "voting_method": self.aggregator.method,
+            "cascade_order": self.cascade_order if self.ensemble_mode == "cascade" else None,
+            "models_run_histogram": {
+                str(count): requests for count, requests in sorted(self.models_run_counts.items())
+            },
+            "tta": {
+                "mode": self.tta_mode,
+                "views": self.tta_views,
+                "margin_threshold": self.tta_margin_threshold if self.tta_mode == "adaptive" else None,
+                "applied": self.tta_counts["applied"],
+                "checked": self.tta_counts["checked"],
+            },
+        }
+    
+    def get_input_sizes(self, models: Dict[str, Any], image_processor: Any) -> Dict[str, int]:
+        """{model_name: kích thước input} cho các models sẽ chạy"""
+        return {
+            model_name: self._get_input_size(model_name, model, image_processor)
+            for model_name, model in models.items()
+        }
+    
+    def get_input_dtype(
+        self,
+        models: Dict[str, Any],
+        inference_fns: Optional[Dict[str, Callable[[np.ndarray], np.ndarray]]] = None,
+    ) -> Any:
+        """
+        np.uint8 nếu mọi model sẽ chạy nhận pixel uint8 (UINT8_INPUTS, fused ensemble),
+        ngược lại np.float32 - ảnh dùng chung giữa các model nên chỉ chọn một dtype.
+        """
+        inference_fns = inference_fns or {}
+        if models and all(
+            getattr(inference_fns.get(model_name, model), "accepts_uint8", False)
+            for model_name, model in models.items()
+        ):
+            return np.uint8
+        return np.float32
+    
+    def _get_input_size(self, model_name: str, model: Any, image_processor: Any) -> int:
+        """Kích thước input của model (đọc từ input_shape, fallback theo kiến trúc)"""
+        input_shape = getattr(model, "input_shape", None)
+        if isinstance(input_shape, list):
+            input_shape = input_shape[0]
+        if input_shape and len(input_shape) == 4 and input_shape[1]:
+            return int(input_shape[1])
+        # Một số kiến trúc Inception/Xception cần kích thước 299x299
+        if model_name in {"inception_v3", "inception_resnet_v2", "xception"}:
+            return 299
+        return image_processor.image_size
+    
     async def _predict_single_model(
         self, 
         model_name: str, 
-        model: tf.keras.Model, 
+        model: Any, 
         image: np.ndarray
     ) -> Dict[str, Any]:
         """
-        Chạy prediction cho một model.
+        Chạy prediction cho một model (Keras model hoặc compiled inference fn).
         Chạy trong thread pool để không block event loop.
+        Nếu bật micro-batching, ảnh được gom chung batch với các request khác.
         """
-        loop = asyncio.get_event_loop()
-        
-        # Chạy trong thread pool
-        result = await loop.run_in_executor(
-            self.executor,
-            self._run_prediction,
-            model_name,
-            model,
-            image
-        )
+        if not self.enable_batching:
+            loop = asyncio.get_event_loop()
+            
+            # Chạy trong thread pool
+            result = await loop.run_in_executor(
+                self.executor,
+                self._run_prediction,
+                model_name,
+                model,
+                image,
+                time.perf_counter(),
+            )
+            
+            return result
         
-        return result
+        try:
+            timing: Dict[str, float] = {}
+            predictions = await self._get_batcher(model_name).submit(image, model, timing)
+            observe_model_timing(model_name, timing)
+            return {**self._format_output(model, predictions), "timing": timing}
+        except Exception as e:
+            print(f"❌ Error in {model_name} prediction: {e}")
+            import traceback
+            traceback.print_exc()
+            return {
+                "prediction": "Unknown",
+                "confidence": 0.0,
+                "error": str(e)
+            }
+    
+    def _get_batcher(self, model_name: str) -> MicroBatcher:
+        """Lấy (hoặc tạo) hàng đợi batching của model"""
+        batcher = self.batchers.get(model_name)
+        if batcher is None:
+            batcher = MicroBatcher(
+                model_name,
+                self._infer,
+                self.executor,
+                max_batch_size=self.max_batch_size,
+                max_wait_ms=self.max_wait_ms,
+            )
+            self.batchers[model_name] = batcher
+        return batcher
+    
+    def get_batching_stats(self) -> Dict[str, Any]:
+        """Thống kê batch size thực tế của từng model"""
+        return {
+            "enabled": self.enable_batching,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "models": {
+                model_name: batcher.get_stats()
+                for model_name, batcher in self.batchers.items()
+            },
+        }
+    
+    def _infer(self, model: Any, batch: np.ndarray) -> np.ndarray:
+        """Chạy một forward pass trên cả batch, trả về (N, num_classes)"""
+        if isinstance(model, tf.keras.Model):
+            # Legacy path
+            return model.predict(batch, verbose=0)
+        return model(batch)
     
     def _run_prediction(
         self, 
         model_name: str, 
-        model: tf.keras.Model, 
-        image: np.ndarray
+        model: Any, 
+        image: np.ndarray,
+        submitted: Optional[float] = None,
     ) -> Dict[str, Any]:
         """
         Thực hiện prediction với Keras model.
+        submitted: thời điểm gửi vào thread pool (perf_counter) để đo queue wait.
         """
         try:
+            started = time.perf_counter()
             # Chạy prediction
-            predictions = model.predict(image, verbose=0)
-            
-            # Lấy prediction có confidence cao nhất
-            if len(predictions.shape) > 1:
-                # Nếu có nhiều outputs, lấy output đầu tiên
-                pred_array = predictions[0]
-            else:
-                pred_array = predictions
-            
-            # Tìm class có confidence cao nhất
-            class_idx = np.argmax(pred_array)
-            confidence = float(pred_array[class_idx])
-            
-            # Lấy tên class
-            if self.class_names and class_idx < len(self.class_names):
-                prediction_name = self.class_names[class_idx]
-            else:
-                # Fallback: dùng index nếu chưa có class names
-                prediction_name = f"class_{class_idx}"
-            
-            return {
-                "prediction": prediction_name,
-                "confidence": round(confidence, 4),
-                "all_predictions": pred_array.tolist() if len(pred_array) < 100 else None,  # Chỉ trả về nếu không quá nhiều
+            predictions = self._infer(model, image)
+            timing = {
+                "queue_ms": (started - submitted) * 1000 if submitted is not None else None,
+                "inference_ms": (time.perf_counter() - started) * 1000,
+                "batch_size": 1,
             }
+            observe_model_timing(model_name, timing)
+            return {**self._format_output(model, predictions), "timing": timing}
         except Exception as e:
             print(f"❌ Error in {model_name} prediction: {e}")
             import traceback
@@ -120,9 +525,61 @@ class PredictionService:
                 "error": str(e)
             }
     
-    def vote(self, predictions: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    def _format_output(self, model: Any, predictions: np.ndarray) -> Dict[str, Any]:
+        """
+        Format output của model cho 1 ảnh. Student distill (MultiHeadModel) trả về
+        (1, num_heads, num_classes): mỗi head thành một kết quả riêng trong "heads".
+        """
+        head_names = getattr(model, "head_names", None)
+        if not head_names:
+            return self._format_prediction(predictions)
+        rows = predictions[0] if predictions.ndim == 3 else predictions
+        return {
+            "heads": {
+                head_name: self._format_prediction(rows[index])
+                for index, head_name in enumerate(head_names)
+            }
+        }
+    
+    def _format_prediction(self, predictions: np.ndarray) -> Dict[str, Any]:
+        """Chuyển output của model (cho 1 ảnh) thành prediction name + confidence"""
+        # Lấy prediction có confidence cao nhất
+        if len(predictions.shape) > 1:
+            # Nếu có nhiều outputs, lấy output đầu tiên
+            pred_array = predictions[0]
+        else:
+            pred_array = predictions
+        
+        # Tìm class có confidence cao nhất
+        class_idx = np.argmax(pred_array)
+        confidence = float(pred_array[class_idx])
+        # Margin giữa top-1 và top-2 (dùng cho cascade early-exit)
+        runner_up = float(np.partition(pred_array, -2)[-2]) if len(pred_array) > 1 else 0.0
+        
+        # Lấy tên class
+        if self.class_names and class_idx < len(self.class_names):
+            prediction_name = self.class_names[class_idx]
+        else:
+            # Fallback: dùng index nếu chưa có class names
+            prediction_name = f"class_{class_idx}"
+        
+        return {
+            "prediction": prediction_name,
+            "confidence": round(confidence, 4),
+            "margin": round(confidence - runner_up, 4),
+            # Full distribution (numpy) để aggregate, không đưa thẳng vào response
+            "probabilities": pred_array,
+        }
+    
+    def vote(
+        self,
+        predictions: Dict[str, Dict[str, Any]],
+        method: Optional[str] = None,
+        top_k: Optional[int] = None,
+    ) -> Dict[str, Any]:
         """
-        Voting mechanism: Chọn kết quả cuối cùng dựa trên majority vote.
+        Voting mechanism: Gộp probability vectors của các models thành kết quả cuối cùng.
+        Phương pháp theo VOTING_METHOD: majority (mặc định) | soft | geometric | weighted.
         
         Args:
             predictions: Dict chứa predictions từ tất cả models
@@ -132,31 +589,18 @@ class PredictionService:
                 "prediction": "Tên món ăn thắng cuộc",
                 "confidence": 0.98,
                 "votes": {"Pho": 2, "Bun": 1},
-                "total_models": 3
+                "total_models": 3,
+                "method": "majority",
+                "top_k": [{"prediction": "Pho", "probability": 0.91}, ...],
+                "margin": 0.85
             }
         """
-        # Đếm số vote cho mỗi prediction
-        vote_counts = Counter()
-        confidence_sum = {}
-        
-        print("📊 Voting - Predictions từ các models:")
-        for model_name, result in predictions.items():
-            prediction = result.get("prediction", "Unknown")
-            confidence = result.get("confidence", 0.0)
-            
-            # Bỏ qua nếu có lỗi
-            if "error" in result:
-                print(f"  ❌ {model_name}: Error - {result.get('error', 'Unknown error')}")
-                continue
-            
-            print(f"  ✅ {model_name}: {prediction} (confidence: {confidence:.4f})")
-            vote_counts[prediction] += 1
-            if prediction not in confidence_sum:
-                confidence_sum[prediction] = 0.0
-            confidence_sum[prediction] += confidence
-        
-        # Chọn prediction có nhiều vote nhất
-        if not vote_counts:
+        # Bỏ qua model bị lỗi
+        valid = {
+            model_name: result for model_name, result in predictions.items()
+            if "error" not in result and result.get("probabilities") is not None
+        }
+        if not valid:
             return {
                 "prediction": "Unknown",
                 "confidence": 0.0,
@@ -164,49 +608,11 @@ class PredictionService:
                 "total_models": len(predictions),
             }
         
-        # Lấy prediction có nhiều vote nhất
-        most_common = vote_counts.most_common()
-        max_votes = most_common[0][1]  # Số vote cao nhất
-        
-        print(f"\n📊 Voting - Vote counts: {dict(vote_counts)}")
-        print(f"📊 Voting - Confidence sums: {confidence_sum}")
-        print(f"📊 Voting - Max votes: {max_votes}")
-        
-        # Nếu có nhiều predictions cùng số vote (tie), chọn cái có confidence cao nhất
-        tied_predictions = [pred for pred, votes in most_common if votes == max_votes]
-        
-        if len(tied_predictions) == 1:
-            # Chỉ có 1 prediction có nhiều vote nhất
-            best_prediction = tied_predictions[0]
-            print(f"✅ Voting - Chọn {best_prediction} (có {max_votes} votes, duy nhất)")
-        else:
-            # Có tie - chọn prediction có confidence cao nhất
-            print(f"⚠️  Voting - Có tie! {len(tied_predictions)} predictions cùng {max_votes} votes")
-            print(f"   Tied predictions: {tied_predictions}")
-            
-            # Tính average confidence cho mỗi tied prediction
-            tied_with_confidence = [
-                (pred, confidence_sum.get(pred, 0.0) / vote_counts[pred])
-                for pred in tied_predictions
-            ]
-            print(f"   Average confidences: {dict(tied_with_confidence)}")
-            
-            best_prediction = max(
-                tied_predictions,
-                key=lambda p: confidence_sum.get(p, 0.0) / vote_counts[p]  # Average confidence
-            )
-            best_avg_conf = confidence_sum[best_prediction] / vote_counts[best_prediction]
-            print(f"✅ Voting - Chọn {best_prediction} (average confidence cao nhất: {best_avg_conf:.4f})")
-        
-        num_votes = vote_counts[best_prediction]
-        avg_confidence = confidence_sum[best_prediction] / num_votes
-        
-        return {
-            "prediction": best_prediction,
-            "confidence": round(avg_confidence, 4),
-            "votes": dict(vote_counts),
-            "total_models": len(predictions),
-        }
+        model_names = list(valid.keys())
+        probabilities = np.stack([valid[model_name]["probabilities"] for model_name in model_names])
+        result = self.aggregator.aggregate(model_names, probabilities, self.class_names, method, top_k)
+        result["total_models"] = len(predictions)
+        return result
     
     def set_class_names(self, class_names: list):
         """Set danh sách tên classes"""
@@ -0,0 +1,341 @@
+"""
+Worker Pool - Chạy inference trong nhiều process để không bị giới hạn bởi GIL
+"""
+
+from typing import Any, Dict, List, Optional
+from concurrent.futures import Future
+import itertools
+import multiprocessing as mp
+import queue
+import threading
+import time
+import numpy as np
+
+
+def _worker_main(
+    worker_id: int,
+    model_names: List[str],
+    request_queue,
+    result_queue,
+    intra_op_threads: int,
+    inter_op_threads: int,
+    cpus: Optional[List[int]] = None,
+):
+    """
+    Entry point của worker process: pin CPU (nếu có), cấu hình thread TF, load models
+    được giao, sau đó nhận (job_id, model_name, batch) và trả output về result_queue.
+    """
+    import asyncio
+    import os
+    from utils.runtime import configure_runtime
+
+    if cpus:
+        # Mỗi worker một nhóm core riêng: thread pool của các worker không tranh nhau core
+        os.sched_setaffinity(0, cpus)
+    # Phải chạy trước khi import TF / TF runtime khởi tạo (trước lần chạy op đầu tiên)
+    configure_runtime(intra_op_threads, inter_op_threads)
+
+    from services.model_service import ModelService
+
+    model_service = ModelService(model_names=model_names, num_workers=0, lazy_loading=False, fused=False)
+    if not model_service.backend_threads:
+        model_service.backend_threads = intra_op_threads
+    try:
+        asyncio.run(model_service.load_all_models())
+    except Exception as e:
+        result_queue.put(("failed", worker_id, None, f"{type(e).__name__}: {e}"))
+        return
+
+    runners = {}
+    models_info = {}
+    for model_name, model in model_service.models.items():
+        runner = model_service.inference_fns.get(model_name)
+        if runner is None:
+            runner = lambda batch, model=model: model.predict(batch, verbose=0)
+        runners[model_name] = runner
+        output_shape = getattr(model, "output_shape", None)
+        if isinstance(output_shape, list):
+            output_shape = output_shape[0]
+        models_info[model_name] = {
+            "input_size": model_service.get_input_size(model_name),
+            "num_classes": int(output_shape[-1]) if output_shape else None,
+            # uint8 batch qua IPC nhỏ hơn 4 lần so với float32
+            "accepts_uint8": bool(getattr(runner, "accepts_uint8", False)),
+            "precision": model_service.precision_stats.get(model_name),
+            "version": model_service.model_versions.get(model_name),
+        }
+    result_queue.put(("ready", worker_id, None, models_info))
+
+    while True:
+        job = request_queue.get()
+        if job is None:
+            break
+        job_id, model_name, batch = job
+        try:
+            outputs = np.asarray(runners[model_name](batch))
+            result_queue.put(("result", worker_id, job_id, outputs))
+        except Exception as e:
+            result_queue.put(("error", worker_id, job_id, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    """Trạng thái của một worker process ở phía parent"""
+
+    def __init__(self, worker_id: int, model_names: List[str]):
+        self.worker_id = worker_id
+        self.model_names = model_names
+        self.process = None
+        self.request_queue = None
+        self.pending: Dict[int, Future] = {}
+        self.models_info: Dict[str, Dict[str, Any]] = {}
+        self.ready = threading.Event()
+        self.failed: Optional[str] = None
+        self.restarts = 0
+        self.completed = 0
+
+
+class WorkerPool:
+    """
+    Pool các inference process.
+
+    - Mỗi worker giữ một nhóm models (replicate: tất cả; pin: chia models
+      giữa các worker để RAM không nhân theo số process)
+    - Request được gửi tới worker có ít job đang chờ nhất trong số các
+      worker có model đó
+    - Worker chết thì các job đang chờ báo lỗi và worker được khởi động lại
+    """
+
+    def __init__(
+        self,
+        assignments: List[List[str]],
+        intra_op_threads: int = 1,
+        inter_op_threads: int = 1,
+        monitor_interval: float = 1.0,
+        cpu_sets: Optional[List[List[int]]] = None,
+    ):
+        self._ctx = mp.get_context("spawn")
+        self._result_queue = self._ctx.Queue()
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count()
+        self._stopped = False
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.monitor_interval = monitor_interval
+        # CPU affinity theo worker id (None = không pin)
+        self.cpu_sets = cpu_sets
+        self.workers = [_Worker(worker_id, names) for worker_id, names in enumerate(assignments)]
+
+    def start(self, timeout: float = 600.0) -> Dict[str, Dict[str, Any]]:
+        """
+        Khởi động tất cả workers và đợi chúng load xong models.
+
+        Returns:
+            {model_name: {"input_size": ..., "num_classes": ...}} của các model sẵn sàng
+        """
+        for worker in self.workers:
+            self._spawn(worker)
+        threading.Thread(target=self._read_results, name="worker-pool-results", daemon=True).start()
+        threading.Thread(target=self._monitor, name="worker-pool-monitor", daemon=True).start()
+
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            if not worker.ready.wait(max(0.0, deadline - time.monotonic())):
+                print(f"⚠️  Inference worker {worker.worker_id} not ready after {timeout:.0f}s")
+
+        models_info: Dict[str, Dict[str, Any]] = {}
+        for worker in self.workers:
+            for model_name, info in worker.models_info.items():
+                models_info.setdefault(model_name, info)
+        return models_info
+
+    def _spawn(self, worker: _Worker):
+        worker.request_queue = self._ctx.Queue()
+        worker.ready.clear()
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                worker.worker_id,
+                worker.model_names,
+                worker.request_queue,
+                self._result_queue,
+                self.intra_op_threads,
+                self.inter_op_threads,
+                self.cpu_sets[worker.worker_id] if self.cpu_sets else None,
+            ),
+            name=f"yummy-inference-{worker.worker_id}",
+            daemon=True,
+        )
+        worker.process.start()
+        print(f"🔄 Started inference worker {worker.worker_id} (pid {worker.process.pid}): {', '.join(worker.model_names)}")
+
+    def submit(self, model_name: str, batch: np.ndarray) -> Future:
+        """Gửi batch tới worker ít tải nhất đang giữ model"""
+        with self._lock:
+            candidates = [
+                worker for worker in self.workers
+                if model_name in worker.models_info and worker.ready.is_set() and not worker.failed
+            ]
+            if not candidates:
+                raise RuntimeError(f"No inference worker available for {model_name}")
+            worker = min(candidates, key=lambda w: len(w.pending))
+            job_id = next(self._job_ids)
+            future: Future = Future()
+            worker.pending[job_id] = future
+            request_queue = worker.request_queue
+        request_queue.put((job_id, model_name, batch))
+        return future
+
+    def _read_results(self):
+        """Thread nhận kết quả từ các workers và resolve futures"""
+        while not self._stopped:
+            try:
+                kind, worker_id, job_id, payload = self._result_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+
+            worker = self.workers[worker_id]
+            if kind == "ready":
+                worker.models_info = payload
+                worker.ready.set()
+                print(f"✅ Inference worker {worker_id} ready: {', '.join(payload)}")
+                continue
+            if kind == "failed":
+                worker.failed = payload
+                worker.ready.set()
+                print(f"❌ Inference worker {worker_id} failed to load models: {payload}")
+                continue
+
+            with self._lock:
+                future = worker.pending.pop(job_id, None)
+                worker.completed += 1
+            if future is None or future.done():
+                continue
+            if kind == "result":
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    def _monitor(self):
+        """Thread phát hiện worker chết (OOM kill, segfault...) và khởi động lại"""
+        while not self._stopped:
+            time.sleep(self.monitor_interval)
+            for worker in self.workers:
+                if self._stopped or worker.failed or worker.process is None:
+                    continue
+                if not worker.process.is_alive():
+                    self._restart(worker)
+
+    def _restart(self, worker: _Worker):
+        with self._lock:
+            pending = worker.pending
+            worker.pending = {}
+            worker.ready.clear()
+        exit_code = worker.process.exitcode
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(
+                    RuntimeError(f"Inference worker {worker.worker_id} crashed (exit code {exit_code})")
+                )
+        worker.restarts += 1
+        print(f"⚠️  Inference worker {worker.worker_id} died (exit code {exit_code}), restarting...")
+        self._spawn(worker)
+
+    def stop(self, timeout: float = 5.0):
+        """Dừng tất cả workers"""
+        self._stopped = True
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.request_queue.put(None)
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(timeout)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Trạng thái từng worker cho /health"""
+        return {
+            "workers": [
+                {
+                    "worker_id": worker.worker_id,
+                    "pid": worker.process.pid if worker.process else None,
+                    "alive": bool(worker.process and worker.process.is_alive()),
+                    "ready": worker.ready.is_set() and not worker.failed,
+                    "models": list(worker.models_info) or worker.model_names,
+                    "queue_depth": len(worker.pending),
+                    "completed": worker.completed,
+                    "restarts": worker.restarts,
+                    "error": worker.failed,
+                }
+                for worker in self.workers
+            ],
+            "intra_op_threads": self.intra_op_threads,
+            "inter_op_threads": self.inter_op_threads,
+            "cpu_sets": self.cpu_sets,
+        }
+
+
+class RemoteModel:
+    """
+    Proxy cho model chạy trong worker process, dùng như inference callable
+    (blocking, gọi từ thread pool của PredictionService).
+    """
+
+    backend = "worker"
+
+    def __init__(
+        self,
+        pool: WorkerPool,
+        model_name: str,
+        input_size: int,
+        num_classes: Optional[int],
+        timeout: float = 60.0,
+        accepts_uint8: bool = False,
+    ):
+        self.pool = pool
+        self.accepts_uint8 = accepts_uint8
+        self.model_name = model_name
+        self.input_size = input_size
+        self.input_shape = (None, input_size, input_size, 3)
+        self.output_shape = (None, num_classes)
+        self.timeout = timeout
+
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        return self.pool.submit(self.model_name, images).result(timeout=self.timeout)
+
+
+def assign_models(model_names: List[str], num_workers: int, strategy: str) -> List[List[str]]:
+    """
+    Chia models cho workers.
+
+    - replicate: mỗi worker giữ tất cả models (nên dùng với MODEL_BACKEND=tflite,
+      file .tflite được mmap nên các process dùng chung page cache)
+    - pin: mỗi model chỉ nằm ở một số worker (round-robin), RAM không nhân theo N
+    """
+    if strategy == "replicate":
+        return [list(model_names) for _ in range(num_workers)]
+    assignments: List[List[str]] = [[] for _ in range(num_workers)]
+    for index in range(max(num_workers, len(model_names))):
+        model_name = model_names[index % len(model_names)]
+        worker_models = assignments[index % num_workers]
+        if model_name not in worker_models:
+            worker_models.append(model_name)
+    return assignments
+
+
+def assign_cpus(num_workers: int) -> Optional[List[List[int]]]:
+    """
+    Chia các core process được phép dùng thành num_workers nhóm liên tiếp (không chồng nhau).
+    None nếu không hỗ trợ affinity hoặc có ít core hơn số worker.
+    """
+    import os
+
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < num_workers:
+        return None
+    size = len(cpus) // num_workers
+    return [cpus[index * size:(index + 1) * size] for index in range(num_workers)]
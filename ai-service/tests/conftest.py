@@ -0,0 +1,57 @@
+"""
+Tests chạy từ thư mục ai-service: `python -m pytest tests`
+"""
+
+import importlib
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+ADMIN_TOKEN = "test-admin-token"
+
+# Import giống khi chạy server / tools (services.*, utils.*)
+sys.path.insert(0, str(SERVICE_DIR))
+
+
+@pytest.fixture(scope="session")
+def fused_client(tmp_path_factory):
+    """Server với FUSED_ENSEMBLE=true trên stub models (main đọc env lúc import)"""
+    pytest.importorskip("tensorflow")
+    from fastapi.testclient import TestClient
+    from tools.benchmark import build_stub_models
+
+    models_dir = tmp_path_factory.mktemp("stub-models")
+    build_stub_models(models_dir, filters=4)
+    shutil.copy(SERVICE_DIR / "models" / "class_names.json", models_dir / "class_names.json")
+
+    env = {
+        "MODELS_DIR": str(models_dir),
+        "FUSED_ENSEMBLE": "true",
+        "PREDICTION_CACHE_ENABLED": "true",
+        "PREDICTION_CACHE_DISK_PATH": "",
+        "ADMIN_TOKEN": ADMIN_TOKEN,
+    }
+    previous = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    sys.modules.pop("main", None)
+    main = importlib.import_module("main")
+    try:
+        with TestClient(main.app) as client:
+            for _ in range(600):
+                if main.models_loaded or main.models_load_error:
+                    break
+                time.sleep(0.1)
+            assert main.models_loaded, main.models_load_error
+            yield main, client
+    finally:
+        sys.modules.pop("main", None)
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
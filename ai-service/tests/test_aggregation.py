@@ -0,0 +1,56 @@
+import numpy as np
+
+from services.aggregation import EnsembleAggregator
+
+
+CLASS_NAMES = ["pho", "bun_bo_hue", "banh_mi"]
+
+
+def test_majority_ranks_by_votes_when_top_voted_class_has_lower_mean_probability():
+    # pho thắng 3/5 vote với confidence thấp, bun_bo_hue có probability trung bình cao hơn
+    probabilities = np.array([
+        [0.40, 0.35, 0.25],
+        [0.40, 0.35, 0.25],
+        [0.40, 0.35, 0.25],
+        [0.00, 1.00, 0.00],
+        [0.00, 1.00, 0.00],
+    ])
+    model_names = [f"model_{index}" for index in range(len(probabilities))]
+    result = EnsembleAggregator(method="majority", top_k=3).aggregate(model_names, probabilities, CLASS_NAMES)
+
+    assert result["prediction"] == "pho"
+    top_k = result["top_k"]
+    assert [item["prediction"] for item in top_k[:2]] == ["pho", "bun_bo_hue"]
+    assert top_k[0]["probability"] < top_k[1]["probability"]
+    assert [item["votes"] for item in top_k[:2]] == [3, 2]
+    scores = [item["score"] for item in top_k]
+    assert scores == sorted(scores, reverse=True)
+    assert result["margin"] >= 0
+    assert result["margin"] == round(scores[0] - scores[1], 4)
+
+
+def test_soft_voting_margin_uses_probabilities():
+    probabilities = np.array([[0.6, 0.3, 0.1], [0.4, 0.5, 0.1]])
+    result = EnsembleAggregator(method="soft", top_k=2).aggregate(["a", "b"], probabilities, CLASS_NAMES)
+
+    assert result["prediction"] == "pho"
+    assert result["top_k"] == [
+        {"prediction": "pho", "probability": 0.5},
+        {"prediction": "bun_bo_hue", "probability": 0.4},
+    ]
+    assert result["margin"] == 0.1
+
+
+def test_majority_orders_unvoted_classes_by_probability():
+    class_names = [f"c{index}" for index in range(6)]
+    # Mọi model vote c0; c3 > c1 > c5 > c2 về probability trung bình, c4 = 0
+    probabilities = np.array([
+        [0.50, 0.15, 0.05, 0.20, 0.00, 0.10],
+        [0.60, 0.10, 0.05, 0.15, 0.00, 0.10],
+        [0.55, 0.15, 0.00, 0.20, 0.00, 0.10],
+    ])
+    model_names = [f"model_{index}" for index in range(len(probabilities))]
+    result = EnsembleAggregator(method="majority", top_k=5).aggregate(model_names, probabilities, class_names)
+
+    assert [item["prediction"] for item in result["top_k"]] == ["c0", "c3", "c1", "c5", "c2"]
+    assert all(item["votes"] == 0 for item in result["top_k"][1:])
@@ -0,0 +1,66 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from utils.archive import extract_images
+from utils.image_processor import InvalidImageError
+
+
+def _zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+def _tar_gz(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("build", [_zip, _tar_gz])
+def test_extracts_images_sorted_by_name(build):
+    data = build({"b.jpg": b"bbb", "a.png": b"aa", "notes.txt": b"skip", "__MACOSX/._a.png": b"x"})
+    assert extract_images(data) == [("a.png", b"aa"), ("b.jpg", b"bbb")]
+
+
+@pytest.mark.parametrize("build", [_zip, _tar_gz])
+def test_rejects_member_above_per_image_limit(build):
+    # Nén rất nhỏ nhưng giải nén ra 8 MB
+    data = build({"bomb.jpg": b"\0" * (8 * 1024 * 1024)})
+    assert len(data) < 64 * 1024
+    with pytest.raises(InvalidImageError) as error:
+        extract_images(data, max_file_bytes=1024 * 1024)
+    assert error.value.status_code == 413
+
+
+@pytest.mark.parametrize("build", [_zip, _tar_gz])
+def test_rejects_archive_above_total_uncompressed_limit(build):
+    data = build({f"{index}.jpg": b"\0" * (512 * 1024) for index in range(10)})
+    with pytest.raises(InvalidImageError) as error:
+        extract_images(data, max_file_bytes=1024 * 1024, max_total_bytes=2 * 1024 * 1024)
+    assert error.value.status_code == 413
+    assert len(extract_images(data, max_file_bytes=1024 * 1024, max_total_bytes=5 * 1024 * 1024)) == 10
+
+
+def test_zip_header_understating_size_is_caught_while_reading():
+    data = bytearray(_zip({"bomb.jpg": b"\0" * (4 * 1024 * 1024)}))
+    # Sửa uncompressed size trong local header + central directory thành 10 byte
+    size = (4 * 1024 * 1024).to_bytes(4, "little")
+    data = bytes(data).replace(size, (10).to_bytes(4, "little"))
+    with pytest.raises((InvalidImageError, ValueError)):
+        extract_images(data, max_file_bytes=1024 * 1024)
+
+
+def test_rejects_more_than_max_files():
+    data = _zip({f"{index}.jpg": b"x" for index in range(3)})
+    with pytest.raises(ValueError):
+        extract_images(data, max_files=2)
@@ -0,0 +1,30 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from services.batching import MicroBatcher
+
+
+def _run_batch(model, batch):
+    return np.zeros((len(batch), 3), dtype=np.float32)
+
+
+def test_batch_assembly_error_fails_requests_and_keeps_worker_alive():
+    async def scenario():
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            batcher = MicroBatcher("model", _run_batch, executor, max_batch_size=4, max_wait_ms=50)
+            model = object()
+            # Cùng model + dtype nhưng khác kích thước: np.concatenate lỗi
+            results = await asyncio.wait_for(asyncio.gather(
+                batcher.submit(np.zeros((1, 8, 8, 3), dtype=np.float32), model),
+                batcher.submit(np.zeros((1, 4, 4, 3), dtype=np.float32), model),
+                return_exceptions=True,
+            ), timeout=5)
+            assert all(isinstance(result, ValueError) for result in results)
+
+            # Worker vẫn chạy: request sau vẫn có kết quả
+            output = await asyncio.wait_for(batcher.submit(np.zeros((1, 8, 8, 3), dtype=np.float32), model), 5)
+            assert output.shape == (1, 3)
+
+    asyncio.run(scenario())
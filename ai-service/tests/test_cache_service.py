@@ -0,0 +1,35 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from services.cache_service import PredictionCache
+
+
+def _png(seed: int = 0, size=(64, 48)) -> bytes:
+    buffer = io.BytesIO()
+    pixels = np.random.default_rng(seed).integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_lookup_does_not_decode_and_perceptual_lookup_hits_re_encoded_image():
+    cache = PredictionCache(enabled=True, max_entries=8, ttl_seconds=60, use_perceptual_hash=True, disk_path="")
+    original = _png()
+
+    value, keys = cache.lookup(original, "ns")
+    assert value is None and len(keys) == 1  # chỉ SHA-256, chưa decode ảnh
+    assert cache.lookup_perceptual(Image.open(io.BytesIO(original)), keys, "ns") is None
+    assert len(keys) == 2
+    cache.store(keys, {"best_match": "pho"})
+
+    # Cùng ảnh, encode lại (bytes khác): SHA-256 miss, dHash hit
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(original)).save(buffer, "PNG", compress_level=1)
+    re_encoded = buffer.getvalue()
+    assert re_encoded != original
+    value, keys = cache.lookup(re_encoded, "ns")
+    assert value is None
+    assert cache.lookup_perceptual(Image.open(io.BytesIO(re_encoded)), keys, "ns") == {"best_match": "pho"}
+    assert cache.perceptual_hits == 1
+    assert cache.misses == 1
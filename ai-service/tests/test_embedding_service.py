@@ -0,0 +1,58 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+from services.embedding_service import EmbeddingService  # noqa: E402
+from services.model_registry import LazyModelRegistry  # noqa: E402
+
+
+def _keras_model(model_name, model_path):
+    model = tf.keras.Sequential([
+        tf.keras.Input((32, 32, 3)),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(8, activation="relu"),
+        tf.keras.layers.Dense(4, activation="softmax"),
+    ], name=model_name)
+    return model, model
+
+
+class _LazyModelService:
+    """Phần của ModelService mà EmbeddingService dùng, ở lazy mode"""
+
+    serving_mode = "ensemble"
+    models_path = Path("/nonexistent")
+
+    def __init__(self):
+        self.reload_listeners = []
+        self.evict_listeners = []
+        self.model_names = ["inception_v3", "xception"]
+        self.registry = LazyModelRegistry(
+            _keras_model, {name: Path(f"/nonexistent/{name}") for name in self.model_names},
+            on_evict=lambda name: [listener(name) for listener in self.evict_listeners],
+        )
+
+    async def acquire_models(self, model_names=None):
+        return self.registry.acquire(model_names)
+
+    def get_model(self, model_name):
+        return None
+
+    def get_keras_path(self, model_name):
+        raise AssertionError("lazy mode must not load a second copy from the .keras file")
+
+
+def test_lazy_embed_uses_registry_model_and_drops_extractor_on_evict(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_UNKNOWN_THRESHOLD", "not-a-number")
+    model_service = _LazyModelService()
+    embedding_service = EmbeddingService(model_service)
+    assert embedding_service.unknown_threshold_override is None
+
+    extractor = asyncio.run(embedding_service.acquire_extractor("inception_v3"))
+
+    assert model_service.registry.is_resident("inception_v3")
+    assert extractor.dimension == 8
+    assert embedding_service.extractors == {"inception_v3": extractor}
+    model_service.registry.evict("inception_v3")
+    assert embedding_service.extractors == {}
@@ -0,0 +1,43 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip("tensorflow")
+
+
+def _jpeg() -> bytes:
+    buffer = io.BytesIO()
+    pixels = np.random.default_rng(0).integers(0, 255, (320, 240, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def test_fused_results_are_cached(fused_client):
+    main, client = fused_client
+    assert main.model_service.fused is not None
+    image = _jpeg()
+
+    first = client.post("/predict", files={"file": ("dish.jpg", image, "image/jpeg")})
+    second = client.post("/predict", files={"file": ("dish.jpg", image, "image/jpeg")})
+
+    assert first.status_code == second.status_code == 200
+    assert not first.json().get("cached")
+    assert second.json().get("cached") is True
+    assert second.json()["best_match"] == first.json()["best_match"]
+    assert main.prediction_cache.get_stats()["hits"] >= 1
+
+
+def test_top_k_starts_with_best_match_and_ranks_unvoted_by_probability(fused_client):
+    main, client = fused_client
+    response = client.post("/predict?top_k=5", files={"file": ("dish.jpg", _jpeg(), "image/jpeg")})
+
+    assert response.status_code == 200
+    body = response.json()
+    top_k = body["top_k"]
+    assert len(top_k) == 5
+    assert top_k[0]["prediction"] == body["best_match"]
+    if body["voting_result"]["method"] == "majority":
+        unvoted = [item["probability"] for item in top_k if item["votes"] == 0]
+        assert unvoted == sorted(unvoted, reverse=True)
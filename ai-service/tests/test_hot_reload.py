@@ -0,0 +1,58 @@
+import pathlib
+import threading
+
+import pytest
+
+from conftest import ADMIN_TOKEN
+
+pytest.importorskip("tensorflow")
+
+HEADERS = {"Authorization": f"Bearer {ADMIN_TOKEN}"}
+
+
+def test_reload_survives_read_only_version_pointer(fused_client, monkeypatch):
+    main, client = fused_client
+    from services.model_service import VERSION_POINTER_FILE
+
+    write_text = pathlib.Path.write_text
+
+    def read_only(path, *args, **kwargs):
+        if path.name == VERSION_POINTER_FILE:
+            raise PermissionError(30, "Read-only file system", str(path))
+        return write_text(path, *args, **kwargs)
+
+    monkeypatch.setattr(pathlib.Path, "write_text", read_only)
+    listened = []
+    monkeypatch.setattr(main.model_service, "reload_listeners",
+                        [*main.model_service.reload_listeners, listened.append])
+
+    response = client.post("/admin/models/vgg19/reload?wait=true", headers=HEADERS)
+
+    assert response.status_code == 200, response.text
+    status = response.json()
+    assert status["state"] == "active"
+    assert "Read-only" in status["pointer_error"]
+    assert listened == ["vgg19"]
+    assert main.model_service.fused._models["vgg19"] is main.model_service.models["vgg19"]
+    # Không kẹt ở "loading": reload tiếp theo không bị 409
+    assert client.post("/admin/models/vgg19/reload?wait=true", headers=HEADERS).status_code == 200
+
+
+def test_concurrent_reloads_keep_every_new_model_in_fused_ensemble(fused_client):
+    main, client = fused_client
+    names = ["vgg19", "xception"]
+    responses = {}
+
+    def reload(model_name):
+        responses[model_name] = client.post(f"/admin/models/{model_name}/reload?wait=true", headers=HEADERS)
+
+    threads = [threading.Thread(target=reload, args=(model_name,)) for model_name in names]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(response.status_code == 200 for response in responses.values())
+    fused = main.model_service.fused
+    for model_name in main.model_service.models:
+        assert fused._models[model_name] is main.model_service.models[model_name]
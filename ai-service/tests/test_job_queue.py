@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from services.job_queue import JobQueue, check_callback_url
+
+
+async def _handler(payload):
+    return {"best_match": payload}
+
+
+def test_callbacks_are_disabled_without_allowlist():
+    with pytest.raises(ValueError, match="disabled"):
+        check_callback_url("http://backend:3000/ai/callback", [])
+
+
+def test_callback_allowlist():
+    check_callback_url("http://backend:3000/ai/callback", ["backend"])
+    with pytest.raises(ValueError, match="not allowed"):
+        check_callback_url("http://169.254.169.254/latest/meta-data", ["backend"])
+    with pytest.raises(ValueError, match="http"):
+        check_callback_url("file:///etc/passwd", ["backend"])
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1:8000/admin",
+    "http://localhost/",
+    "http://169.254.169.254/latest/meta-data",
+    "http://10.0.0.5/",
+    "http://[::1]/",
+])
+def test_wildcard_rejects_non_public_addresses(url):
+    with pytest.raises(ValueError):
+        check_callback_url(url, ["*"])
+
+
+def test_wildcard_accepts_public_address():
+    check_callback_url("https://8.8.8.8/callback", ["*"])
+
+
+def test_completed_jobs_are_bounded():
+    queue = JobQueue(_handler, max_queue_size=4)
+    queue.max_stored_results = 3
+    jobs = [queue.add_completed({"best_match": str(index)}) for index in range(10)]
+
+    assert len(queue.jobs) == 3
+    assert queue.get(jobs[0].id) is None
+    assert queue.get(jobs[-1].id) is jobs[-1]
+    assert queue.get_stats()["evicted"] == 7
+
+
+def test_eviction_drops_earliest_finished_job():
+    queue = JobQueue(_handler, max_queue_size=4)
+    queue.max_stored_results = 2
+    long_job = queue.add_completed({"best_match": "long"})
+    quick_job = queue.add_completed({"best_match": "quick"})
+    # Job submit trước nhưng xong sau cùng (vd. chạy lâu) phải được giữ lại
+    long_job.finished_at = quick_job.finished_at + 1
+    latest_job = queue.add_completed({"best_match": "latest"})
+
+    assert queue.get(quick_job.id) is None
+    assert queue.get(long_job.id) is long_job
+    assert queue.get(latest_job.id) is latest_job
+
+
+def test_callbacks_run_on_their_own_executor():
+    queue = JobQueue(_handler, max_queue_size=4)
+    delivered = threading.Event()
+    threads = []
+
+    def deliver(job):
+        threads.append(threading.current_thread().name)
+        delivered.set()
+
+    queue._deliver_callback = deliver
+    queue.add_completed({"best_match": "pho"}, "http://backend/callback")
+
+    assert delivered.wait(5)
+    assert threads[0].startswith("job-callback")
@@ -0,0 +1,73 @@
+import threading
+import time
+from pathlib import Path
+
+from services.model_registry import LazyModelRegistry
+
+
+class _SlowLoader:
+    def __init__(self, delays):
+        self.delays = delays
+        self.calls = []
+
+    def __call__(self, model_name, model_path):
+        self.calls.append(model_name)
+        time.sleep(self.delays.get(model_name, 0.0))
+        model = object()
+        return model, model
+
+
+def _registry(loader):
+    return LazyModelRegistry(loader, {"fast": Path("/nonexistent/fast"), "slow": Path("/nonexistent/slow")})
+
+
+def test_resident_model_is_not_blocked_by_another_model_loading():
+    loader = _SlowLoader({"slow": 1.0})
+    registry = _registry(loader)
+    registry.acquire(["fast"])
+
+    slow_thread = threading.Thread(target=registry.acquire, args=(["slow"],))
+    slow_thread.start()
+    time.sleep(0.1)
+    start = time.perf_counter()
+    models, _ = registry.acquire(["fast"])
+    elapsed = time.perf_counter() - start
+    slow_thread.join()
+
+    assert list(models) == ["fast"]
+    assert elapsed < 0.5
+    assert registry.is_resident("slow")
+
+
+def test_concurrent_requests_load_a_model_once():
+    loader = _SlowLoader({"slow": 0.3})
+    registry = _registry(loader)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(registry.acquire(["slow"])[0]["slow"]))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loader.calls == ["slow"]
+    assert len(results) == 4 and all(model is results[0] for model in results)
+    assert registry.get_stats()["models"]["slow"]["loads"] == 1
+
+
+def test_failed_load_is_skipped_and_can_be_retried():
+    attempts = []
+
+    def loader(model_name, model_path):
+        attempts.append(model_name)
+        if len(attempts) == 1:
+            raise OSError("broken file")
+        model = object()
+        return model, model
+
+    registry = LazyModelRegistry(loader, {"slow": Path("/nonexistent/slow")})
+    assert registry.acquire(["slow"]) == ({}, {})
+    models, _ = registry.acquire(["slow"])
+    assert "slow" in models
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+tf = pytest.importorskip("tensorflow")
+from services.model_service import ModelService  # noqa: E402
+
+
+def _model():
+    return tf.keras.Sequential([
+        tf.keras.Input((32, 32, 3)),
+        tf.keras.layers.Conv2D(4, 3, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(5, activation="softmax"),
+    ])
+
+
+def _service(monkeypatch, calibration_dir=""):
+    monkeypatch.setenv("MODEL_PRECISION", "float16")
+    monkeypatch.setenv("MODEL_PRECISION_CALIBRATION_DIR", str(calibration_dir))
+    monkeypatch.setenv("MODEL_PRECISION_MAX_SLOWDOWN", "100")
+    return ModelService(num_workers=0, lazy_loading=False, serving_mode="ensemble", fused=False)
+
+
+def test_reduced_precision_needs_calibration_images(monkeypatch, tmp_path):
+    model = _model()
+    service = _service(monkeypatch)
+
+    assert service._apply_precision("vgg19", model) is model
+    assert service.precision_stats["vgg19"]["precision"] == "float32"
+    assert "MODEL_PRECISION_CALIBRATION_DIR" in service.precision_stats["vgg19"]["reason"]
+
+    service = _service(monkeypatch, tmp_path)
+    assert service._apply_precision("vgg19", model) is model
+    assert "no calibration images" in service.precision_stats["vgg19"]["reason"]
+
+
+def test_reduced_precision_is_checked_on_calibration_images(monkeypatch, tmp_path):
+    for index in range(4):
+        pixels = np.random.default_rng(index).integers(0, 255, (40, 40, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(tmp_path / f"{index}.jpg")
+    service = _service(monkeypatch, tmp_path)
+
+    service._apply_precision("vgg19", _model())
+
+    assert service.precision_stats["vgg19"]["calibration"] == "4 images"
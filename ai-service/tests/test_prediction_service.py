@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+from services.prediction_service import PredictionService  # noqa: E402
+
+
+def test_tta_margin_uses_mean_probabilities_not_vote_share():
+    # 3/3 vote cho class 0 nhưng confidence thấp: vote margin ~1.0, probability margin 0.05
+    predictions = {
+        f"model_{index}": {"probabilities": np.array([0.40, 0.35, 0.25])}
+        for index in range(3)
+    }
+    predictions["broken"] = {"error": "boom"}
+
+    margin = PredictionService._probability_margin(predictions)
+
+    assert margin == pytest.approx(0.05)
+    assert PredictionService._probability_margin({"broken": {"error": "boom"}}) is None
@@ -0,0 +1,31 @@
+import threading
+
+from utils import runtime
+
+
+def test_auto_profile_starts_with_fallback_and_tunes_in_background(monkeypatch, tmp_path):
+    monkeypatch.setattr(runtime, "_state", {})
+    monkeypatch.setenv("RUNTIME_PROFILE", "auto")
+    monkeypatch.setenv("RUNTIME_TUNING_PATH", str(tmp_path / "runtime_tuning.json"))
+    monkeypatch.setenv("TF_ENABLE_ONEDNN_OPTS", "0")
+    for name in ("TF_INTRA_OP_THREADS", "TF_INTER_OP_THREADS", "RUNTIME_TUNING_OBJECTIVE", "RUNTIME_TUNING_ON_STARTUP"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("BATCH_MAX_WAIT_MS", "5")
+    benchmark_started = threading.Event()
+    release_benchmark = threading.Event()
+
+    def slow_benchmark(path, objective, onednn):
+        benchmark_started.set()
+        release_benchmark.wait(5)
+        return None
+
+    monkeypatch.setattr(runtime, "run_self_benchmark", slow_benchmark)
+
+    state = runtime.configure_runtime()
+
+    # configure_runtime trả về ngay với profile fallback, không chờ self-benchmark
+    assert state["source"] == "fallback"
+    assert (state["intra_op_threads"], state["inter_op_threads"]) == runtime.profile_threads("latency", state["cpus"])
+    assert benchmark_started.wait(5)
+    assert state["tuning_job"]["state"] == "running"
+    release_benchmark.set()
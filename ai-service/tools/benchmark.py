@@ -0,0 +1,328 @@
+"""
+Benchmark - Đo latency / throughput của AI service (chạy offline với stub models)
+
+Chạy từ thư mục ai-service:
+
+    python -m tools.benchmark --stub-models --concurrency 8 --requests 200
+    python -m tools.benchmark --models-dir models --images data/replay --compare benchmark_results/old.json
+    python -m tools.benchmark --url http://localhost:8000 --images data/replay --concurrency 16
+
+--stub-models tạo 5 model random-weight rất nhỏ (cùng tên file, kích thước input và số
+class với model thật) trong thư mục tạm nên không cần file .keras thật. Các stage được đo:
+preprocess (preprocess_multi), inference từng model (batch 1), voting và end-to-end
+/predict với nhiều request đồng thời. Mỗi stage có p50/p95/p99 + images/sec; report JSON
+kèm commit hiện tại để so sánh giữa các commit (--compare).
+"""
+
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+
+
+DEFAULT_NUM_CLASSES = 30
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Latency / throughput benchmark for Yummy AI service")
+    parser.add_argument("--stub-models", action="store_true", help="Dùng model random-weight nhỏ thay cho file .keras")
+    parser.add_argument("--stub-filters", type=int, default=16, help="Số filter conv của stub model (tăng để nặng hơn)")
+    parser.add_argument("--models-dir", default=None, help="Thư mục model thật (mặc định MODELS_DIR / models)")
+    parser.add_argument("--images", default=None, help="Thư mục ảnh; mặc định sinh ảnh ngẫu nhiên")
+    parser.add_argument("--num-images", type=int, default=16, help="Số ảnh sinh ngẫu nhiên")
+    parser.add_argument("--image-width", type=int, default=1200)
+    parser.add_argument("--image-height", type=int, default=900)
+    parser.add_argument("--iterations", type=int, default=50, help="Số lần đo mỗi stage riêng lẻ")
+    parser.add_argument("--requests", type=int, default=100, help="Số request end-to-end /predict")
+    parser.add_argument("--concurrency", type=int, default=4, help="Số request /predict đồng thời")
+    parser.add_argument("--warmup", type=int, default=5, help="Số request warm-up (không tính)")
+    parser.add_argument("--url", default=None, help="Benchmark server đang chạy thay vì chạy in-process")
+    parser.add_argument("--skip-stages", action="store_true", help="Chỉ đo end-to-end")
+    parser.add_argument("--output", default=None, help="File JSON (mặc định benchmark_results/<commit>-<time>.json)")
+    parser.add_argument("--compare", default=None, help="Report JSON cũ để so sánh")
+    return parser.parse_args()
+
+
+def summarize(latencies_ms: List[float], images: Optional[int] = None, wall_seconds: Optional[float] = None) -> Dict[str, float]:
+    """p50 / p95 / p99 + throughput của một stage"""
+    values = np.asarray(latencies_ms, dtype=np.float64)
+    if values.size == 0:
+        return {"count": 0}
+    total_seconds = wall_seconds if wall_seconds is not None else values.sum() / 1000
+    return {
+        "count": int(values.size),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+        "images_per_sec": round((images or int(values.size)) / total_seconds, 2) if total_seconds > 0 else None,
+    }
+
+
+def build_stub_models(out_dir: Path, num_classes: int = DEFAULT_NUM_CLASSES, filters: int = 16):
+    """Tạo model random-weight cho từng file trong MODEL_FILES (cùng input size + số class)"""
+    import tensorflow as tf
+    from services.model_service import MODEL_FILES, MODEL_INPUT_SIZES, DEFAULT_INPUT_SIZE
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for model_name, model_file in MODEL_FILES.items():
+        size = MODEL_INPUT_SIZES.get(model_name, DEFAULT_INPUT_SIZE)
+        model = tf.keras.Sequential([
+            tf.keras.Input((size, size, 3)),
+            tf.keras.layers.Conv2D(filters, 3, strides=2, activation="relu"),
+            tf.keras.layers.Conv2D(filters * 2, 3, strides=2, activation="relu"),
+            tf.keras.layers.GlobalAveragePooling2D(),
+            tf.keras.layers.Dense(num_classes, activation="softmax"),
+        ], name=model_name)
+        model.save(out_dir / model_file)
+    print(f"🧪 Stub models written to {out_dir}")
+
+
+def load_images(args) -> List[bytes]:
+    """Bytes của ảnh benchmark (thư mục ảnh hoặc JPEG ngẫu nhiên cỡ ảnh điện thoại)"""
+    if args.images:
+        from utils.dataset import list_images
+        paths = list_images(Path(args.images), limit=args.num_images)
+        if not paths:
+            raise SystemExit(f"No images found in {args.images}")
+        return [path.read_bytes() for path in paths]
+
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(args.num_images):
+        # Gradient + noise để JPEG có kích thước gần ảnh thật (noise thuần nén rất kém)
+        base = np.linspace(0, 255, args.image_width, dtype=np.float32)[None, :, None]
+        noise = rng.normal(0, 20, (args.image_height, args.image_width, 3))
+        pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+async def bench_stages(main_module, images: List[bytes], iterations: int) -> Dict[str, Any]:
+    """Đo riêng từng stage: preprocess, inference từng model, voting"""
+    model_service = main_module.model_service
+    prediction_service = main_module.prediction_service
+    image_processor = main_module.image_processor
+    models, inference_fns = await model_service.acquire_models()
+    input_sizes = prediction_service.get_input_sizes(models, image_processor)
+    sizes = set(input_sizes.values())
+
+    decoded = [Image.open(io.BytesIO(data)) for data in images]
+    for image in decoded:
+        image.load()
+
+    stages: Dict[str, Any] = {}
+    latencies = []
+    preprocessed = []
+    for index in range(iterations):
+        image = decoded[index % len(decoded)]
+        start = time.perf_counter()
+        preprocessed.append(image_processor.preprocess_multi(image, sizes))
+        latencies.append((time.perf_counter() - start) * 1000)
+    stages["preprocess"] = summarize(latencies)
+
+    stages["inference"] = {}
+    outputs = {}
+    for model_name, model in models.items():
+        runner = inference_fns.get(model_name, model)
+        latencies = []
+        for index in range(iterations):
+            batch = preprocessed[index % len(preprocessed)][input_sizes[model_name]]
+            start = time.perf_counter()
+            outputs[model_name] = prediction_service._infer(runner, batch)
+            latencies.append((time.perf_counter() - start) * 1000)
+        stages["inference"][model_name] = summarize(latencies)
+
+    predictions = {
+        model_name: prediction_service._format_prediction(np.asarray(output))
+        for model_name, output in outputs.items()
+    }
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        prediction_service.vote(predictions)
+        latencies.append((time.perf_counter() - start) * 1000)
+    stages["vote"] = summarize(latencies)
+    return stages
+
+
+async def bench_end_to_end(client, images: List[bytes], requests: int, concurrency: int, warmup: int) -> Dict[str, Any]:
+    """Gửi `requests` request /predict với tối đa `concurrency` request cùng lúc"""
+    async def post(index: int) -> float:
+        data = images[index % len(images)]
+        start = time.perf_counter()
+        response = await client.post("/predict", files={"file": (f"bench_{index}.jpg", data, "image/jpeg")})
+        elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f"/predict returned {response.status_code}: {response.text[:200]}")
+        return elapsed
+
+    for index in range(warmup):
+        await post(index)
+
+    latencies: List[float] = []
+    next_index = iter(range(requests))
+
+    async def worker():
+        for index in next_index:
+            latencies.append(await post(index))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall_seconds = time.perf_counter() - start
+    return {"concurrency": concurrency, **summarize(latencies, requests, wall_seconds)}
+
+
+async def run(args) -> Dict[str, Any]:
+    try:
+        import httpx
+    except ImportError as e:
+        raise RuntimeError("tools.benchmark requires httpx (pip install -r requirements-dev.txt)") from e
+
+    images = load_images(args)
+    report: Dict[str, Any] = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "stub_models": args.stub_models,
+            "images": args.images or f"random {args.image_width}x{args.image_height} JPEG",
+            "num_images": len(images),
+            "iterations": args.iterations,
+            "requests": args.requests,
+            "url": args.url,
+        },
+    }
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=300) as client:
+            report["health"] = (await client.get("/health")).json()
+            report["end_to_end"] = await bench_end_to_end(
+                client, images, args.requests, args.concurrency, args.warmup
+            )
+        return report
+
+    # In-process: env phải set trước khi import main (services đọc config lúc khởi tạo)
+    os.environ["PREDICTION_CACHE_ENABLED"] = "false"  # ảnh lặp lại không được trả từ cache
+    import main as main_module
+    import tensorflow as tf
+
+    report["tensorflow"] = tf.__version__
+    await main_module.load_models_background()
+    if not main_module.models_loaded:
+        raise SystemExit(f"Models failed to load: {main_module.models_load_error}")
+    report["inference_mode"] = main_module.model_service.get_inference_mode()
+    report["env"] = {
+        key: value for key, value in sorted(os.environ.items())
+        if key.startswith(("BATCH_", "ENABLE_", "ENSEMBLE_", "CASCADE_", "MODEL_", "PREPROCESS_",
+                           "USE_", "VOTING_", "LAZY_", "WORKER_"))
+    }
+
+    if not args.skip_stages:
+        print("⏱️  Benchmarking stages...")
+        report["stages"] = await bench_stages(main_module, images, args.iterations)
+
+    print(f"⏱️  Benchmarking /predict ({args.requests} requests, concurrency {args.concurrency})...")
+    transport = httpx.ASGITransport(app=main_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=300) as client:
+        report["end_to_end"] = await bench_end_to_end(
+            client, images, args.requests, args.concurrency, args.warmup
+        )
+    report["batching"] = main_module.prediction_service.get_batching_stats()
+    main_module.model_service.shutdown()
+    return report
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any]) -> List[str]:
+    """So sánh p50 / p95 / images_per_sec với report cũ"""
+    def flatten(report: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+        rows = {}
+        for stage, stats in report.get("stages", {}).items():
+            if stage == "inference":
+                rows.update({f"inference.{name}": model_stats for name, model_stats in stats.items()})
+            else:
+                rows[stage] = stats
+        if "end_to_end" in report:
+            rows["end_to_end"] = report["end_to_end"]
+        return rows
+
+    old_rows = flatten(previous)
+    lines = [f"📊 Compared with {previous.get('commit')} ({previous.get('timestamp')}):"]
+    for stage, stats in flatten(current).items():
+        old = old_rows.get(stage)
+        if not old:
+            continue
+        parts = []
+        for key in ("p50_ms", "p95_ms", "images_per_sec"):
+            if stats.get(key) and old.get(key):
+                parts.append(f"{key} {old[key]} -> {stats[key]} ({100 * (stats[key] / old[key] - 1):+.1f}%)")
+        lines.append(f"   {stage}: " + ", ".join(parts))
+    return lines
+
+
+def main():
+    args = parse_args()
+    if args.stub_models:
+        stub_dir = Path(tempfile.mkdtemp(prefix="yummy-stub-models-"))
+        build_stub_models(stub_dir, filters=args.stub_filters)
+        class_names = Path(os.environ.get("MODELS_DIR", "models")) / "class_names.json"
+        if class_names.exists():
+            (stub_dir / "class_names.json").write_bytes(class_names.read_bytes())
+        os.environ["MODELS_DIR"] = str(stub_dir)
+    elif args.models_dir:
+        os.environ["MODELS_DIR"] = args.models_dir
+
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if args.stub_models:
+            shutil.rmtree(os.environ["MODELS_DIR"], ignore_errors=True)
+
+    output = Path(args.output) if args.output else Path("benchmark_results") / (
+        f"{report['commit'] or 'unknown'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    for stage, stats in report.get("stages", {}).items():
+        if stage == "inference":
+            for model_name, model_stats in stats.items():
+                print(f"   inference.{model_name}: {json.dumps(model_stats)}")
+        else:
+            print(f"   {stage}: {json.dumps(stats)}")
+    print(f"   end_to_end: {json.dumps(report['end_to_end'])}")
+    print(f"📊 Report saved to {output}")
+
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print("\n".join(compare(report, previous)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
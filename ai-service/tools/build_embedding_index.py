@@ -0,0 +1,124 @@
+"""
+Build Embedding Index - Tạo vector index ảnh tham chiếu cho /embed (món tương tự + món lạ)
+
+Chạy từ thư mục ai-service:
+
+    python -m tools.build_embedding_index --images data/reference --model inception_v3
+    python -m tools.build_embedding_index --images data/reference --output models/embedding_index --batch-size 64
+
+Thư mục ảnh theo layout <tên món>/*.jpg; tên món không cần nằm trong class_names
+(index có thể chứa món model chưa được train). Mỗi ảnh được lấy embedding (penultimate
+layer, L2-normalized) bằng cùng code path với /embed, rồi ghi embeddings.npy + index.json.
+
+Unknown threshold được calibrate từ chính index: similarity của mỗi ảnh với ảnh gần
+nhất cùng món (leave-one-out), lấy percentile --unknown-percentile. Query có similarity
+cao nhất thấp hơn threshold này bị coi là món lạ.
+"""
+
+from typing import List, Optional, Tuple
+from pathlib import Path
+import argparse
+import time
+import numpy as np
+from PIL import Image
+
+from services.embedding_service import EmbeddingIndex, EmbeddingService
+from services.model_service import ModelService
+from utils.dataset import list_images
+from utils.image_processor import ImageProcessor
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the reference embedding index used by /embed")
+    parser.add_argument("--images", required=True, help="Thư mục ảnh tham chiếu <tên món>/*.jpg")
+    parser.add_argument("--model", default=None, help="Model lấy embedding (mặc định EMBEDDING_MODEL / inception_v3)")
+    parser.add_argument("--output", default=None, help="Thư mục index (mặc định EMBEDDING_INDEX_PATH)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--limit-per-dish", type=int, default=None, help="Số ảnh tối đa mỗi món")
+    parser.add_argument("--unknown-percentile", type=float, default=5.0,
+                        help="Percentile similarity cùng món dùng làm unknown threshold")
+    return parser.parse_args()
+
+
+def list_reference_images(root: Path, limit_per_dish: Optional[int]) -> List[Tuple[Path, str]]:
+    """[(đường dẫn ảnh, tên món)] theo layout root/<tên món>/*.jpg"""
+    samples = []
+    for dish_dir in sorted(Path(root).iterdir()):
+        if dish_dir.is_dir():
+            samples.extend((path, dish_dir.name) for path in list_images(dish_dir, limit_per_dish))
+    return samples
+
+
+def calibrate_unknown_threshold(
+    embeddings: np.ndarray,
+    labels: List[str],
+    percentile: float,
+    chunk_size: int = 1024,
+) -> Optional[float]:
+    """
+    Percentile của similarity giữa mỗi ảnh và ảnh gần nhất cùng món (trừ chính nó).
+    None nếu không món nào có >= 2 ảnh.
+    """
+    label_ids = np.unique(np.asarray(labels), return_inverse=True)[1]
+    nearest_same = []
+    for start in range(0, len(embeddings), chunk_size):
+        scores = embeddings[start:start + chunk_size] @ embeddings.T
+        rows = np.arange(len(scores))
+        scores[rows, start + rows] = -np.inf
+        scores[label_ids[start:start + chunk_size, None] != label_ids[None, :]] = -np.inf
+        best = scores.max(axis=1)
+        nearest_same.append(best[np.isfinite(best)])
+    values = np.concatenate(nearest_same)
+    if values.size == 0:
+        return None
+    return round(float(np.percentile(values, percentile)), 4)
+
+
+def main():
+    args = parse_args()
+    model_service = ModelService(serving_mode="ensemble")
+    embedding_service = EmbeddingService(model_service)
+    model_name = embedding_service.resolve_model(args.model)
+    output = Path(args.output) if args.output else embedding_service.index_path
+    image_processor = ImageProcessor()
+
+    samples = list_reference_images(Path(args.images), args.limit_per_dish)
+    if not samples:
+        raise SystemExit(f"No images found in {args.images} (expected <dish>/*.jpg)")
+    dishes = sorted({label for _, label in samples})
+    print(f"📋 Indexing {len(samples)} images of {len(dishes)} dishes with {model_name}")
+
+    extractor = embedding_service.get_extractor(model_name)
+    embeddings, labels, references = [], [], []
+    start_time = time.perf_counter()
+    for start in range(0, len(samples), args.batch_size):
+        batch = []
+        for path, label in samples[start:start + args.batch_size]:
+            try:
+                with Image.open(path) as image:
+                    batch.append(image_processor.preprocess_multi(image, {extractor.input_size})[extractor.input_size])
+            except Exception as e:
+                print(f"⚠️  Skipping {path}: {e}")
+                continue
+            labels.append(label)
+            references.append(str(path.relative_to(args.images)))
+        if batch:
+            embeddings.append(extractor(np.concatenate(batch, axis=0)))
+        print(f"   🧮 {min(start + args.batch_size, len(samples))}/{len(samples)}")
+    if not embeddings:
+        raise SystemExit("No image could be embedded")
+    embeddings = np.concatenate(embeddings, axis=0).astype(np.float32)
+    elapsed = time.perf_counter() - start_time
+
+    threshold = calibrate_unknown_threshold(embeddings, labels, args.unknown_percentile)
+    index = EmbeddingIndex(
+        embeddings, labels, model_name,
+        references=references, unknown_threshold=threshold, layer_name=extractor.layer_name,
+    )
+    index.save(output, extra={"unknown_percentile": args.unknown_percentile, "source": str(args.images)})
+    print(f"💾 Index saved to {output}: {index.size} x {index.dimension} "
+          f"({len(samples) / elapsed:.1f} images/sec), unknown threshold {threshold}")
+
+
+if __name__ == "__main__":
+    main()
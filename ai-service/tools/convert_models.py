@@ -0,0 +1,254 @@
+"""
+Convert Models - Export ensemble Keras sang TFLite (float16 / dynamic / int8), ONNX hoặc SavedModel snapshot
+
+Chạy từ thư mục ai-service:
+
+    python -m tools.convert_models --format tflite --quantization float16 dynamic int8 \\
+        --representative-dir data/calibration --heldout-dir data/heldout
+
+File output nằm trong models/exported/ (MODEL_EXPORT_DIR), đặt tên theo file .keras gốc,
+vd. InceptionV3_models.int8.tflite. Khi có --heldout-dir (layout <class_name>/*.jpg),
+tool so sánh accuracy / latency / kích thước với model Keras gốc và ghi report JSON.
+Bật backend khi serve bằng MODEL_BACKEND=tflite MODEL_QUANTIZATION=int8 (hoặc onnx).
+
+Snapshot để khởi động nhanh (MODEL_BACKEND=savedmodel):
+
+    python -m tools.convert_models --format savedmodel
+"""
+
+from typing import Dict, Iterator, List, Optional
+from pathlib import Path
+import argparse
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from services.model_backends import ONNXModel, SavedModelSnapshot, TFLiteModel, exported_model_path
+from services.model_service import MODEL_FILES, MODEL_INPUT_SIZES, DEFAULT_INPUT_SIZE
+from utils.dataset import list_images, list_labeled_images
+from utils.image_processor import ImageProcessor
+
+
+TFLITE_QUANTIZATIONS = ("float16", "dynamic", "int8")
+
+
+def load_image(image_processor: ImageProcessor, path: Path, input_size: int) -> np.ndarray:
+    with Image.open(path) as image:
+        return image_processor.preprocess_multi(image, [input_size])[input_size]
+
+
+def representative_dataset(
+    paths: List[Path],
+    image_processor: ImageProcessor,
+    input_size: int,
+) -> Iterator[List[np.ndarray]]:
+    """Generator ảnh calibration cho full-integer quantization"""
+    for path in paths:
+        yield [load_image(image_processor, path, input_size)]
+
+
+def concrete_function(model: tf.keras.Model, input_size: int):
+    """Concrete function (batch thay đổi) dùng làm input cho converter"""
+    @tf.function(input_signature=[tf.TensorSpec([None, input_size, input_size, 3], tf.float32)])
+    def serve(images):
+        return model(images, training=False)
+    return serve.get_concrete_function()
+
+
+def convert_tflite(
+    model: tf.keras.Model,
+    input_size: int,
+    quantization: str,
+    calibration_paths: List[Path],
+    image_processor: ImageProcessor,
+) -> bytes:
+    # Không truyền model làm trackable_obj: với Keras 3 converter lỗi khi infer type
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([concrete_function(model, input_size)])
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if not calibration_paths:
+            raise ValueError("int8 quantization requires --representative-dir with calibration images")
+        converter.representative_dataset = lambda: representative_dataset(
+            calibration_paths, image_processor, input_size
+        )
+    # "dynamic": chỉ Optimize.DEFAULT -> weights int8, activations float
+    return converter.convert()
+
+
+def convert_onnx(model: tf.keras.Model, input_size: int, output_path: Path):
+    try:
+        import tf2onnx
+    except ImportError as e:
+        raise RuntimeError("ONNX export requires tf2onnx (pip install tf2onnx onnxruntime)") from e
+
+    signature = [tf.TensorSpec([None, input_size, input_size, 3], tf.float32, name="images")]
+    tf2onnx.convert.from_function(
+        tf.function(lambda images: model(images, training=False)),
+        input_signature=signature,
+        opset=17,
+        output_path=str(output_path),
+    )
+
+
+def export_savedmodel(model: tf.keras.Model, input_size: int, output_path: Path):
+    """
+    SavedModel chỉ chứa serving concrete function + weights. Chỉ track tf.Variable
+    (không track Keras model) để file không chứa functions của từng layer: load
+    nhanh hơn ~2x và không cần dựng lại Keras objects.
+    """
+    module = tf.Module()
+    # Keras 3: weight.value là tf.Variable bên dưới; Keras 2: weight đã là tf.Variable
+    module.weights = [weight if callable(getattr(weight, "value", None)) else weight.value for weight in model.weights]
+    module.serve = tf.function(
+        lambda images: {"probabilities": model(images, training=False)},
+        input_signature=[tf.TensorSpec([None, input_size, input_size, 3], tf.float32, name="images")],
+    )
+    tf.saved_model.save(module, str(output_path), signatures={"serving_default": module.serve})
+
+
+def evaluate(
+    model_fn,
+    samples: List,
+    image_processor: ImageProcessor,
+    input_size: int,
+) -> Dict[str, object]:
+    """Chạy model trên held-out set, trả về probabilities + latency trung bình"""
+    probabilities = []
+    latencies = []
+    for path, _ in samples:
+        image = load_image(image_processor, path, input_size)
+        start = time.perf_counter()
+        probabilities.append(np.asarray(model_fn(image))[0])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "probabilities": np.stack(probabilities),
+        "latency_ms": float(np.mean(latencies)),
+    }
+
+
+def compare(reference: Dict, candidate: Dict, labels: np.ndarray) -> Dict[str, float]:
+    """So sánh model đã convert với model Keras gốc"""
+    ref_top1 = reference["probabilities"].argmax(axis=1)
+    cand_top1 = candidate["probabilities"].argmax(axis=1)
+    reference_accuracy = float(np.mean(ref_top1 == labels))
+    candidate_accuracy = float(np.mean(cand_top1 == labels))
+    return {
+        "keras_accuracy": round(reference_accuracy, 4),
+        "accuracy": round(candidate_accuracy, 4),
+        "accuracy_delta": round(candidate_accuracy - reference_accuracy, 4),
+        "top1_agreement": round(float(np.mean(ref_top1 == cand_top1)), 4),
+        "max_prob_abs_diff": round(float(np.abs(reference["probabilities"] - candidate["probabilities"]).max()), 6),
+        "keras_latency_ms": round(reference["latency_ms"], 2),
+        "latency_ms": round(candidate["latency_ms"], 2),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export Yummy ensemble to TFLite / ONNX / SavedModel")
+    parser.add_argument("--models-dir", default="models", help="Thư mục chứa file .keras")
+    parser.add_argument("--out-dir", default=None, help="Thư mục output (mặc định <models-dir>/exported)")
+    parser.add_argument("--format", choices=["tflite", "onnx", "savedmodel"], default="tflite")
+    parser.add_argument(
+        "--quantization", nargs="+", choices=TFLITE_QUANTIZATIONS, default=["float16"],
+        help="Các biến thể TFLite cần tạo",
+    )
+    parser.add_argument("--models", nargs="+", default=list(MODEL_FILES), help="Chỉ convert các model này")
+    parser.add_argument("--representative-dir", default=None, help="Ảnh calibration cho int8")
+    parser.add_argument("--representative-count", type=int, default=200)
+    parser.add_argument("--heldout-dir", default=None, help="Held-out set dạng <class_name>/*.jpg")
+    parser.add_argument("--heldout-limit", type=int, default=None)
+    parser.add_argument("--report", default=None, help="File JSON report (mặc định <out-dir>/conversion_report.json)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    models_dir = Path(args.models_dir)
+    out_dir = Path(args.out_dir) if args.out_dir else models_dir / "exported"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    image_processor = ImageProcessor()
+
+    calibration_paths: List[Path] = []
+    if args.representative_dir:
+        calibration_paths = list_images(Path(args.representative_dir), limit=args.representative_count)
+        print(f"📋 Calibration images: {len(calibration_paths)}")
+
+    samples = []
+    labels: Optional[np.ndarray] = None
+    if args.heldout_dir:
+        class_names = json.loads((models_dir / "class_names.json").read_text(encoding="utf-8"))
+        samples = list_labeled_images(Path(args.heldout_dir), class_names, limit=args.heldout_limit)
+        labels = np.array([label for _, label in samples])
+        print(f"📋 Held-out images: {len(samples)}")
+
+    variants = args.quantization if args.format == "tflite" else [""]
+    report: Dict[str, Dict] = {}
+
+    for model_name in args.models:
+        model_file = MODEL_FILES[model_name]
+        keras_path = models_dir / model_file
+        if not keras_path.exists():
+            print(f"⚠️  Model file not found: {keras_path} (skipping)")
+            continue
+
+        print(f"🔄 Loading {model_name} from {keras_path}...")
+        model = tf.keras.models.load_model(str(keras_path), compile=False)
+        input_size = int(model.input_shape[1] or MODEL_INPUT_SIZES.get(model_name, DEFAULT_INPUT_SIZE))
+        report[model_name] = {"keras_size_mb": round(keras_path.stat().st_size / (1024 * 1024), 2)}
+
+        reference = None
+        if samples:
+            reference = evaluate(
+                lambda images: model(images, training=False).numpy(), samples, image_processor, input_size
+            )
+
+        for quantization in variants:
+            output_path = exported_model_path(out_dir, model_file, args.format, quantization)
+            variant_name = quantization or args.format
+            try:
+                start = time.perf_counter()
+                if args.format == "tflite":
+                    output_path.write_bytes(
+                        convert_tflite(model, input_size, quantization, calibration_paths, image_processor)
+                    )
+                    converted = TFLiteModel(output_path)
+                elif args.format == "onnx":
+                    convert_onnx(model, input_size, output_path)
+                    converted = ONNXModel(output_path)
+                else:
+                    export_savedmodel(model, input_size, output_path)
+                    converted = SavedModelSnapshot(output_path)
+                elapsed = time.perf_counter() - start
+            except Exception as e:
+                print(f"❌ {model_name} [{variant_name}] conversion failed: {e}")
+                report[model_name][variant_name] = {"error": str(e)}
+                continue
+
+            size_bytes = (
+                sum(path.stat().st_size for path in output_path.rglob("*") if path.is_file())
+                if output_path.is_dir() else output_path.stat().st_size
+            )
+            entry = {
+                "path": str(output_path),
+                "size_mb": round(size_bytes / (1024 * 1024), 2),
+                "convert_seconds": round(elapsed, 1),
+            }
+            if reference is not None:
+                entry.update(compare(reference, evaluate(converted, samples, image_processor, input_size), labels))
+            report[model_name][variant_name] = entry
+            print(f"✅ {model_name} [{variant_name}]: {json.dumps(entry)}")
+
+        del model
+        tf.keras.backend.clear_session()
+
+    report_path = Path(args.report) if args.report else out_dir / "conversion_report.json"
+    report_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"📊 Report saved to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
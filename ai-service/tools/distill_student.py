@@ -0,0 +1,372 @@
+"""
+Distill Student - Distill ensemble 5 models thành một student nhỏ (một backbone, nhiều head)
+
+Chạy từ thư mục ai-service:
+
+    python -m tools.distill_student --images data/train --val-dir data/val \\
+        --backbone mobilenet_v3_large --epochs 10 --warmup-epochs 2
+
+Ensemble hiện tại (ModelService) làm teacher: probability của từng model trên ảnh
+train được tính một lần và cache ra file NPZ (--targets-cache). Student gồm một
+backbone MobileNet/EfficientNet + một head cho mỗi teacher, học theo soft target
+(KL divergence với temperature); nếu thư mục có layout <class_name>/*.jpg thì
+trộn thêm cross-entropy với nhãn thật theo --alpha. Ảnh không có nhãn vẫn dùng được.
+
+Model lưu ra --output (mặc định models/student.keras) có output tên theo từng teacher,
+phục vụ bằng SERVING_MODE=student: voting của các head giống hệt ensemble nên response
+giữ nguyên format. Report so sánh accuracy / latency của student với vote của ensemble
+trên --val-dir (hoặc --val-split ảnh giữ lại từ --images).
+"""
+
+from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from services.model_service import MODEL_FILES, ModelService, MultiHeadModel, STUDENT_MODEL_NAME
+from services.prediction_service import PredictionService
+from utils.dataset import list_images, list_labeled_images
+from utils.image_processor import ImageProcessor
+
+
+# backbone -> (constructor, scale, offset): input của student là ảnh [0, 1] giống
+# preprocess_multi, Rescaling(scale, offset) đưa về range backbone cần
+BACKBONES = {
+    "mobilenet_v3_small": (tf.keras.applications.MobileNetV3Small, 255.0, 0.0),
+    "mobilenet_v3_large": (tf.keras.applications.MobileNetV3Large, 255.0, 0.0),
+    "mobilenet_v2": (tf.keras.applications.MobileNetV2, 2.0, -1.0),
+    "efficientnet_b0": (tf.keras.applications.EfficientNetB0, 255.0, 0.0),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Distill the model ensemble into a multi-head student")
+    parser.add_argument("--images", required=True, help="Ảnh train (phẳng hoặc <class_name>/*.jpg)")
+    parser.add_argument("--val-dir", default=None, help="Ảnh đánh giá có nhãn <class_name>/*.jpg")
+    parser.add_argument("--val-split", type=float, default=0.1,
+                        help="Tỷ lệ ảnh giữ lại để đánh giá khi không có --val-dir")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--backbone", choices=sorted(BACKBONES), default="mobilenet_v3_large")
+    parser.add_argument("--backbone-weights", choices=["imagenet", "none"], default="imagenet")
+    parser.add_argument("--input-size", type=int, default=224)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--warmup-epochs", type=int, default=2, help="Số epoch đầu chỉ train các head")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--fine-tune-lr", type=float, default=1e-4)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.3, help="Trọng số cross-entropy với nhãn thật")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--targets-cache", default="distill_targets.npz", help="Cache soft targets của teacher")
+    parser.add_argument("--output", default=None, help="File student (mặc định <MODELS_DIR>/student.keras)")
+    parser.add_argument("--report", default=None, help="Report JSON (mặc định <output>_report.json)")
+    return parser.parse_args()
+
+
+def load_samples(root: Path, class_names: List[str], limit: Optional[int]) -> Tuple[List[Path], np.ndarray]:
+    """Ảnh + nhãn (-1 nếu thư mục không có layout theo class)"""
+    samples = list_labeled_images(root, class_names, limit=limit)
+    if samples:
+        return [path for path, _ in samples], np.array([label for _, label in samples], dtype=np.int32)
+    paths = list_images(root, limit=limit)
+    return paths, np.full(len(paths), -1, dtype=np.int32)
+
+
+async def compute_teacher_targets(
+    paths: List[Path],
+    model_service: ModelService,
+    prediction_service: PredictionService,
+    image_processor: ImageProcessor,
+    input_size: int,
+    batch_size: int,
+) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Chạy ensemble trên toàn bộ ảnh train.
+
+    Returns:
+        (student inputs uint8 (N, S, S, 3), teacher probabilities (N, num_models, C), tên models)
+    """
+    models, inference_fns = await model_service.acquire_models()
+    model_names = list(models)
+    input_sizes = prediction_service.get_input_sizes(models, image_processor)
+    sizes = set(input_sizes.values()) | {input_size}
+
+    inputs, targets = [], []
+    for start in range(0, len(paths), batch_size):
+        images = []
+        for path in paths[start:start + batch_size]:
+            with Image.open(path) as image:
+                images.append(image_processor.preprocess_multi(image, sizes))
+        predictions = await prediction_service.predict_batch(images, models, input_sizes, inference_fns)
+        for image, image_predictions in zip(images, predictions):
+            failed = [name for name in model_names if "error" in image_predictions[name]]
+            if failed:
+                raise RuntimeError(f"Teacher models failed: {', '.join(failed)}")
+            inputs.append(np.round(image[input_size][0] * 255).astype(np.uint8))
+            targets.append(np.stack([image_predictions[name]["probabilities"] for name in model_names]))
+        print(f"   🧑‍🏫 Teacher targets {min(start + batch_size, len(paths))}/{len(paths)}")
+    return np.stack(inputs), np.stack(targets).astype(np.float32), model_names
+
+
+def build_student(
+    backbone: str,
+    input_size: int,
+    head_names: List[str],
+    num_classes: int,
+    weights: Optional[str],
+) -> Tuple[tf.keras.Model, tf.keras.Model, tf.keras.Model]:
+    """
+    Returns:
+        (model train trả về logits từng head, model phục vụ trả về softmax, backbone)
+    """
+    constructor, scale, offset = BACKBONES[backbone]
+    inputs = tf.keras.Input((input_size, input_size, 3), name="image")
+    x = tf.keras.layers.Rescaling(scale, offset)(inputs)
+    base = constructor(input_shape=(input_size, input_size, 3), include_top=False, weights=weights)
+    x = base(x)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    x = tf.keras.layers.Dropout(0.2)(x)
+    logits = [tf.keras.layers.Dense(num_classes, name=f"{name}_logits")(x) for name in head_names]
+    # Tên output = tên teacher -> MultiHeadModel.head_names
+    probabilities = [
+        tf.keras.layers.Activation("softmax", name=name)(head_logits)
+        for name, head_logits in zip(head_names, logits)
+    ]
+    return tf.keras.Model(inputs, logits), tf.keras.Model(inputs, probabilities), base
+
+
+def soften(probabilities: np.ndarray, temperature: float) -> np.ndarray:
+    """Soft target với temperature: p^(1/T) chuẩn hóa lại (= softmax(logits / T))"""
+    logits = np.log(np.clip(probabilities, 1e-8, 1.0)) / temperature
+    logits -= logits.max(axis=-1, keepdims=True)
+    softened = np.exp(logits)
+    return (softened / softened.sum(axis=-1, keepdims=True)).astype(np.float32)
+
+
+def distillation_loss(logits, targets, labels, temperature: float, alpha: float):
+    """
+    T² · KL(target || student) trung bình trên các head; ảnh có nhãn trộn thêm
+    cross-entropy với nhãn thật: (1 - alpha) · KD + alpha · CE.
+    """
+    labeled = labels >= 0
+    safe_labels = tf.maximum(labels, 0)
+    total = 0.0
+    for head, head_logits in enumerate(logits):
+        target = targets[:, head]
+        log_student = tf.nn.log_softmax(head_logits / temperature)
+        kd = temperature ** 2 * tf.reduce_sum(target * (tf.math.log(target + 1e-8) - log_student), axis=-1)
+        ce = tf.keras.losses.sparse_categorical_crossentropy(safe_labels, head_logits, from_logits=True)
+        total += tf.where(labeled, (1 - alpha) * kd + alpha * ce, kd)
+    return tf.reduce_mean(total) / len(logits)
+
+
+def train(
+    train_model: tf.keras.Model,
+    base: tf.keras.Model,
+    inputs: np.ndarray,
+    targets: np.ndarray,
+    labels: np.ndarray,
+    args,
+):
+    """Warm-up chỉ train head (backbone đóng băng), sau đó fine-tune toàn bộ"""
+    dataset = (
+        tf.data.Dataset.from_tensor_slices((inputs, targets, labels))
+        .shuffle(len(inputs), seed=args.seed, reshuffle_each_iteration=True)
+        .batch(args.batch_size)
+        .map(
+            lambda x, t, y: (tf.image.random_flip_left_right(tf.cast(x, tf.float32) / 255.0), t, y),
+            num_parallel_calls=tf.data.AUTOTUNE,
+        )
+        .prefetch(tf.data.AUTOTUNE)
+    )
+
+    phases = []
+    if args.warmup_epochs > 0:
+        phases.append(("warm-up", min(args.warmup_epochs, args.epochs), False, args.lr))
+    fine_tune_epochs = args.epochs - min(args.warmup_epochs, args.epochs)
+    if fine_tune_epochs > 0:
+        phases.append(("fine-tune", fine_tune_epochs, True, args.fine_tune_lr if args.warmup_epochs > 0 else args.lr))
+
+    epoch = 0
+    for phase, epochs, backbone_trainable, learning_rate in phases:
+        base.trainable = backbone_trainable
+        optimizer = tf.keras.optimizers.Adam(learning_rate)
+        variables = train_model.trainable_variables
+
+        @tf.function
+        def train_step(x, t, y):
+            with tf.GradientTape() as tape:
+                logits = train_model(x, training=True)
+                if not isinstance(logits, (list, tuple)):
+                    logits = [logits]
+                loss = distillation_loss(logits, t, y, args.temperature, args.alpha)
+            optimizer.apply_gradients(zip(tape.gradient(loss, variables), variables))
+            return loss
+
+        for _ in range(epochs):
+            epoch += 1
+            start = time.perf_counter()
+            losses = [float(train_step(x, t, y)) for x, t, y in dataset]
+            print(f"📚 Epoch {epoch}/{args.epochs} ({phase}): loss {np.mean(losses):.4f} "
+                  f"({time.perf_counter() - start:.1f}s)")
+
+
+def summarize_latency(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "mean_ms": round(float(np.mean(latencies)), 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+    }
+
+
+async def evaluate(
+    prediction_service: PredictionService,
+    image_processor: ImageProcessor,
+    models: Dict,
+    inference_fns: Dict,
+    paths: List[Path],
+) -> Tuple[List[str], List[float]]:
+    """Chạy cùng code path với /predict (predict_all_models + vote), đo latency từng ảnh"""
+    predictions, latencies = [], []
+    for path in paths:
+        with Image.open(path) as image:
+            start = time.perf_counter()
+            results = await prediction_service.predict_all_models(
+                image, models, image_processor, inference_fns=inference_fns, mode="full"
+            )
+            voting_result = prediction_service.vote(results)
+            latencies.append((time.perf_counter() - start) * 1000)
+        predictions.append(voting_result["prediction"])
+    return predictions, latencies
+
+
+def count_params(models: Dict) -> int:
+    return int(sum(model.count_params() for model in models.values() if hasattr(model, "count_params")))
+
+
+async def distill(args) -> Dict:
+    tf.keras.utils.set_random_seed(args.seed)
+    model_service = ModelService(serving_mode="ensemble", fused=False)
+    await model_service.load_all_models()
+    # Tắt micro-batching: tool chạy tuần tự
+    prediction_service = PredictionService(enable_batching=False)
+    prediction_service.set_class_names(model_service.class_names)
+    image_processor = ImageProcessor()
+    class_names = model_service.class_names
+
+    paths, labels = load_samples(Path(args.images), class_names, args.limit)
+    if not paths:
+        raise SystemExit(f"No images found in {args.images}")
+    if args.val_dir:
+        val_paths, val_labels = load_samples(Path(args.val_dir), class_names, None)
+    else:
+        # Giữ lại ngẫu nhiên một phần ảnh train để đánh giá
+        rng = np.random.default_rng(args.seed)
+        order = rng.permutation(len(paths))
+        held_out = set(order[:max(1, int(len(paths) * args.val_split))].tolist()) if len(paths) > 1 else set()
+        val_paths = [paths[i] for i in sorted(held_out)]
+        val_labels = labels[sorted(held_out)]
+        keep = [i for i in range(len(paths)) if i not in held_out]
+        paths, labels = [paths[i] for i in keep], labels[keep]
+    if not val_paths:
+        raise SystemExit("No evaluation images (use --val-dir or more images in --images)")
+    print(f"📋 Distilling on {len(paths)} images ({int((labels >= 0).sum())} labeled), "
+          f"evaluating on {len(val_paths)}")
+
+    # Soft targets của teacher (cache vì chạy 5 models trên toàn bộ ảnh là bước tốn nhất)
+    cache_path = Path(args.targets_cache)
+    path_keys = np.array([str(path) for path in paths])
+    cached = None
+    if cache_path.exists():
+        cached = np.load(cache_path, allow_pickle=False)
+        if not (np.array_equal(cached["paths"], path_keys) and int(cached["input_size"]) == args.input_size):
+            print(f"⚠️  {cache_path} does not match the current image set, recomputing teacher targets")
+            cached = None
+    if cached is not None:
+        inputs, teacher, head_names = cached["inputs"], cached["teacher"], cached["head_names"].tolist()
+        print(f"✅ Loaded teacher targets from {cache_path}")
+    else:
+        inputs, teacher, head_names = await compute_teacher_targets(
+            paths, model_service, prediction_service, image_processor, args.input_size, args.batch_size
+        )
+        np.savez(cache_path, inputs=inputs, teacher=teacher, head_names=np.array(head_names),
+                 paths=path_keys, input_size=args.input_size)
+        print(f"💾 Teacher targets saved to {cache_path}")
+
+    train_model, serving_model, base = build_student(
+        args.backbone,
+        args.input_size,
+        head_names,
+        len(class_names) or teacher.shape[-1],
+        None if args.backbone_weights == "none" else args.backbone_weights,
+    )
+    train(train_model, base, inputs, soften(teacher, args.temperature), labels, args)
+
+    output = Path(args.output) if args.output else model_service.models_path / "student.keras"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    serving_model.save(output)
+    print(f"💾 Student saved to {output} ({output.stat().st_size / (1024 * 1024):.1f} MB)")
+
+    # Đánh giá: load lại file đã lưu, chạy cùng code path với SERVING_MODE=student
+    student = MultiHeadModel(tf.keras.models.load_model(str(output), compile=False))
+    student.warmup()
+    student_models = {STUDENT_MODEL_NAME: student}
+    teacher_models, teacher_fns = await model_service.acquire_models()
+    ensemble_predictions, ensemble_latencies = await evaluate(
+        prediction_service, image_processor, teacher_models, teacher_fns, val_paths
+    )
+    student_predictions, student_latencies = await evaluate(
+        prediction_service, image_processor, student_models, student_models, val_paths
+    )
+
+    teacher_size = sum(
+        (model_service.models_path / MODEL_FILES[name]).stat().st_size
+        for name in head_names if (model_service.models_path / MODEL_FILES[name]).exists()
+    )
+    report = {
+        "backbone": args.backbone,
+        "heads": head_names,
+        "train_images": len(paths),
+        "eval_images": len(val_paths),
+        "ensemble": {
+            **summarize_latency(ensemble_latencies),
+            "voting_method": prediction_service.aggregator.method,
+            "params": count_params(teacher_models),
+            "size_mb": round(teacher_size / (1024 * 1024), 1),
+        },
+        "student": {
+            **summarize_latency(student_latencies),
+            "params": int(serving_model.count_params()),
+            "size_mb": round(output.stat().st_size / (1024 * 1024), 1),
+        },
+        "agreement_with_ensemble": round(
+            float(np.mean([a == b for a, b in zip(student_predictions, ensemble_predictions)])), 4
+        ),
+        "speedup": round(float(np.mean(ensemble_latencies) / np.mean(student_latencies)), 2),
+    }
+    labeled = val_labels >= 0
+    if labeled.any():
+        expected = [class_names[label] if label >= 0 else None for label in val_labels]
+        for key, predicted in (("ensemble", ensemble_predictions), ("student", student_predictions)):
+            correct = [p == e for p, e, is_labeled in zip(predicted, expected, labeled) if is_labeled]
+            report[key]["accuracy"] = round(float(np.mean(correct)), 4)
+
+    report_path = Path(args.report) if args.report else output.with_name(f"{output.stem}_report.json")
+    report_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"📊 Report saved to {report_path}")
+    return report
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(distill(args))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
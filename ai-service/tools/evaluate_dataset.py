@@ -0,0 +1,326 @@
+"""
+Evaluate Dataset - Chấm lại cả thư mục ảnh offline bằng ensemble (không qua HTTP /predict)
+
+Chạy từ thư mục ai-service:
+
+    python -m tools.evaluate_dataset --images data/val --output eval/val.npz
+    python -m tools.evaluate_dataset --images data/val --output eval/val.parquet --batch-size 128
+    python -m tools.evaluate_dataset --images data/val --weights-output models/ensemble_weights.json
+
+Ảnh được stream qua tf.data: decode + resize (cùng preprocess_multi với /predict nên pixel
+giống hệt) chạy song song trên --parallel-calls thread và prefetch trong lúc model chạy
+batch trước; mỗi batch --batch-size ảnh đi qua PredictionService.predict_batch + vote như
+/predict/batch (không TTA / cascade).
+
+Output (--output) chứa probability của từng model cho từng ảnh:
+- .npz: paths, labels (-1 nếu không có nhãn), model_names, class_names,
+  probabilities (N, num_models, num_classes), ensemble_prediction (-1 nếu Unknown),
+  ensemble_confidence, failed, confusion (ensemble), model_confusion (num_models, C, C)
+- .parquet (cần pyarrow): một dòng / ảnh, mỗi model một cột list probability
+
+Report JSON (--report, mặc định cạnh output) gồm throughput, thời gian chờ input
+pipeline vs inference, và nếu thư mục có layout <class_name>/*.jpg: accuracy từng model
++ ensemble, confusion matrix theo class_names.json và các cặp món hay bị nhầm nhất.
+--weights-output học trọng số cho VOTING_METHOD=weighted (aggregation.learn_weights).
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+from PIL import Image
+
+from services.aggregation import learn_weights
+from services.model_service import ModelService
+from services.prediction_service import PredictionService
+from utils.dataset import list_images, list_labeled_images
+from utils.image_processor import ImageProcessor
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk-evaluate the ensemble on a directory of images")
+    parser.add_argument("--images", required=True, help="Thư mục ảnh (phẳng hoặc <class_name>/*.jpg)")
+    parser.add_argument("--output", default="evaluation.npz", help="File probability (.npz hoặc .parquet)")
+    parser.add_argument("--report", default=None, help="Report JSON (mặc định <output>.json)")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=64, help="Số ảnh mỗi batch inference")
+    parser.add_argument("--parallel-calls", type=int, default=None,
+                        help="Số thread decode / resize (mặc định tf.data AUTOTUNE)")
+    parser.add_argument("--prefetch", type=int, default=2, help="Số batch chuẩn bị trước")
+    parser.add_argument("--weights-output", default=None,
+                        help="Học trọng số weighted voting từ ảnh có nhãn và ghi ra file JSON")
+    return parser.parse_args()
+
+
+def load_samples(root: Path, class_names: List[str], limit: Optional[int]) -> Tuple[List[Path], np.ndarray]:
+    """Ảnh + nhãn (-1 nếu thư mục không có layout theo class)"""
+    samples = list_labeled_images(root, class_names, limit=limit)
+    if samples:
+        return [path for path, _ in samples], np.array([label for _, label in samples], dtype=np.int32)
+    paths = list_images(root, limit=limit)
+    return paths, np.full(len(paths), -1, dtype=np.int32)
+
+
+def build_pipeline(
+    paths: List[Path],
+    image_processor: ImageProcessor,
+    sizes: List[int],
+    dtype: Any,
+    batch_size: int,
+    parallel_calls: Optional[int],
+    prefetch: int,
+):
+    """
+    tf.data.Dataset các batch (indices, ok, {size: (B, S, S, 3)}). Decode bằng PIL qua
+    preprocess_multi (PIL nhả GIL khi decode / resize nên các thread chạy song song
+    thật); ảnh hỏng trả về ok=False + ảnh rỗng thay vì làm dừng pipeline.
+    """
+    # Import sau ModelService: configure_runtime() phải chạy trước khi TF khởi tạo
+    import tensorflow as tf
+
+    tf_dtype = tf.uint8 if dtype == np.uint8 else tf.float32
+
+    def load(path: bytes):
+        try:
+            with Image.open(path.decode()) as image:
+                arrays = image_processor.preprocess_multi(image, sizes, dtype=dtype)
+            return (np.bool_(True), *(arrays[size][0] for size in sizes))
+        except Exception as e:
+            print(f"⚠️  Skipping {path.decode()}: {e}")
+            return (np.bool_(False), *(np.zeros((size, size, 3), dtype=dtype) for size in sizes))
+
+    def load_tf(index, path):
+        ok, *arrays = tf.numpy_function(load, [path], [tf.bool] + [tf_dtype] * len(sizes), stateful=False)
+        ok.set_shape([])
+        for array, size in zip(arrays, sizes):
+            array.set_shape([size, size, 3])
+        return index, ok, {str(size): array for size, array in zip(sizes, arrays)}
+
+    return (
+        tf.data.Dataset.from_tensor_slices((np.arange(len(paths)), [str(path) for path in paths]))
+        .map(load_tf, num_parallel_calls=parallel_calls or tf.data.AUTOTUNE, deterministic=True)
+        .batch(batch_size)
+        .prefetch(prefetch)
+    )
+
+
+def confusion_matrix(labels: np.ndarray, predictions: np.ndarray, num_classes: int) -> np.ndarray:
+    """(C, C): hàng = nhãn thật, cột = dự đoán; bỏ qua ảnh không nhãn / dự đoán Unknown"""
+    mask = (labels >= 0) & (predictions >= 0)
+    matrix = np.zeros((num_classes, num_classes), dtype=np.int64)
+    np.add.at(matrix, (labels[mask], predictions[mask]), 1)
+    return matrix
+
+
+def top_confusions(matrix: np.ndarray, class_names: List[str], limit: int = 10) -> List[Dict[str, Any]]:
+    """Các cặp (thật -> dự đoán sai) nhiều nhất"""
+    off_diagonal = matrix.copy()
+    np.fill_diagonal(off_diagonal, 0)
+    order = np.argsort(off_diagonal, axis=None)[::-1][:limit]
+    return [
+        {"true": class_names[row], "predicted": class_names[col], "count": int(off_diagonal[row, col])}
+        for row, col in zip(*np.unravel_index(order, off_diagonal.shape))
+        if off_diagonal[row, col] > 0
+    ]
+
+
+def import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Parquet output requires pyarrow (pip install pyarrow), or use a .npz output") from e
+    return pa, pq
+
+
+def save_parquet(path: Path, results: Dict[str, Any]):
+    pa, pq = import_pyarrow()
+
+    class_names = results["class_names"]
+    columns = {
+        "path": pa.array(results["paths"]),
+        "label": pa.array(results["labels"]),
+        "failed": pa.array(results["failed"]),
+        "ensemble_prediction": pa.array(results["ensemble_prediction"]),
+        "ensemble_confidence": pa.array(results["ensemble_confidence"]),
+    }
+    for index, model_name in enumerate(results["model_names"]):
+        values = pa.array(results["probabilities"][:, index].ravel())
+        columns[model_name] = pa.FixedSizeListArray.from_arrays(values, len(class_names))
+    table = pa.table(columns).replace_schema_metadata({"class_names": json.dumps(class_names)})
+    pq.write_table(table, str(path))
+
+
+async def evaluate(args) -> Dict[str, Any]:
+    output = Path(args.output)
+    if output.suffix == ".parquet":
+        import_pyarrow()  # báo lỗi trước khi chạy cả dataset
+    model_service = ModelService()
+    await model_service.load_all_models()
+    # Tắt micro-batching: predict_batch đã chạy batch thật
+    prediction_service = PredictionService(enable_batching=False)
+    prediction_service.set_class_names(model_service.class_names)
+    image_processor = ImageProcessor()
+    class_names = model_service.class_names
+    class_index = {name: index for index, name in enumerate(class_names)}
+
+    try:
+        paths, labels = load_samples(Path(args.images), class_names, args.limit)
+        if not paths:
+            raise SystemExit(f"No images found in {args.images}")
+        models, inference_fns = await model_service.acquire_models()
+        input_sizes = prediction_service.get_input_sizes(models, image_processor)
+        sizes = sorted(set(input_sizes.values()))
+        dtype = prediction_service.get_input_dtype(models, inference_fns)
+        print(f"📋 Evaluating {len(paths)} images ({int((labels >= 0).sum())} labeled) with "
+              f"{model_service.get_inference_mode()} inference, batches of {args.batch_size}")
+
+        dataset = build_pipeline(
+            paths, image_processor, sizes, dtype, args.batch_size, args.parallel_calls, args.prefetch
+        )
+        model_names: Optional[List[str]] = None
+        probabilities: Optional[np.ndarray] = None
+        ensemble_prediction = np.full(len(paths), -1, dtype=np.int32)
+        ensemble_confidence = np.zeros(len(paths), dtype=np.float32)
+        failed = np.zeros(len(paths), dtype=bool)
+        model_errors: Dict[str, int] = {}
+        input_wait = inference_time = 0.0
+        done = 0
+
+        start_time = time.perf_counter()
+        iterator = dataset.as_numpy_iterator()
+        while True:
+            waited = time.perf_counter()
+            batch = next(iterator, None)
+            input_wait += time.perf_counter() - waited
+            if batch is None:
+                break
+            indices, ok, arrays = batch
+            failed[indices[~ok]] = True
+            valid = np.flatnonzero(ok)
+            done += len(indices)
+            if not valid.size:
+                continue
+
+            images = [{size: arrays[str(size)][row:row + 1] for size in sizes} for row in valid]
+            started = time.perf_counter()
+            batch_predictions = await prediction_service.predict_batch(images, models, input_sizes, inference_fns)
+            inference_time += time.perf_counter() - started
+
+            for row, predictions in zip(valid, batch_predictions):
+                index = indices[row]
+                if model_names is None:
+                    # Tên sau khi tách head (student / fused) - thứ tự cố định cho cả file output
+                    model_names = list(predictions)
+                    probabilities = np.full((len(paths), len(model_names), len(class_names)), np.nan, dtype=np.float32)
+                for position, model_name in enumerate(model_names):
+                    result = predictions.get(model_name, {})
+                    if result.get("probabilities") is None:
+                        model_errors[model_name] = model_errors.get(model_name, 0) + 1
+                        continue
+                    probabilities[index, position] = result["probabilities"]
+                voting_result = prediction_service.vote(predictions)
+                ensemble_prediction[index] = class_index.get(voting_result["prediction"], -1)
+                ensemble_confidence[index] = voting_result["confidence"]
+            elapsed = time.perf_counter() - start_time
+            print(f"   🧮 {done}/{len(paths)} ({done / elapsed:.1f} images/sec)")
+        elapsed = time.perf_counter() - start_time
+    finally:
+        model_service.shutdown()
+
+    if model_names is None:
+        raise SystemExit("No image could be evaluated")
+
+    evaluated = ~failed
+    labeled = evaluated & (labels >= 0)
+    confusion = confusion_matrix(labels, ensemble_prediction, len(class_names))
+    model_confusion = np.stack([
+        confusion_matrix(
+            np.where(labeled, labels, -1),
+            np.where(np.isnan(probabilities[:, position]).any(axis=1), -1,
+                     np.nan_to_num(probabilities[:, position]).argmax(axis=1)),
+            len(class_names),
+        )
+        for position in range(len(model_names))
+    ])
+    results = {
+        "paths": [str(path) for path in paths],
+        "labels": labels,
+        "model_names": model_names,
+        "class_names": class_names,
+        "probabilities": probabilities,
+        "ensemble_prediction": ensemble_prediction,
+        "ensemble_confidence": ensemble_confidence,
+        "failed": failed,
+    }
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    if output.suffix == ".parquet":
+        save_parquet(output, results)
+    else:
+        np.savez(
+            output,
+            **{key: np.asarray(value) for key, value in results.items()},
+            confusion=confusion,
+            model_confusion=model_confusion,
+        )
+    print(f"💾 Probabilities saved to {output}")
+
+    report: Dict[str, Any] = {
+        "images": len(paths),
+        "evaluated": int(evaluated.sum()),
+        "failed": int(failed.sum()),
+        "labeled": int(labeled.sum()),
+        "inference_mode": model_service.get_inference_mode(),
+        "voting_method": prediction_service.aggregator.method,
+        "batch_size": args.batch_size,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_images_per_sec": round(int(evaluated.sum()) / elapsed, 2) if elapsed else 0.0,
+        # input_wait cao -> decode / resize là bottleneck (tăng --parallel-calls / --prefetch)
+        "input_wait_s": round(input_wait, 2),
+        "inference_s": round(inference_time, 2),
+        "model_names": model_names,
+        "model_errors": model_errors,
+        "output": str(output),
+    }
+    if labeled.any():
+        model_predictions = np.nan_to_num(probabilities[labeled]).argmax(axis=2)  # (N, num_models)
+        report["model_accuracy"] = {
+            model_name: round(float(np.mean(model_predictions[:, position] == labels[labeled])), 4)
+            for position, model_name in enumerate(model_names)
+        }
+        report["ensemble_accuracy"] = round(float(np.mean(ensemble_prediction[labeled] == labels[labeled])), 4)
+        support = confusion.sum(axis=1)
+        report["class_accuracy"] = {
+            name: round(float(confusion[index, index] / support[index]), 4)
+            for index, name in enumerate(class_names) if support[index]
+        }
+        report["top_confusions"] = top_confusions(confusion, class_names)
+        report["confusion_matrix"] = {"labels": class_names, "matrix": confusion.tolist()}
+
+        if args.weights_output:
+            complete = ~np.isnan(probabilities[labeled]).any(axis=(1, 2))
+            weights = learn_weights(model_names, probabilities[labeled][complete], labels[labeled][complete])
+            Path(args.weights_output).write_text(json.dumps(weights, indent=2), encoding="utf-8")
+            report["learned_weights"] = weights
+            print(f"⚖️  Ensemble weights saved to {args.weights_output}: {weights}")
+    elif args.weights_output:
+        print("⚠️  No labeled images (<class_name>/*.jpg), skipping --weights-output")
+    return report
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(evaluate(args))
+    report_path = Path(args.report) if args.report else Path(args.output).with_suffix(".json")
+    report_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    summary = {key: value for key, value in report.items() if key not in ("confusion_matrix", "class_accuracy")}
+    print(json.dumps(summary, indent=2))
+    print(f"📊 Report saved to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
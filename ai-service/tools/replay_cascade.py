@@ -0,0 +1,153 @@
+"""
+Replay Cascade - So sánh cascade mode với full ensemble trên một thư mục ảnh
+
+Chạy từ thư mục ai-service:
+
+    python -m tools.replay_cascade --images data/replay --margin 0.5 --min-models 2
+
+Mỗi ảnh được chạy cả 2 mode (full + cascade) trên cùng các model đã load. Report gồm
+latency trung bình / p95 của từng mode, latency tiết kiệm được, tỷ lệ cascade trả
+về cùng best_match với full ensemble và số model trung bình đã chạy. Nếu thư mục
+có layout <class_name>/*.jpg thì tính thêm accuracy của từng mode.
+"""
+
+from typing import Dict, List, Optional
+from collections import Counter
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+from PIL import Image
+
+from services.model_service import ModelService
+from services.prediction_service import PredictionService
+from utils.dataset import list_images, list_labeled_images
+from utils.image_processor import ImageProcessor
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay images through full vs cascade ensemble")
+    parser.add_argument("--images", required=True, help="Thư mục ảnh (phẳng hoặc <class_name>/*.jpg)")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--order", nargs="+", default=None, help="Thứ tự cascade (mặc định CASCADE_ORDER)")
+    parser.add_argument("--min-models", type=int, default=None)
+    parser.add_argument("--margin", type=float, default=None)
+    parser.add_argument("--report", default=None, help="Ghi report JSON ra file")
+    return parser.parse_args()
+
+
+async def timed_predict(
+    prediction_service: PredictionService,
+    model_service: ModelService,
+    image_processor: ImageProcessor,
+    path: Path,
+    mode: str,
+):
+    models, inference_fns = await model_service.acquire_models()
+    with Image.open(path) as image:
+        start = time.perf_counter()
+        predictions = await prediction_service.predict_all_models(
+            image,
+            models,
+            image_processor,
+            inference_fns=inference_fns,
+            mode=mode,
+        )
+        voting_result = prediction_service.vote(predictions)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    return voting_result["prediction"], list(predictions.keys()), elapsed_ms
+
+
+def summarize_latency(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "mean_ms": round(float(np.mean(latencies)), 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+    }
+
+
+async def replay(args) -> Dict:
+    # Cascade cần từng model riêng
+    model_service = ModelService(fused=False)
+    await model_service.load_all_models()
+
+    # Tắt micro-batching: replay chạy tuần tự, chỉ đo latency của từng request
+    prediction_service = PredictionService(enable_batching=False)
+    prediction_service.set_class_names(model_service.class_names)
+    if args.order:
+        prediction_service.cascade_order = args.order
+    if args.min_models is not None:
+        prediction_service.cascade_min_models = args.min_models
+    if args.margin is not None:
+        prediction_service.cascade_margin = args.margin
+    image_processor = ImageProcessor()
+
+    root = Path(args.images)
+    labels: Optional[List[int]] = None
+    samples = list_labeled_images(root, model_service.class_names, limit=args.limit)
+    if samples:
+        paths = [path for path, _ in samples]
+        labels = [label for _, label in samples]
+    else:
+        paths = list_images(root, limit=args.limit)
+    if not paths:
+        raise SystemExit(f"No images found in {root}")
+    print(f"📋 Replaying {len(paths)} images")
+
+    full_latencies, cascade_latencies = [], []
+    agreements, models_run = [], Counter()
+    full_correct = cascade_correct = 0
+    model_usage = Counter()
+
+    for index, path in enumerate(paths):
+        full_label, _, full_ms = await timed_predict(
+            prediction_service, model_service, image_processor, path, "full"
+        )
+        cascade_label, ran, cascade_ms = await timed_predict(
+            prediction_service, model_service, image_processor, path, "cascade"
+        )
+        full_latencies.append(full_ms)
+        cascade_latencies.append(cascade_ms)
+        agreements.append(full_label == cascade_label)
+        models_run[len(ran)] += 1
+        model_usage.update(ran)
+
+        if labels is not None:
+            expected = model_service.class_names[labels[index]]
+            full_correct += full_label == expected
+            cascade_correct += cascade_label == expected
+
+    full_mean = float(np.mean(full_latencies))
+    cascade_mean = float(np.mean(cascade_latencies))
+    report = {
+        "images": len(paths),
+        "cascade_order": prediction_service.cascade_order,
+        "cascade_min_models": prediction_service.cascade_min_models,
+        "cascade_margin": prediction_service.cascade_margin,
+        "full": summarize_latency(full_latencies),
+        "cascade": summarize_latency(cascade_latencies),
+        "latency_saved_pct": round(100 * (1 - cascade_mean / full_mean), 2) if full_mean else 0.0,
+        "agreement_with_full": round(float(np.mean(agreements)), 4),
+        "avg_models_run": round(sum(count * n for count, n in models_run.items()) / len(paths), 3),
+        "models_run_histogram": {str(count): n for count, n in sorted(models_run.items())},
+        "model_usage": dict(model_usage),
+    }
+    if labels is not None:
+        report["full"]["accuracy"] = round(full_correct / len(paths), 4)
+        report["cascade"]["accuracy"] = round(cascade_correct / len(paths), 4)
+    return report
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(replay(args))
+    print(json.dumps(report, indent=2))
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"📊 Report saved to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Tune Runtime - Self-benchmark chọn số intra-op / inter-op threads của TensorFlow cho host
+
+Chạy từ thư mục ai-service:
+
+    python -m tools.tune_runtime
+    python -m tools.tune_runtime --candidates 8x1 8x2 4x2 2x5 --compare-onednn
+    python -m tools.tune_runtime --real-models --iterations 20
+
+Số thread chỉ set được trước khi TF runtime khởi tạo nên mỗi thread split chạy trong
+một subprocess riêng: 5 model chạy song song như một request /predict (latency: p50
+thời gian tới khi model chậm nhất xong), sau đó --concurrency request đồng thời
+(throughput: ảnh / giây), kèm peak RSS của process. Mặc định workload là 5 model nhỏ
+(MobileNetV2, cùng kích thước input với ensemble) để chạy nhanh lúc startup;
+--real-models dùng file model thật trong MODELS_DIR.
+
+Kết quả (RUNTIME_TUNING_PATH, mặc định models/runtime_tuning.json) được RUNTIME_PROFILE=auto
+đọc lúc startup; split tốt nhất theo từng objective (latency / throughput).
+--compare-onednn chạy lại split tốt nhất với oneDNN bật / tắt để đo chênh lệch latency và RAM.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+from utils.runtime import AI_SERVICE_DIR, CONCURRENT_MODELS, available_cpus, host_key, tuning_path
+
+
+RESULT_PREFIX = "TUNE_RESULT "
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pick the best TensorFlow thread split for this host")
+    parser.add_argument("--output", default=None, help="File JSON kết quả (mặc định RUNTIME_TUNING_PATH)")
+    parser.add_argument("--candidates", nargs="+", default=None, help="Các split INTRAxINTER, vd. 8x1 4x2")
+    parser.add_argument("--iterations", type=int, default=10, help="Số request đo mỗi phase")
+    parser.add_argument("--concurrency", type=int, default=4, help="Số request đồng thời khi đo throughput")
+    parser.add_argument("--real-models", action="store_true", help="Dùng model thật trong MODELS_DIR")
+    parser.add_argument("--compare-onednn", action="store_true", help="Đo split tốt nhất với oneDNN bật và tắt")
+    parser.add_argument("--timeout", type=int, default=600, help="Timeout (giây) mỗi candidate")
+    parser.add_argument("--run-candidate", nargs=2, type=int, metavar=("INTRA", "INTER"), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def default_candidates(cpus: int) -> List[Tuple[int, int]]:
+    """Các split quanh hai profile: mọi core cho một op <-> chia core cho các model chạy song song"""
+    intra_values = sorted({cpus, max(1, cpus // 2), max(1, cpus // CONCURRENT_MODELS)}, reverse=True)
+    inter_values = sorted({1, min(2, cpus), min(CONCURRENT_MODELS, cpus)})
+    return [(intra, inter) for intra in intra_values for inter in inter_values if intra * inter <= 2 * cpus]
+
+
+def build_workload(real_models: bool) -> List[Tuple[str, Any, int]]:
+    """[(tên, inference callable, input size)] - callable đã compile (tf.function) như khi serve"""
+    import asyncio
+    import tensorflow as tf
+    from services.model_service import MODEL_INPUT_SIZES, CompiledInference, ModelService
+
+    if real_models:
+        model_service = ModelService(num_workers=0, lazy_loading=False, serving_mode="ensemble")
+        asyncio.run(model_service.load_all_models())
+        return [
+            (name, model_service.inference_fns.get(name, model), model_service.get_input_size(name))
+            for name, model in model_service.models.items()
+        ]
+
+    workload = []
+    for name, size in MODEL_INPUT_SIZES.items():
+        model = tf.keras.applications.MobileNetV2(alpha=0.35, weights=None, input_shape=(size, size, 3), classes=30)
+        fn = CompiledInference(name, model, size)
+        fn.warmup()
+        workload.append((name, fn, size))
+    return workload
+
+
+def run_candidate(intra: int, inter: int, iterations: int, concurrency: int, real_models: bool) -> Dict[str, Any]:
+    """Đo một thread split trong process hiện tại (TF chưa được khởi tạo)"""
+    from utils.runtime import configure_runtime
+    import resource
+
+    configure_runtime(intra, inter)
+    workload = build_workload(real_models)
+    inputs = {size: np.random.default_rng(0).random((1, size, size, 3), dtype=np.float32)
+              for size in {size for _, _, size in workload}}
+    executor = ThreadPoolExecutor(max_workers=len(workload) * concurrency)
+
+    def predict_once() -> float:
+        start = time.perf_counter()
+        futures = [executor.submit(fn, inputs[size]) for _, fn, size in workload]
+        for future in futures:
+            future.result()
+        return (time.perf_counter() - start) * 1000
+
+    predict_once()  # warm-up
+    latencies = [predict_once() for _ in range(iterations)]
+
+    def request_loop(count: int):
+        for _ in range(count):
+            predict_once()
+
+    per_loop = max(1, iterations // concurrency)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as loops:
+        list(loops.map(request_loop, [per_loop] * concurrency))
+    wall = time.perf_counter() - start
+    executor.shutdown()
+
+    return {
+        "intra_op_threads": intra,
+        "inter_op_threads": inter,
+        "latency_p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "latency_p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "throughput_images_per_sec": round(per_loop * concurrency / wall, 2),
+        # ru_maxrss: KB trên Linux
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def spawn_candidate(intra: int, inter: int, args, onednn: bool) -> Optional[Dict[str, Any]]:
+    """Chạy một candidate trong subprocess mới (TF runtime riêng)"""
+    command = [
+        sys.executable, "-m", "tools.tune_runtime",
+        "--run-candidate", str(intra), str(inter),
+        "--iterations", str(args.iterations),
+        "--concurrency", str(args.concurrency),
+    ]
+    if args.real_models:
+        command.append("--real-models")
+    env = {
+        **os.environ,
+        "RUNTIME_PROFILE": "default",
+        "TF_ENABLE_ONEDNN_OPTS": "1" if onednn else "0",
+        "TF_CPP_MIN_LOG_LEVEL": "2",
+    }
+    try:
+        completed = subprocess.run(
+            command, cwd=AI_SERVICE_DIR, env=env, capture_output=True, text=True, timeout=args.timeout
+        )
+    except subprocess.TimeoutExpired:
+        print(f"   ⚠️  {intra}x{inter}: timed out")
+        return None
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    print(f"   ⚠️  {intra}x{inter} failed: {completed.stderr.strip().splitlines()[-1:] or completed.returncode}")
+    return None
+
+
+def main():
+    args = parse_args()
+    if args.run_candidate:
+        result = run_candidate(*args.run_candidate, args.iterations, args.concurrency, args.real_models)
+        print(RESULT_PREFIX + json.dumps(result))
+        return
+
+    onednn = os.environ.get("TF_ENABLE_ONEDNN_OPTS", "0") not in ("0", "false")
+    cpus = available_cpus()
+    candidates = (
+        [tuple(int(value) for value in candidate.lower().split("x")) for candidate in args.candidates]
+        if args.candidates else default_candidates(cpus)
+    )
+    print(f"🧵 Tuning {len(candidates)} thread splits on {cpus} CPUs (oneDNN {'on' if onednn else 'off'})")
+
+    results = []
+    for intra, inter in candidates:
+        result = spawn_candidate(intra, inter, args, onednn)
+        if result is None:
+            continue
+        results.append(result)
+        print(f"   {intra:>3} x {inter:<3} p50 {result['latency_p50_ms']:8.1f} ms  "
+              f"{result['throughput_images_per_sec']:7.2f} img/s  RSS {result['max_rss_mb']:.0f} MB")
+    if not results:
+        raise SystemExit("No candidate finished")
+
+    best = {
+        "latency": min(results, key=lambda result: result["latency_p50_ms"]),
+        "throughput": max(results, key=lambda result: result["throughput_images_per_sec"]),
+    }
+    report: Dict[str, Any] = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "host": host_key(onednn),
+        "workload": "real" if args.real_models else "mobilenet_v2_x5",
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+        "candidates": results,
+        "best": best,
+    }
+
+    if args.compare_onednn:
+        reference = best["latency"]
+        flipped = spawn_candidate(reference["intra_op_threads"], reference["inter_op_threads"], args, not onednn)
+        if flipped is not None:
+            on, off = (reference, flipped) if onednn else (flipped, reference)
+            report["onednn_tradeoff"] = {
+                "intra_op_threads": reference["intra_op_threads"],
+                "inter_op_threads": reference["inter_op_threads"],
+                "latency_p50_ms": {"on": on["latency_p50_ms"], "off": off["latency_p50_ms"]},
+                "throughput_images_per_sec": {
+                    "on": on["throughput_images_per_sec"], "off": off["throughput_images_per_sec"]
+                },
+                "max_rss_mb": {"on": on["max_rss_mb"], "off": off["max_rss_mb"]},
+            }
+            print(f"🧪 oneDNN on vs off: p50 {on['latency_p50_ms']:.1f} / {off['latency_p50_ms']:.1f} ms, "
+                  f"RSS {on['max_rss_mb']:.0f} / {off['max_rss_mb']:.0f} MB")
+
+    output = Path(args.output) if args.output else tuning_path()
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"✅ Best latency split {best['latency']['intra_op_threads']}x{best['latency']['inter_op_threads']}, "
+          f"best throughput split {best['throughput']['intra_op_threads']}x{best['throughput']['inter_op_threads']} "
+          f"-> {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Archive helpers - Giải nén ảnh từ file zip / tar (kể cả .tar.gz) trong RAM
+"""
+
+from typing import IO, List, Optional, Tuple
+from pathlib import PurePosixPath
+import io
+import tarfile
+import zipfile
+
+from utils.dataset import IMAGE_EXTENSIONS
+from utils.image_processor import InvalidImageError
+
+
+# Đọc từng đoạn để không tin kích thước trong header (zip bomb có thể khai sai)
+_READ_CHUNK_BYTES = 1024 * 1024
+
+
+def is_archive(data: bytes) -> bool:
+    """Nhận diện zip / tar / tar.gz theo nội dung (không dựa vào tên file)"""
+    if data[:4] == b"PK\x03\x04":
+        return True
+    if data[:2] == b"\x1f\x8b":  # gzip -> thường là .tar.gz
+        return True
+    return len(data) > 262 and data[257:262] == b"ustar"
+
+
+def _is_image_name(name: str) -> bool:
+    path = PurePosixPath(name)
+    # Bỏ file ẩn / metadata của macOS (__MACOSX/._xxx.jpg)
+    if any(part.startswith(".") or part == "__MACOSX" for part in path.parts):
+        return False
+    return path.suffix.lower() in IMAGE_EXTENSIONS
+
+
+def extract_images(
+    data: bytes,
+    max_files: Optional[int] = None,
+    max_file_bytes: Optional[int] = None,
+    max_total_bytes: Optional[int] = None,
+) -> List[Tuple[str, bytes]]:
+    """
+    Đọc các file ảnh trong archive, sắp xếp theo tên.
+
+    Args:
+        max_file_bytes: kích thước giải nén tối đa của một ảnh (giới hạn upload một ảnh)
+        max_total_bytes: tổng kích thước giải nén tối đa của các ảnh trong archive
+
+    Returns:
+        [(tên file trong archive, bytes)]
+
+    Raises:
+        InvalidImageError: ảnh / tổng dung lượng giải nén vượt giới hạn (413)
+        ValueError: archive hỏng / không đọc được hoặc có quá max_files ảnh
+    """
+    images: List[Tuple[str, bytes]] = []
+    total_bytes = 0
+
+    def add(name: str, declared_size: int, open_member):
+        nonlocal total_bytes
+        if max_files is not None and len(images) >= max_files:
+            raise ValueError(f"Archive contains more than {max_files} images")
+        # Kiểm tra theo header trước khi giải nén, sau đó vẫn đếm byte thật khi đọc
+        limit = max_file_bytes
+        if max_total_bytes is not None:
+            remaining = max_total_bytes - total_bytes
+            limit = remaining if limit is None else min(limit, remaining)
+        content = None
+        if limit is None or declared_size <= limit:
+            with open_member() as member_file:
+                content = _read_limited(member_file, limit)
+        if content is None:
+            if limit == max_file_bytes:
+                raise InvalidImageError(
+                    f"Image too large in archive: {name} (> {max_file_bytes} bytes uncompressed)", status_code=413
+                )
+            raise InvalidImageError(
+                f"Archive too large: uncompressed images exceed {max_total_bytes} bytes", status_code=413
+            )
+        total_bytes += len(content)
+        images.append((name, content))
+
+    try:
+        if data[:4] == b"PK\x03\x04":
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and _is_image_name(info.filename):
+                        add(info.filename, info.file_size, lambda info=info: archive.open(info))
+        else:
+            # "r:*" tự nhận tar thường / gzip / bz2 / xz
+            with tarfile.open(fileobj=io.BytesIO(data), mode="r:*") as archive:
+                for member in archive:
+                    if member.isfile() and _is_image_name(member.name):
+                        add(member.name, member.size, lambda member=member: archive.extractfile(member))
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        raise ValueError(f"Invalid archive: {e}") from e
+
+    images.sort(key=lambda item: item[0])
+    return images
+
+
+def _read_limited(member_file: IO[bytes], limit: Optional[int]) -> Optional[bytes]:
+    """Đọc file theo từng đoạn; None nếu nội dung dài hơn limit (không đọc hết file)"""
+    chunks = []
+    size = 0
+    while True:
+        chunk = member_file.read(_READ_CHUNK_BYTES)
+        if not chunk:
+            return b"".join(chunks)
+        size += len(chunk)
+        if limit is not None and size > limit:
+            return None
+        chunks.append(chunk)
+
@@ -0,0 +1,57 @@
+"""
+Config helpers - Đọc cấu hình runtime từ biến môi trường
+"""
+
+import os
+from typing import List, Optional
+
+
+_TRUE_VALUES = {"1", "true", "yes", "on"}
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    """Đọc biến môi trường dạng bool (1/true/yes/on)"""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in _TRUE_VALUES
+
+
+def env_int(name: str, default: int) -> int:
+    """Đọc biến môi trường dạng int, fallback về default nếu không hợp lệ"""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"⚠️  Invalid int for {name}={value!r}, using default {default}")
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """Đọc biến môi trường dạng float, fallback về default nếu không hợp lệ"""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        print(f"⚠️  Invalid float for {name}={value!r}, using default {default}")
+        return default
+
+
+def env_str(name: str, default: str = "") -> str:
+    """Đọc biến môi trường dạng string (đã strip)"""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip()
+
+
+def env_list(name: str, default: Optional[List[str]] = None) -> List[str]:
+    """Đọc biến môi trường dạng danh sách phân cách bởi dấu phẩy"""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return list(default or [])
+    return [item.strip() for item in value.split(",") if item.strip()]
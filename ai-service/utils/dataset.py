@@ -0,0 +1,51 @@
+"""
+Dataset helpers - Liệt kê ảnh trong thư mục dataset cho các tools offline
+"""
+
+from typing import List, Optional, Sequence, Tuple
+from pathlib import Path
+
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif"}
+
+
+def list_images(root: Path, limit: Optional[int] = None) -> List[Path]:
+    """Liệt kê (đệ quy) tất cả file ảnh trong thư mục, sắp xếp theo tên"""
+    paths = sorted(
+        path for path in Path(root).rglob("*")
+        if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS
+    )
+    return paths[:limit] if limit else paths
+
+
+def list_labeled_images(
+    root: Path,
+    class_names: Sequence[str],
+    limit: Optional[int] = None,
+) -> List[Tuple[Path, int]]:
+    """
+    Liệt kê ảnh có nhãn theo layout `root/<class_name>/*.jpg`.
+    Thư mục không có trong class_names bị bỏ qua.
+
+    Returns:
+        [(đường dẫn ảnh, class index)]
+    """
+    class_index = {name: idx for idx, name in enumerate(class_names)}
+    samples = []
+    skipped = []
+    for class_dir in sorted(Path(root).iterdir()):
+        if not class_dir.is_dir():
+            continue
+        if class_dir.name not in class_index:
+            skipped.append(class_dir.name)
+            continue
+        for path in list_images(class_dir):
+            samples.append((path, class_index[class_dir.name]))
+
+    if skipped:
+        print(f"⚠️  Skipping unknown class folders: {', '.join(skipped)}")
+    if limit and len(samples) > limit:
+        # Lấy mẫu cách đều để vẫn phủ đủ các class
+        step = len(samples) / limit
+        samples = [samples[int(i * step)] for i in range(limit)]
+    return samples
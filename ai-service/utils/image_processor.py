@@ -2,16 +2,81 @@
 Image Processor - Xử lý và preprocess ảnh trước khi đưa vào models
 """
 
-from PIL import Image
+from typing import Any, Dict, Iterable, Optional
+from PIL import Image, UnidentifiedImageError
+import io
+import time
 import numpy as np
 import tensorflow as tf
 
+from utils.config import env_bool, env_int
+
+
+# Các format nhận từ client (MPO = JPEG nhiều ảnh của một số điện thoại);
+# Image.init() đăng ký đủ plugins, bỏ format mà bản Pillow không hỗ trợ (vd. thiếu libwebp)
+Image.init()
+ALLOWED_FORMATS = tuple(
+    image_format for image_format in ("JPEG", "MPO", "PNG", "GIF", "WEBP", "BMP")
+    if image_format in Image.OPEN
+)
+
+
+class InvalidImageError(ValueError):
+    """Ảnh không hợp lệ hoặc vượt giới hạn; status_code là mã HTTP API nên trả về"""
+    
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
 
 class ImageProcessor:
     """Service để xử lý ảnh cho Keras models"""
     
-    def __init__(self, image_size: int = 224):
+    def __init__(self, image_size: int = 224, use_jpeg_draft: Optional[bool] = None):
         self.image_size = image_size
+        # JPEG draft mode: để libjpeg downscale ngay trong DCT domain khi decode
+        # (nhanh hơn nhiều với ảnh điện thoại 8-12MP, kết quả lệch nhẹ so với decode full)
+        self.use_jpeg_draft = (
+            use_jpeg_draft if use_jpeg_draft is not None
+            else env_bool("PREPROCESS_JPEG_DRAFT", True)
+        )
+        # Giới hạn kiểm tra trước khi decode (ảnh điện thoại 12MP ~ 3-8 MB)
+        self.max_bytes = env_int("MAX_UPLOAD_BYTES", 20 * 1024 * 1024)
+        self.max_pixels = env_int("MAX_IMAGE_PIXELS", 50_000_000)
+    
+    def check_upload(self, image_bytes: bytes):
+        """Kiểm tra kích thước upload trước khi hash / parse"""
+        if not image_bytes:
+            raise InvalidImageError("Empty image file")
+        if len(image_bytes) > self.max_bytes:
+            raise InvalidImageError(
+                f"Image too large: {len(image_bytes)} bytes > {self.max_bytes} bytes", status_code=413
+            )
+    
+    def open_image(self, image_bytes: bytes) -> Image.Image:
+        """
+        Mở ảnh nhưng chỉ parse header (chưa decode pixel): kiểm tra format và
+        số pixel trước khi tốn CPU decode. Pixel được decode một lần duy nhất
+        trong preprocess_multi (kèm JPEG draft mode).
+        
+        Raises:
+            InvalidImageError: upload rỗng / quá lớn, không phải ảnh, quá nhiều pixel
+        """
+        self.check_upload(image_bytes)
+        try:
+            # BytesIO trên bytes không copy dữ liệu
+            image = Image.open(io.BytesIO(image_bytes), formats=ALLOWED_FORMATS)
+        except (UnidentifiedImageError, OSError, SyntaxError, ValueError) as e:
+            raise InvalidImageError(f"Invalid image format: {e}") from e
+        except Image.DecompressionBombError as e:
+            raise InvalidImageError(f"Image too large: {e}", status_code=413) from e
+        
+        width, height = image.size
+        if width * height > self.max_pixels:
+            raise InvalidImageError(
+                f"Image too large: {width}x{height} pixels > {self.max_pixels} pixels", status_code=413
+            )
+        return image
     
     def preprocess(self, image: Image.Image) -> np.ndarray:
         """
@@ -56,6 +121,68 @@ class ImageProcessor:
         
         return img_array
     
+    def preprocess_multi(
+        self,
+        image: Image.Image,
+        sizes: Iterable[int],
+        timings: Optional[Dict[str, float]] = None,
+        dtype: Any = np.float32,
+    ) -> Dict[int, np.ndarray]:
+        """
+        Preprocess một lần cho nhiều model: decode + convert RGB một lần,
+        resize một lần cho mỗi kích thước khác nhau.
+        Models cùng kích thước input dùng chung một array (không được sửa in-place).
+        
+        Args:
+            image: PIL Image (chưa decode thì có thể dùng JPEG draft mode)
+            sizes: Các kích thước input cần (vd. {224, 299})
+            timings: Nếu có, được ghi thời gian (ms) của "decode" và "preprocess_<size>"
+            dtype: np.float32 (chia 255 ở đây, range [0, 1]) hoặc np.uint8 (pixel gốc,
+                model chia 255 trong graph - array nhỏ hơn 4 lần, không cấp phát float)
+        
+        Returns:
+            {size: numpy array shape (1, size, size, 3)}
+        """
+        sizes = sorted(set(sizes), reverse=True)
+        if not sizes:
+            return {}
+        
+        if self.use_jpeg_draft and image.format == "JPEG":
+            try:
+                # Chỉ có tác dụng trước khi ảnh được decode (load)
+                image.draft("RGB", (sizes[0], sizes[0]))
+            except Exception:
+                pass
+        
+        # Decode + convert RGB một lần duy nhất
+        start = time.perf_counter()
+        try:
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            else:
+                image.load()
+        except (OSError, SyntaxError, ValueError) as e:
+            # Ảnh bị cắt cụt / hỏng: header hợp lệ nhưng dữ liệu pixel không decode được
+            raise InvalidImageError(f"Invalid image data: {e}") from e
+        
+        if timings is not None:
+            timings["decode"] = (time.perf_counter() - start) * 1000
+        
+        arrays = {}
+        for size in sizes:
+            start = time.perf_counter()
+            resized = image.resize((size, size), Image.Resampling.LANCZOS)
+            if dtype == np.uint8:
+                img_array = np.asarray(resized, dtype=np.uint8)
+            else:
+                img_array = np.asarray(resized, dtype=np.float32)
+                img_array /= 255.0
+            arrays[size] = img_array[np.newaxis]
+            if timings is not None:
+                timings[f"preprocess_{size}"] = (time.perf_counter() - start) * 1000
+        
+        return arrays
+    
     def resize(self, image: Image.Image, max_size: int = 1024) -> Image.Image:
         """
         Resize ảnh để tối ưu băng thông.
@@ -0,0 +1,234 @@
+"""
+Runtime config - Cấu hình TensorFlow CPU runtime (oneDNN, intra/inter-op threads) theo
+deployment profile. configure_runtime() phải chạy trước khi import TensorFlow: các biến
+môi trường của TF chỉ được đọc lúc import, số thread chỉ set được trước op đầu tiên.
+"""
+
+from typing import Any, Dict, Optional, Tuple
+from pathlib import Path
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+from utils.config import env_bool, env_int, env_str
+
+
+# default: thread do TF tự chọn, tắt oneDNN (ít RAM nhất)
+# latency: mỗi op dùng mọi core, ít op chạy song song -> một request xong nhanh nhất
+# throughput: chia core cho các model chạy đồng thời -> nhiều request / giây nhất
+# auto: self-benchmark (tools/tune_runtime.py) chọn thread split tốt nhất cho host, cache lại
+RUNTIME_PROFILES = ("default", "latency", "throughput", "auto")
+
+# Số model chạy đồng thời trong một request (ensemble)
+CONCURRENT_MODELS = 5
+
+# Giá trị mặc định của micro-batching theo profile (env đặt tường minh vẫn được ưu tiên)
+PROFILE_ENV_DEFAULTS = {
+    "latency": {"BATCH_MAX_WAIT_MS": "2"},
+    "throughput": {"BATCH_MAX_SIZE": "16", "BATCH_MAX_WAIT_MS": "10"},
+}
+
+AI_SERVICE_DIR = Path(__file__).resolve().parents[1]
+
+_state: Dict[str, Any] = {}
+
+
+def available_cpus() -> int:
+    """Số CPU process được phép dùng (theo affinity / cgroup cpuset nếu có)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def profile_threads(profile: str, cpus: int, concurrent_models: int = CONCURRENT_MODELS) -> Tuple[int, int]:
+    """(intra_op_threads, inter_op_threads) của một profile trên host có `cpus` core"""
+    if profile == "throughput":
+        inter = max(1, min(concurrent_models, cpus))
+        return max(1, cpus // inter), inter
+    # latency
+    return cpus, min(2, cpus)
+
+
+def host_key(onednn: bool) -> Dict[str, Any]:
+    """Định danh host cho cache kết quả tuning (đổi CPU / TF version / oneDNN thì tune lại)"""
+    from importlib.metadata import PackageNotFoundError, version
+
+    tf_version = None
+    for package in ("tensorflow", "tensorflow-cpu", "tensorflow-intel"):
+        try:
+            tf_version = version(package)
+            break
+        except PackageNotFoundError:
+            continue
+    return {
+        "cpus": available_cpus(),
+        "machine": platform.machine(),
+        "processor": platform.processor() or None,
+        "tensorflow": tf_version,
+        "onednn": onednn,
+    }
+
+
+def tuning_path() -> Path:
+    return Path(env_str("RUNTIME_TUNING_PATH", str(Path(env_str("MODELS_DIR", "models")) / "runtime_tuning.json")))
+
+
+def load_tuning(path: Path, objective: str, onednn: bool) -> Optional[Dict[str, Any]]:
+    """Kết quả tuning đã cache nếu khớp host + objective hiện tại"""
+    if not path.exists():
+        return None
+    try:
+        tuning = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Error reading {path}: {e}")
+        return None
+    if tuning.get("host") != host_key(onednn) or objective not in tuning.get("best", {}):
+        return None
+    return tuning
+
+
+def run_self_benchmark(path: Path, objective: str, onednn: bool) -> Optional[Dict[str, Any]]:
+    """
+    Chạy tools.tune_runtime trong subprocess (mỗi thread split cần một TF runtime mới,
+    process hiện tại chưa được import TF) và đọc kết quả đã ghi ra `path`.
+    """
+    timeout = env_int("RUNTIME_TUNING_TIMEOUT", 600)
+    print(f"⏱️  Runtime self-benchmark ({objective}, oneDNN {'on' if onednn else 'off'}), up to {timeout}s...")
+    env = {**os.environ, "RUNTIME_PROFILE": "default", "TF_ENABLE_ONEDNN_OPTS": "1" if onednn else "0"}
+    try:
+        subprocess.run(
+            [sys.executable, "-m", "tools.tune_runtime", "--output", str(path)],
+            cwd=AI_SERVICE_DIR,
+            env=env,
+            timeout=timeout,
+            check=True,
+        )
+    except (subprocess.SubprocessError, OSError) as e:
+        print(f"⚠️  Runtime self-benchmark failed: {e}")
+        return None
+    return load_tuning(path, objective, onednn)
+
+
+def start_background_tuning(path: Path, objective: str, onednn: bool) -> Dict[str, Any]:
+    """
+    Chạy self-benchmark trong background thread: process hiện tại phục vụ ngay với
+    profile fallback (số thread không đổi được sau khi TF đã chạy op), kết quả được
+    cache và áp dụng ở lần khởi động sau.
+
+    Returns:
+        Trạng thái job (cập nhật tại chỗ khi benchmark xong) cho /health
+    """
+    job: Dict[str, Any] = {"state": "running", "started_at": round(time.time(), 3)}
+
+    def run():
+        tuning = run_self_benchmark(path, objective, onednn)
+        job.update(state="done" if tuning is not None else "failed", finished_at=round(time.time(), 3))
+        if tuning is not None:
+            print(f"✅ Runtime tuning saved to {path}, applied on next start")
+
+    threading.Thread(target=run, name="runtime-tuning", daemon=True).start()
+    return job
+
+
+def configure_runtime(
+    intra_op_threads: Optional[int] = None,
+    inter_op_threads: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Áp dụng RUNTIME_PROFILE (một lần mỗi process). Thứ tự ưu tiên của số thread:
+    tham số (vd. worker process) > TF_INTRA_OP_THREADS / TF_INTER_OP_THREADS > profile.
+
+    Returns:
+        Cấu hình đã áp dụng (cho /health)
+    """
+    if _state and intra_op_threads is None and inter_op_threads is None:
+        return _state
+
+    profile = env_str("RUNTIME_PROFILE", "default").lower()
+    if profile not in RUNTIME_PROFILES:
+        print(f"⚠️  Unknown RUNTIME_PROFILE={profile}, falling back to default")
+        profile = "default"
+
+    # oneDNN nhanh hơn trên CPU x86 nhưng tốn thêm RAM cho weights đã reorder + primitive cache;
+    # profile default giữ tắt như trước, các profile tối ưu tốc độ bật (TF_ENABLE_ONEDNN_OPTS ghi đè)
+    os.environ.setdefault("TF_FORCE_GPU_ALLOW_GROWTH", "true")
+    os.environ.setdefault("TF_ENABLE_ONEDNN_OPTS", "0" if profile == "default" else "1")
+    onednn = os.environ["TF_ENABLE_ONEDNN_OPTS"] not in ("0", "false")
+    if "tensorflow" in sys.modules:
+        print("⚠️  TensorFlow was imported before configure_runtime(); TF_ENABLE_ONEDNN_OPTS may have no effect")
+
+    cpus = available_cpus()
+    intra = intra_op_threads or env_int("TF_INTRA_OP_THREADS", 0) or None
+    inter = inter_op_threads or env_int("TF_INTER_OP_THREADS", 0) or None
+    source = "explicit" if intra or inter else profile
+    tuning = None
+    tuning_job = None
+    if source == "auto":
+        objective = env_str("RUNTIME_TUNING_OBJECTIVE", "latency").lower()
+        if objective not in ("latency", "throughput"):
+            print(f"⚠️  Unknown RUNTIME_TUNING_OBJECTIVE={objective}, falling back to latency")
+            objective = "latency"
+        path = tuning_path()
+        tuning = load_tuning(path, objective, onednn)
+        source = "cache"
+        if tuning is not None:
+            intra, inter = tuning["best"][objective]["intra_op_threads"], tuning["best"][objective]["inter_op_threads"]
+        else:
+            # Không benchmark đồng bộ: configure_runtime chạy lúc import main, trước khi server
+            # bind port, /health phải trả lời ngay như khi models load trong background
+            print(f"⚠️  No runtime tuning available, using the {objective} profile")
+            source = "fallback"
+            intra, inter = profile_threads(objective, cpus)
+            if env_bool("RUNTIME_TUNING_ON_STARTUP", True):
+                tuning_job = start_background_tuning(path, objective, onednn)
+        profile_defaults = PROFILE_ENV_DEFAULTS.get(objective, {})
+    else:
+        profile_defaults = PROFILE_ENV_DEFAULTS.get(profile, {})
+        if source in ("latency", "throughput"):
+            intra, inter = profile_threads(source, cpus)
+
+    for name, value in profile_defaults.items():
+        os.environ.setdefault(name, value)
+
+    if intra or inter:
+        import tensorflow as tf
+        try:
+            if intra:
+                tf.config.threading.set_intra_op_parallelism_threads(intra)
+            if inter:
+                tf.config.threading.set_inter_op_parallelism_threads(inter)
+        except RuntimeError as e:
+            # TF runtime đã khởi tạo (đã chạy op) -> giữ nguyên số thread hiện tại
+            print(f"⚠️  Could not set TensorFlow threads: {e}")
+
+    _state.clear()
+    _state.update({
+        "profile": profile,
+        "source": source,
+        "cpus": cpus,
+        "intra_op_threads": intra,
+        "inter_op_threads": inter,
+        "onednn": onednn,
+    })
+    if tuning is not None:
+        _state["tuning"] = {
+            "path": str(tuning_path()),
+            "created_at": tuning.get("created_at"),
+            "best": tuning.get("best"),
+            "onednn_tradeoff": tuning.get("onednn_tradeoff"),
+        }
+    if tuning_job is not None:
+        _state["tuning_job"] = tuning_job
+    if profile != "default" or source == "explicit":
+        print(f"🧵 Runtime: profile {profile} ({source}), intra-op {intra or 'auto'}, "
+              f"inter-op {inter or 'auto'}, oneDNN {'on' if onednn else 'off'}, {cpus} CPUs")
+    return _state
+
+
+def get_runtime_stats() -> Dict[str, Any]:
+    """Cấu hình runtime đã áp dụng cho /health"""
+    return dict(_state)
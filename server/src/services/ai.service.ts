@@ -18,12 +18,29 @@ export interface AIPredictionResponse {
   };
 }
 
+interface AIJobResponse {
+  job_id: string;
+  status: 'queued' | 'running' | 'done' | 'failed';
+  result?: AIPredictionResponse;
+  error?: { status_code: number; detail: string };
+}
+
+// Job mode: gửi ảnh qua POST /jobs rồi poll GET /jobs/{id}, không giữ connection
+// trong lúc AI service chạy ensemble (tránh timeout khi instance cold / quá tải)
+const useJobMode = (): boolean => process.env.AI_SERVICE_JOB_MODE === 'true';
+const getJobTimeoutMs = (): number => Number(process.env.AI_SERVICE_JOB_TIMEOUT_MS || 120000);
+const JOB_POLL_INTERVAL_MS = 500;
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+const AI_REQUEST_TIMEOUT_MS = 30000; // 30 seconds timeout
+
 // Tạo axios client instance
 const getAIClient = (): AxiosInstance => {
   const aiServiceUrl = process.env.AI_SERVICE_URL || 'http://localhost:8000';
   return axios.create({
     baseURL: aiServiceUrl,
-    timeout: 30000, // 30 seconds timeout
+    timeout: AI_REQUEST_TIMEOUT_MS,
   });
 };
 
@@ -45,6 +62,10 @@ export const AIService = {
         filename,
       });
 
+      if (useJobMode()) {
+        return await AIService.predictFoodJob(imageBuffer, filename);
+      }
+
       // Tạo FormData
       const formData = new FormData();
       formData.append('file', imageBuffer, {
@@ -52,7 +73,11 @@ export const AIService = {
         contentType: 'image/jpeg',
       });
 
-      const headers = formData.getHeaders();
+      const headers = {
+        ...formData.getHeaders(),
+        // AI service bỏ request chưa kịp chạy khi client đã timeout, sắp hết giờ thì chạy ít model hơn
+        'X-Request-Timeout-Ms': String(AI_REQUEST_TIMEOUT_MS),
+      };
       console.log('📸 AI Service - FormData headers:', headers);
 
       // Gửi request đến FastAPI service
@@ -90,6 +115,59 @@ export const AIService = {
     }
   },
 
+  /**
+   * Job mode: submit ảnh (POST /jobs) rồi poll kết quả (GET /jobs/{id}).
+   * Queue đầy (429) thì chờ theo Retry-After rồi submit lại, tới khi hết AI_SERVICE_JOB_TIMEOUT_MS.
+   */
+  predictFoodJob: async (
+    imageBuffer: Buffer,
+    filename: string = 'image.jpg',
+  ): Promise<AIPredictionResponse> => {
+    const client = getAIClient();
+    const deadline = Date.now() + getJobTimeoutMs();
+
+    let job: AIJobResponse | undefined;
+    while (!job) {
+      const formData = new FormData();
+      formData.append('file', imageBuffer, { filename, contentType: 'image/jpeg' });
+      const response = await client.post<AIJobResponse>('/jobs', formData as any, {
+        headers: formData.getHeaders(),
+        maxContentLength: Infinity,
+        maxBodyLength: Infinity,
+        validateStatus: (status) => status === 202 || status === 429,
+      });
+      if (response.status === 202) {
+        job = response.data;
+        break;
+      }
+      const retryAfterMs = Number(response.headers['retry-after'] || 1) * 1000;
+      if (Date.now() + retryAfterMs > deadline) {
+        throw new Error('AI service job queue is full');
+      }
+      console.warn(`⏳ AI Service - Job queue full, retrying in ${retryAfterMs} ms`);
+      await sleep(retryAfterMs);
+    }
+    console.log('📸 AI Service - Job submitted:', job.job_id);
+
+    while (job.status === 'queued' || job.status === 'running') {
+      if (Date.now() > deadline) {
+        throw new Error(`AI service job ${job.job_id} timed out`);
+      }
+      await sleep(JOB_POLL_INTERVAL_MS);
+      job = (await client.get<AIJobResponse>(`/jobs/${job.job_id}`)).data;
+    }
+
+    if (job.status === 'failed' || !job.result) {
+      throw new Error(job.error?.detail || `AI service job ${job.job_id} failed`);
+    }
+    console.log('✅ AI Service - Job done:', {
+      jobId: job.job_id,
+      bestMatch: job.result.best_match,
+      confidence: job.result.confidence,
+    });
+    return job.result;
+  },
+
   /**
    * Health check AI service
    */